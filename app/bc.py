@@ -1,9 +1,19 @@
 # Best-effort asynchronous broadcast channel
 
 import asyncio
+import time
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
-from typing import AsyncIterator
+from typing import AsyncIterator, Callable
+
+# An adaptive window is kept at least this many times as long as the receiver
+# took to handle the previous value, e.g. to render a board, so that it spends
+# at most about a tenth of its time doing so.
+_COST_RATIO = 10
+# Weight of the newest sample in the moving averages
+_EWMA_ALPHA = 0.2
+# Receivers that stopped waiting are cleared out of a generation from this many
+_MIN_PURGE_AT = 64
 
 
 # A wrapper class to pass any type of values by reference
@@ -12,40 +22,226 @@ class Slot[T]:
     value: T
 
 
+@dataclass
+class Pacing[T]:
+    """
+    Lets a receiver return at most once per window, merging the values sent in
+    the meantime, while the first value after a quiet spell still returns right
+    away. An `urgent` value ends the wait early.
+
+    An adaptive window doubles, up to `max_window_secs`, whenever more than one
+    value arrived within it, and halves back towards `window_secs` otherwise.
+    It never falls below `_COST_RATIO` times the time taken by the receiver to
+    handle the previous value.
+
+    Times are read from `clock`, which must agree with the running event loop's
+    on how long a timeout lasts, as `asyncio.AbstractEventLoop.time` does.
+    """
+
+    window_secs: float
+    max_window_secs: float
+    adaptive: bool
+    urgent: Callable[[T], bool] = lambda _: False
+    clock: Callable[[], float] = time.monotonic
+
+
+@dataclass
+class BroadcastStats:
+    receivers: int
+    sends: int  # Values sent, including the ones relayed from other workers
+    deliveries: int  # Values returned by the receivers, merged or not
+    min_window_secs: float
+    max_window_secs: float
+    # The most frequently woken receiver, recently
+    max_deliveries_per_sec: float
+
+
+class _Generation[T]:
+    """A value sent to a broadcaster, linked to the one sent right after it."""
+
+    __slots__ = ("number", "value", "next", "waiters", "_purge_at")
+
+    def __init__(self, number: int, value: T):
+        self.number = number
+        self.value = value
+        self.next: _Generation[T] | None = None
+        # The receivers waiting for `next`. Those that stop waiting are left
+        # here, done, until the list has doubled since the last purge.
+        self.waiters: list[asyncio.Future[None]] = []
+        self._purge_at = _MIN_PURGE_AT
+
+    async def wait_next(self) -> "_Generation[T]":
+        if self.next is None:
+            if len(self.waiters) >= self._purge_at:
+                self.waiters = [w for w in self.waiters if not w.done()]
+                self._purge_at = max(2 * len(self.waiters), _MIN_PURGE_AT)
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                waiter.cancel()
+        assert self.next is not None
+        return self.next
+
+
 class Receiver[T]:
-    shared: Slot[T]
-    modified: asyncio.Event
+    def __init__(
+        self,
+        seen: _Generation[T],
+        merge: Callable[[T, T], T] | None,
+        pacing: Pacing[T] | None,
+    ):
+        # Only the generations after this one are kept alive by the receiver
+        self._seen = seen
+        self._merge = merge
+        self._pacing = pacing
+        self._clock = pacing.clock if pacing is not None else time.monotonic
 
-    def __init__(self, slot: Slot[T], modified: asyncio.Event):
-        self.shared = slot
-        self.modified = modified
+        self.window_secs = pacing.window_secs if pacing is not None else 0.0
+        self.deliveries = 0
+        self._delivered_at: float | None = None
+        self._interval_secs = float("inf")  # Between deliveries, on average
+
+    @property
+    def generation(self) -> int:
+        """The number of the last value received, counting from the first sent."""
+        return self._seen.number
 
     async def recv(self) -> T:
-        await self.modified.wait()
-        self.modified.clear()
-        return self.shared.value
+        """
+        The values sent since the last call, merged, or the last one of them
+        when the broadcaster does not merge.
+        """
+        cost_secs = 0.0
+        if self._delivered_at is not None:
+            cost_secs = self._clock() - self._delivered_at
+        await self._seen.wait_next()
+        if self._pacing is not None:
+            await self._hold(self._pacing)
+
+        first = node = await self._seen.wait_next()
+        value = first.value
+        while (following := node.next) is not None:
+            node = following
+            value = (
+                node.value if self._merge is None else self._merge(value, node.value)
+            )
+        self._seen = node
+        self._delivered(node.number - first.number + 1, cost_secs)
+        return value
+
+    async def _hold(self, pacing: Pacing[T]) -> None:
+        if self._delivered_at is None:
+            return
+        deadline = self._delivered_at + self.window_secs
+        node = self._seen
+        while True:
+            while (following := node.next) is not None:
+                node = following
+                if pacing.urgent(node.value):
+                    return
+            if (remaining := deadline - self._clock()) <= 0:
+                return
+            try:
+                async with asyncio.timeout(remaining):
+                    await node.wait_next()
+            except TimeoutError:
+                return
+
+    def _delivered(self, merged: int, cost_secs: float) -> None:
+        now = self._clock()
+        if self._delivered_at is not None:
+            interval = now - self._delivered_at
+            if self._interval_secs == float("inf"):
+                self._interval_secs = interval
+            else:
+                self._interval_secs += _EWMA_ALPHA * (interval - self._interval_secs)
+        self._delivered_at = now
+        self.deliveries += 1
+
+        if (pacing := self._pacing) is None or not pacing.adaptive:
+            return
+        window = self.window_secs * 2 if merged > 1 else self.window_secs / 2
+        window = max(window, cost_secs * _COST_RATIO, pacing.window_secs)
+        self.window_secs = min(window, pacing.max_window_secs)
+
+    @property
+    def deliveries_per_sec(self) -> float:
+        if self._delivered_at is None:
+            return 0.0
+        # Falls off as the receiver stays idle
+        idle_secs = self._clock() - self._delivered_at
+        return 1 / max(self._interval_secs, idle_secs, 1e-9)
 
 
 # A multi-producer multi-consumer channel that can send and receive ephemeral
 # messages. The term "ephemeral" means that producers and consumers do not care
 # if any previously sent messages are dropped. That means, there is no queuing
 # going on in the central broadcaster object.
+#
+# Every value sent starts a new generation, linked from the previous one. Each
+# receiver remembers the last generation it has seen and, once woken, catches
+# up to the latest by merging the values on the way with `merge`, or by taking
+# the last one of them. The broadcaster itself holds on to the latest only, so
+# attaching and detaching a receiver costs the same however many there are.
 class Broadcaster[T]:
     shared: Slot[T]
-    modified_events: list[asyncio.Event] = []
+    receivers: set[Receiver[T]]
+    # Called with every value passed to `send` so that it can be propagated
+    # beyond this process. See `app.relay.Relay`.
+    forward: Callable[[T], None] | None
 
-    def __init__(self, default: T):
+    def __init__(self, default: T, merge: Callable[[T, T], T] | None = None):
         self.shared = Slot(default)
+        self.receivers = set()
+        self.forward = None
+        self._merge = merge
+        self._latest = _Generation(0, default)
+        self._deliveries = 0  # Of the receivers detached so far
+
+    @property
+    def generation(self) -> int:
+        """The number of values sent so far, as counted by the receivers."""
+        return self._latest.number
 
     def send(self, value: T):
-        for modified_event in self.modified_events:
-            modified_event.set()
+        self.send_local(value)
+        if self.forward is not None:
+            self.forward(value)
+
+    def send_local(self, value: T):
+        """Wake up the receivers in this process without forwarding `value`."""
+        prev = self._latest
+        self._latest = prev.next = _Generation(prev.number + 1, value)
         self.shared.value = value
+        # Only after everything is in place for the receivers to read
+        waiters, prev.waiters = prev.waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
 
     @asynccontextmanager
-    async def attach_receiver(self) -> AsyncIterator[Receiver[T]]:
-        modified = asyncio.Event()
-        rx = Receiver(self.shared, modified)
-        self.modified_events.append(modified)
-        yield rx
-        self.modified_events.remove(modified)
+    async def attach_receiver(
+        self, pacing: Pacing[T] | None = None
+    ) -> AsyncIterator[Receiver[T]]:
+        rx = Receiver(self._latest, self._merge, pacing)
+        self.receivers.add(rx)
+        try:
+            yield rx
+        finally:
+            self.receivers.discard(rx)
+            self._deliveries += rx.deliveries
+
+    def stats(self) -> BroadcastStats:
+        windows = [rx.window_secs for rx in self.receivers] or [0.0]
+        return BroadcastStats(
+            receivers=len(self.receivers),
+            sends=self._latest.number,
+            deliveries=self._deliveries + sum(rx.deliveries for rx in self.receivers),
+            min_window_secs=min(windows),
+            max_window_secs=max(windows),
+            max_deliveries_per_sec=max(
+                (rx.deliveries_per_sec for rx in self.receivers), default=0.0
+            ),
+        )
@@ -1,3 +1,78 @@
 import os
 
 DEBUG = True if os.environ.get("MURCHACE_DEBUG") else False
+
+# Unix domain socket shared by the uvicorn workers to relay broadcast messages
+IPC_SOCKET_PATH = os.environ.get("MURCHACE_IPC_SOCKET", "db/murchace.sock")
+# Same as above but for the version of the product catalog
+CATALOG_IPC_SOCKET_PATH = os.environ.get(
+    "MURCHACE_CATALOG_IPC_SOCKET", "db/murchace-catalog.sock"
+)
+# How often each worker checks the version of the catalog in the database
+# itself, in case a version sent over the socket above was lost
+CATALOG_RECHECK_SECS = 5
+
+# Where to keep the carts of register sessions: "database" shares them between
+# the workers and keeps them across restarts, "memory" keeps them per worker.
+SESSION_STORE = os.environ.get("MURCHACE_SESSION_STORE", "database")
+
+# Register sessions untouched for this long are evicted by a periodic sweep, as
+# are the least recently used ones beyond the maximum count.
+SESSION_IDLE_TTL_SECS = int(os.environ.get("MURCHACE_SESSION_IDLE_TTL_SECS", 60 * 60))
+SESSION_MAX_COUNT = int(os.environ.get("MURCHACE_SESSION_MAX_COUNT", 1000))
+SESSION_SWEEP_INTERVAL_SECS = 60
+
+# PRAGMAs applied to every SQLite connection. WAL lets the SSE readers keep
+# going while an order is being written. Override or add entries with a comma
+# separated list, e.g. MURCHACE_SQLITE_PRAGMAS="synchronous=FULL,cache_size=-2000"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # Durable with WAL except on a power loss
+    "mmap_size": str(256 * 1024 * 1024),
+    "cache_size": str(-32 * 1024),  # Negative values are in KiB
+    "busy_timeout": "5000",
+    "temp_store": "MEMORY",
+} | {
+    name.strip(): value.strip()
+    for name, _, value in (
+        pragma.partition("=")
+        for pragma in os.environ.get("MURCHACE_SQLITE_PRAGMAS", "").split(",")
+        if pragma
+    )
+}
+
+# Number of read-only SQLite connections each worker keeps for the order boards
+# and the statistics
+READ_POOL_SIZE = int(os.environ.get("MURCHACE_READ_POOL_SIZE", 4))
+
+# The order boards are refreshed at most once per window on each tablet, with
+# the changes made in the meantime sent together. A new order ends the wait so
+# that the ringtone goes off right away. The adaptive window widens up to the
+# maximum while changes keep coming faster than that or the refreshes take
+# long, and narrows back as they quiet down. See `app.bc.Pacing` and
+# `GET /stat/broadcast`.
+BOARD_REFRESH_WINDOW_SECS = float(
+    os.environ.get("MURCHACE_BOARD_REFRESH_WINDOW_SECS", 0.1)
+)
+BOARD_REFRESH_MAX_WINDOW_SECS = float(
+    os.environ.get("MURCHACE_BOARD_REFRESH_MAX_WINDOW_SECS", 1.0)
+)
+BOARD_REFRESH_ADAPTIVE = os.environ.get("MURCHACE_BOARD_REFRESH_ADAPTIVE", "1") != "0"
+
+# Supply, complete, cancel and reset operations arriving within this window are
+# committed in one transaction and broadcast as one change
+GROUP_COMMIT_WINDOW_SECS = 0.003
+
+# Orders canceled or completed longer ago than this are moved, together with
+# their items, from `db/app.db` to `db/archive.db` every interval, a batch of
+# orders per transaction. `/stat` and the exports still count them.
+ARCHIVE_AFTER_SECS = int(os.environ.get("MURCHACE_ARCHIVE_AFTER_SECS", 24 * 60 * 60))
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_INTERVAL_SECS = 10 * 60
+
+# Online backups of the databases, see `app.store.backup`. Only the newest ones
+# are kept. The pages are copied a step at a time with a pause in between, so
+# that the registers are never held up for longer than a step.
+BACKUP_KEEP = int(os.environ.get("MURCHACE_BACKUP_KEEP", 10))
+BACKUP_PAGES_PER_STEP = 64
+BACKUP_STEP_PAUSE_SECS = 0.001
@@ -1,4 +1,5 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
@@ -6,9 +7,25 @@ from fastapi.staticfiles import StaticFiles
 from htpy import Element, HTMLElement, a, div, p
 
 from .components import page_layout
-from .env import DEBUG
-from .routers import orders, products, register, stat
-from .store import startup_and_shutdown_db
+from .env import (
+    ARCHIVE_INTERVAL_SECS,
+    CATALOG_IPC_SOCKET_PATH,
+    DEBUG,
+    IPC_SOCKET_PATH,
+    SESSION_SWEEP_INTERVAL_SECS,
+)
+from .relay import Relay
+from .routers import admin, orders, products, register, stat
+from .store import (
+    OrderTable,
+    ProductTable,
+    SessionStore,
+    archive,
+    archive_resolved_orders,
+    startup_and_shutdown_db,
+)
+from .store.order import ModifiedFlag
+from .store.session import sweep
 
 
 # https://stackoverflow.com/a/65270864
@@ -17,7 +34,31 @@ from .store import startup_and_shutdown_db
 async def lifespan(_: FastAPI):
     startup_db, shutdown_db = startup_and_shutdown_db
     await startup_db()
+    relay = Relay(
+        OrderTable.modified_flag_bc,
+        IPC_SOCKET_PATH,
+        encode=lambda flag: flag.value,
+        decode=ModifiedFlag,
+    )
+    await relay.start()
+    catalog_relay = Relay(
+        ProductTable.modified_version_bc,
+        CATALOG_IPC_SOCKET_PATH,
+        encode=lambda version: version,
+        decode=lambda version: version,
+    )
+    await catalog_relay.start()
+    sweeper = asyncio.create_task(sweep(SessionStore, SESSION_SWEEP_INTERVAL_SECS))
+    archiver = asyncio.create_task(
+        archive.sweep(archive_resolved_orders, ARCHIVE_INTERVAL_SECS)
+    )
     yield
+    for task in (archiver, sweeper):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await catalog_relay.stop()
+    await relay.stop()
     await shutdown_db()
 
 
@@ -58,3 +99,4 @@ app.include_router(products.router)
 app.include_router(register.router)
 app.include_router(orders.router)
 app.include_router(stat.router)
+app.include_router(admin.router)
@@ -0,0 +1,178 @@
+# Cross-process relay for broadcast channels
+#
+# `doit serve` runs several uvicorn workers, each of which has its own copy of
+# every `Broadcaster`. A relay connects the copies through a Unix domain socket
+# so that a value sent in one worker wakes up the receivers in all of them.
+#
+# The workers form a star. Whichever worker grabs the lock file first becomes
+# the hub: it listens on the socket and forwards each frame it receives to
+# every other connection. The rest connect to the hub as spokes. When the hub
+# goes away, the spokes race for the lock again and one of them takes over.
+# Nothing is polled; a worker only does work when a value is actually sent.
+
+import asyncio
+import fcntl
+import os
+import struct
+from pathlib import Path
+from typing import Callable
+
+from .bc import Broadcaster
+
+_FRAME = struct.Struct("!I")
+
+# Drop a peer instead of buffering without bound when it stops reading.
+_WRITE_BUFFER_LIMIT = 64 * 1024
+
+_RETRY_INTERVAL_SECS = 0.05
+
+
+class Relay[T]:
+    def __init__(
+        self,
+        bc: Broadcaster[T],
+        path: str | os.PathLike[str],
+        encode: Callable[[T], int],
+        decode: Callable[[int], T],
+    ):
+        self._bc = bc
+        self._path = Path(path)
+        self._lock_path = self._path.with_name(self._path.name + ".lock")
+        self._encode = encode
+        self._decode = decode
+
+        self._lock_fd: int | None = None
+        self._server: asyncio.Server | None = None
+        self._peers: set[asyncio.StreamWriter] = set()
+        self._hub: asyncio.StreamWriter | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def is_hub(self) -> bool:
+        return self._server is not None
+
+    @property
+    def connected(self) -> bool:
+        return self.is_hub or self._hub is not None
+
+    @property
+    def spoke_count(self) -> int:
+        """The number of workers connected to this one when it is the hub."""
+        return len(self._peers)
+
+    async def start(self) -> None:
+        """
+        Join the relay and start forwarding values sent to the broadcaster.
+
+        The first election happens before this function returns, so values sent
+        right after startup are not lost.
+        """
+        reader = await self._join()
+        self._bc.forward = self._publish
+        self._task = asyncio.create_task(self._run(reader))
+
+    async def stop(self) -> None:
+        self._bc.forward = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._leave()
+
+    async def _run(self, reader: asyncio.StreamReader | None) -> None:
+        while True:
+            if reader is None:
+                # The hub keeps serving its spokes until the relay is stopped
+                await asyncio.get_running_loop().create_future()
+                return
+            await self._read_from_hub(reader)
+            await self._leave()
+            reader = await self._join()
+
+    async def _join(self) -> asyncio.StreamReader | None:
+        """
+        Connect to the hub, or become the hub if there is none. Returns the
+        stream to read from in the former case and `None` in the latter.
+        """
+        while True:
+            try:
+                reader, self._hub = await asyncio.open_unix_connection(self._path)
+                return reader
+            except (FileNotFoundError, ConnectionRefusedError):
+                pass
+            if self._try_lock():
+                self._path.unlink(missing_ok=True)
+                self._server = await asyncio.start_unix_server(self._serve, self._path)
+                return None
+            await asyncio.sleep(_RETRY_INTERVAL_SECS)
+
+    def _try_lock(self) -> bool:
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _leave(self) -> None:
+        if self._hub is not None:
+            self._hub.close()
+            self._hub = None
+        if self._server is not None:
+            for peer in self._peers:
+                peer.close()
+            self._peers.clear()
+            self._server.close()
+            self._server = None
+            # Remove the socket while still holding the lock so that the next
+            # hub does not get its fresh socket unlinked by us.
+            self._path.unlink(missing_ok=True)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _publish(self, value: T) -> None:
+        frame = _FRAME.pack(self._encode(value))
+        if self._hub is not None:
+            self._write(self._hub, frame)
+        for peer in tuple(self._peers):
+            self._write(peer, frame)
+
+    def _write(self, writer: asyncio.StreamWriter, frame: bytes) -> None:
+        if writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > _WRITE_BUFFER_LIMIT:
+            writer.close()
+            self._peers.discard(writer)
+            return
+        writer.write(frame)
+
+    async def _read_from_hub(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                data = await reader.readexactly(_FRAME.size)
+                self._bc.send_local(self._decode(_FRAME.unpack(data)[0]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+
+    async def _serve(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._peers.add(writer)
+        try:
+            while True:
+                data = await reader.readexactly(_FRAME.size)
+                for peer in tuple(self._peers):
+                    if peer is not writer:
+                        self._write(peer, data)
+                self._bc.send_local(self._decode(_FRAME.unpack(data)[0]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+
+from ..store import backup_databases
+
+router = APIRouter()
+
+
+@router.post("/backups")
+async def create_backup(gzip: bool = False) -> dict[str, str | int]:
+    backup = await backup_databases(gzip)
+    return {"path": str(backup.path), "size": backup.size}
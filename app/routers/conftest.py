@@ -0,0 +1,47 @@
+import asyncio
+from pathlib import Path
+from typing import Awaitable, Callable, Protocol
+
+import pytest
+
+from ..store import startup_and_shutdown_db
+
+STATIC_DIR = Path(__file__).parents[2] / "static"
+
+
+@pytest.fixture
+def workdir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Run the test against a fresh database in a temporary directory."""
+    (tmp_path / "db").mkdir()
+    # Links to the files rather than to the directory, so that whatever a test
+    # writes there stays in the temporary directory
+    (tmp_path / "static").mkdir()
+    for path in STATIC_DIR.iterdir():
+        (tmp_path / "static" / path.name).symlink_to(path)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+class RunWithDb(Protocol):
+    def __call__[T](self, main: Callable[[], Awaitable[T]]) -> T: ...
+
+
+@pytest.fixture
+def run_with_db(workdir: Path) -> RunWithDb:
+    """
+    Run `main` in a new event loop with the database in `workdir` started, and
+    shut it down afterwards, as the app does around the requests.
+    """
+
+    def run[T](main: Callable[[], Awaitable[T]]) -> T:
+        async def started() -> T:
+            startup_db, shutdown_db = startup_and_shutdown_db
+            await startup_db()
+            try:
+                return await main()
+            finally:
+                await shutdown_db()
+
+        return asyncio.run(started())
+
+    return run
@@ -1,14 +1,25 @@
-import asyncio
+import uuid
+from dataclasses import dataclass
 from datetime import datetime
 from functools import partial
-from typing import Any, AsyncIterable, Awaitable, Callable, Literal, Mapping
+from typing import (
+    Annotated,
+    Any,
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Literal,
+    Mapping,
+)
+from urllib.parse import urlencode
 
 import sqlalchemy
 import sqlalchemy.sql.expression as sa_exp
+from datastar_py.consts import ElementPatchMode
 from datastar_py.fastapi import DatastarResponse
 from datastar_py.sse import DatastarEvent
 from datastar_py.sse import ServerSentEventGenerator as SSE
-from fastapi import APIRouter, HTTPException, Request, status
+from fastapi import APIRouter, Header, HTTPException, Query, Request, status
 from fastapi.responses import HTMLResponse
 from htpy import (
     Element,
@@ -16,31 +27,48 @@ from htpy import (
     a,
     button,
     div,
+    form,
+    fragment,
     h3,
     header,
     img,
+    input,
+    label,
     li,
     main,
+    option,
     p,
     script,
+    select,
     span,
     ul,
 )
 from markupsafe import Markup
 from sqlalchemy.sql.functions import func as sa_func
 
+from ..bc import Pacing
 from ..components import clock, page_layout
+from ..env import (
+    BOARD_REFRESH_ADAPTIVE,
+    BOARD_REFRESH_MAX_WINDOW_SECS,
+    BOARD_REFRESH_WINDOW_SECS,
+)
 from ..store import (
     Order,
     OrderedItem,
+    OpenOrderState,
     OrderTable,
     Product,
-    database,
+    ProductRow,
+    ProductTable,
+    cancel_order,
+    read_pool,
+    reset_order,
     supply_all_and_complete,
     supply_and_complete_order_if_done,
-    unixepoch,
 )
 from ..store.order import ModifiedFlag
+from ..store.statements import Statement
 
 router = APIRouter()
 
@@ -97,8 +125,13 @@ def notif_ringtone(req: Request) -> list[Element]:
     ]
 
 
-def _to_time(unix_epoch: int) -> str:
-    return datetime.fromtimestamp(unix_epoch).strftime("%H:%M:%S")
+def _to_time(epoch_ms: int) -> str:
+    return datetime.fromtimestamp(epoch_ms / 1000).strftime("%H:%M:%S")
+
+
+def _static_path(req: Request, path: str) -> str:
+    # Unlike `url_for`, leaves out the host that the request was sent to
+    return str(req.app.url_path_for("static", path=path))
 
 
 # This function exists to reduce code duplication, at the cost of terrible
@@ -106,14 +139,12 @@ def _to_time(unix_epoch: int) -> str:
 #
 # It abstracts out the 2-dimenstional row-by-row extraction loop. But in doing
 # so, the caller must ensure that the outer loop variables and callbacks
-# intertwines oh-so perfectly in a very subtle way. This leads to the
-# `asyncio.Lock` workarounds for avoiding race conditions between tasks. I
-# sincerely regret that I made this abomination in the first place.
+# intertwines oh-so perfectly in a very subtle way. The callbacks are therefore
+# made anew for each call, together with the list they fill in, so that the
+# loads running at the same time never share any of it.
 #
-# If anything, I think the loop should be handled on the caller side rather
-# than managing the loop deep in the call stack. Also, it would be nice to be
-# able to cache the constructed object so that only one connection needs to
-# construct the object and let the others waiting for it.
+# The order boards do not come through here; they are rendered from the open
+# orders in memory, once per change. See `_BoardSnapshot`.
 async def _agen_query_executor[T](
     query: str,
     unique_key: Literal["order_id"] | Literal["product_id"],
@@ -123,7 +154,7 @@ async def _agen_query_executor[T](
 ):
     prev_unique_id = -1
     lst: list[T] = list()
-    async for map in database.iterate(query):
+    async for map in read_pool.iterate(query):
         if (unique_id := map[unique_key]) != prev_unique_id:
             if prev_unique_id != -1:
                 list_cb(lst)
@@ -143,7 +174,7 @@ query_ordered_items_incoming: sa_exp.Select = (
     .select_from(sa_exp.join(OrderedItem, Product))
     .add_columns(Product.name, Product.filename)
     .join(Order)
-    .add_columns(unixepoch(Order.ordered_at))
+    .add_columns(Order.ordered_at)
     .where(Order.canceled_at.is_(None) & Order.completed_at.is_(None))
     .order_by(OrderedItem.product_id.asc(), OrderedItem.order_id.asc())
 )
@@ -151,11 +182,13 @@ query_ordered_items_incoming: sa_exp.Select = (
 type ordered_item_t = dict[str, int | str | list[dict[str, int | str]]]
 
 
-def _ordered_items_loader() -> Callable[[], Awaitable[list[ordered_item_t]]]:
-    query_str = str(query_ordered_items_incoming.compile())
-
-    ordered_items: list[ordered_item_t] = []
-
+def callbacks_ordered_items_incoming(
+    ordered_items: list[ordered_item_t],
+) -> tuple[
+    Callable[[int, Mapping], None],
+    Callable[[Mapping], dict[str, int | str]],
+    Callable[[list[dict[str, int | str]]], None],
+]:
     def init_cb(product_id: int, map: Mapping):
         ordered_items.append(
             {"product_id": product_id, "name": map["name"], "filename": map["filename"]}
@@ -171,25 +204,53 @@ def _ordered_items_loader() -> Callable[[], Awaitable[list[ordered_item_t]]]:
     def list_cb(orders: list[dict[str, int | str]]):
         ordered_items[-1]["orders"] = orders
 
-    load_ordered_products = partial(
-        _agen_query_executor, query_str, "product_id", init_cb, elem_cb, list_cb
-    )
+    return init_cb, elem_cb, list_cb
 
-    # Hack around the situation where multiple threads potentially modifying
-    # the `ordered_items` list simultaneously. See `_agen_query_executor` for
-    # more information.
-    lock = asyncio.Lock()
+
+def _ordered_items_loader() -> Callable[[], Awaitable[list[ordered_item_t]]]:
+    query_str = str(query_ordered_items_incoming.compile())
 
     async def load():
-        async with lock:
-            ordered_items.clear()
-            await load_ordered_products()
-            return ordered_items
+        ordered_items: list[ordered_item_t] = []
+        callbacks = callbacks_ordered_items_incoming(ordered_items)
+        await _agen_query_executor(query_str, "product_id", *callbacks)
+        return ordered_items
 
     return load
 
 
-load_ordered_items_incoming = _ordered_items_loader()
+# The SQL counterpart of `load_ordered_items_incoming`
+load_ordered_items_incoming_from_db = _ordered_items_loader()
+
+
+async def load_ordered_items_incoming() -> list[ordered_item_t]:
+    await OpenOrderState.sync()
+    return _ordered_items_incoming(await ProductTable.select_all())
+
+
+def _ordered_items_incoming(catalog: list[ProductRow]) -> list[ordered_item_t]:
+    products = {p.product_id: p for p in catalog}
+    ordered_items: list[ordered_item_t] = []
+    for product_id in OpenOrderState.waiting_product_ids():
+        if (product := products.get(product_id)) is None:
+            continue
+        orders: list[dict[str, int | str]] = [
+            {
+                "order_id": order.order_id,
+                "count": order.items[product_id].unsupplied,
+                "ordered_at": _to_time(order.ordered_at),
+            }
+            for order in OpenOrderState.by_product_id(product_id)
+        ]
+        ordered_items.append(
+            {
+                "product_id": product_id,
+                "name": product.name,
+                "filename": product.filename,
+                "orders": orders,  # pyright: ignore[reportAssignmentType]
+            }
+        )
+    return ordered_items
 
 
 elm_main_ordered_items = main(
@@ -222,45 +283,43 @@ def page_ordered_items_incoming(req: Request) -> HTMLElement:
 def ordered_items_incoming_component(
     req: Request, ordered_items: list[ordered_item_t]
 ) -> Element:
-    def orders(ordered_item: ordered_item_t) -> list[Element]:
-        return [
-            li(
-                id=f"ordered-item-{order['order_id']}-{ordered_item['product_id']}",
-                class_="flex flex-row items-center",
-            )[
-                span(class_="text-xl")[f"#{order['order_id']}"],
-                span(class_="ml-1")[f"@{order['ordered_at']}"],
-                span(class_="whitespace-nowrap ml-auto")[f"x {order['count']}"],
-                button(
-                    data_on_click=f"@post('/orders/{order['order_id']}/products/{ordered_item['product_id']}/supplied-at')",
-                    class_="w-1/3 py-1 m-1 text-white bg-green-600 rounded-sm",
-                )["✓"],
-            ]
-            for order in ordered_item["orders"]  # pyright: ignore[reportGeneralTypeIssues]
-        ]
-
     return elm_main_ordered_items[
-        [
-            div(
-                id=f"product-{ordered_item['product_id']}",
-                class_="h-80 flex flex-col border-2 border-gray-300 rounded-lg pb-2",
-            )[
-                div(class_="width-full flex flex-row mx-1 items-start pb-2")[
-                    h3(class_="text-lg ml-1")[ordered_item["name"]]
-                ],
-                div(class_="w-1/3 mx-auto")[
-                    img(
-                        src=str(req.url_for("static", path=ordered_item["filename"])),
-                        alt=str(ordered_item["name"]),
-                        class_="mx-auto w-full h-auto aspect-square",
-                    )
-                ],
-                ul(class_="grow overflow-y-auto px-2 divide-y-2 divide-gray-200")[
-                    *orders(ordered_item)
-                ],
-            ]
-            for ordered_item in ordered_items
+        [ordered_item_card(req, ordered_item) for ordered_item in ordered_items]
+    ]
+
+
+def ordered_item_card(req: Request, ordered_item: ordered_item_t) -> Element:
+    orders = [
+        li(
+            id=f"ordered-item-{order['order_id']}-{ordered_item['product_id']}",
+            class_="flex flex-row items-center",
+        )[
+            span(class_="text-xl")[f"#{order['order_id']}"],
+            span(class_="ml-1")[f"@{order['ordered_at']}"],
+            span(class_="whitespace-nowrap ml-auto")[f"x {order['count']}"],
+            button(
+                data_on_click=f"@post('/orders/{order['order_id']}/products/{ordered_item['product_id']}/supplied-at')",
+                class_="w-1/3 py-1 m-1 text-white bg-green-600 rounded-sm",
+            )["✓"],
         ]
+        for order in ordered_item["orders"]  # pyright: ignore[reportGeneralTypeIssues]
+    ]
+
+    return div(
+        id=f"product-{ordered_item['product_id']}",
+        class_="h-80 flex flex-col border-2 border-gray-300 rounded-lg pb-2",
+    )[
+        div(class_="width-full flex flex-row mx-1 items-start pb-2")[
+            h3(class_="text-lg ml-1")[ordered_item["name"]]
+        ],
+        div(class_="w-1/3 mx-auto")[
+            img(
+                src=_static_path(req, str(ordered_item["filename"])),
+                alt=str(ordered_item["name"]),
+                class_="mx-auto w-full h-auto aspect-square",
+            )
+        ],
+        ul(class_="grow overflow-y-auto px-2 divide-y-2 divide-gray-200")[*orders],
     ]
 
 
@@ -273,12 +332,12 @@ query_incoming: sa_exp.Select = (
     sa_exp.select(Order.order_id)
     .group_by(Order.order_id)
     .order_by(Order.order_id.asc())
-    .add_columns(unixepoch(Order.ordered_at))
+    .add_columns(Order.ordered_at)
     # Filter out canceled/completed orders
     .where(Order.canceled_at.is_(None) & Order.completed_at.is_(None))
     # Query the list of ordered items
     .select_from(sa_exp.join(Order, OrderedItem))
-    .add_columns(OrderedItem.product_id, unixepoch(OrderedItem.supplied_at))
+    .add_columns(OrderedItem.product_id, OrderedItem.supplied_at)
     .group_by(OrderedItem.product_id)
     .order_by(OrderedItem.product_id.asc())
     .add_columns(sa_func.count(OrderedItem.product_id).label("count"))
@@ -293,14 +352,14 @@ query_resolved: sa_exp.Select = (
     sa_exp.select(Order.order_id)
     .group_by(Order.order_id)
     .order_by(Order.order_id.asc())
-    .add_columns(unixepoch(Order.ordered_at))
+    .add_columns(Order.ordered_at)
     # Query canceled/completed orders
     .where(Order.canceled_at.isnot(None) | Order.completed_at.isnot(None))
-    .add_columns(unixepoch(Order.canceled_at))
-    .add_columns(unixepoch(Order.completed_at))
+    .add_columns(Order.canceled_at)
+    .add_columns(Order.completed_at)
     # Query the list of ordered items
     .select_from(sa_exp.join(Order, OrderedItem))
-    .add_columns(OrderedItem.product_id, unixepoch(OrderedItem.supplied_at))
+    .add_columns(OrderedItem.product_id, OrderedItem.supplied_at)
     .group_by(OrderedItem.product_id)
     .order_by(OrderedItem.product_id.asc())
     .add_columns(sa_func.count(OrderedItem.product_id).label("count"))
@@ -388,68 +447,187 @@ def _orders_loader(
         ],
     ],
 ) -> Callable[[], Awaitable[list[order_t]]]:
-    orders: list[order_t] = []
-
-    init_cb, elem_cb, list_cb = callbacks(orders)
-    load_orders = partial(
-        _agen_query_executor, str(query), "order_id", init_cb, elem_cb, list_cb
-    )
-
-    # Hack around the situation where multiple threads potentially modifying
-    # the `orders` list simultaneously. See `_agen_query_executor` for more
-    # information.
-    lock = asyncio.Lock()
+    query_str = str(query)
 
     async def load():
-        async with lock:
-            orders.clear()
-            await load_orders()
-            return orders
+        orders: list[order_t] = []
+        await _agen_query_executor(query_str, "order_id", *callbacks(orders))
+        return orders
 
     return load
 
 
-load_incoming_orders = _orders_loader(
+# The SQL counterpart of `load_incoming_orders`
+load_incoming_orders_from_db = _orders_loader(
     query_incoming.compile(), callbacks_orders_incoming
 )
 load_resolved_orders = _orders_loader(
     query_resolved.compile(), callbacks_orders_resolved
 )
 
+# Fills whole rows of the grid with either 1, 2, 3 or 4 columns
+RESOLVED_PAGE_SIZE = 48
+
+
+@dataclass(frozen=True, slots=True)
+class ResolvedFilter:
+    """What the resolved orders are narrowed down to on the page"""
+
+    status: Literal["completed", "canceled"] | None = None
+    # Bounds on `ordered_at` in local time, as given by the datetime-local inputs
+    since: datetime | None = None
+    until: datetime | None = None
+
+    @classmethod
+    def from_query(cls, status_: str, since: str, until: str) -> "ResolvedFilter":
+        if status_ not in ("", "completed", "canceled"):
+            detail = f"Unknown status {status_!r}"
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=detail)
+        try:
+            return cls(
+                status_ or None,  # type: ignore[arg-type]
+                datetime.fromisoformat(since) if since else None,
+                datetime.fromisoformat(until) if until else None,
+            )
+        except ValueError as e:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    def params(self) -> dict[str, str]:
+        params = {
+            "status": self.status or "",
+            "since": self.since.isoformat(timespec="minutes") if self.since else "",
+            "until": self.until.isoformat(timespec="minutes") if self.until else "",
+        }
+        return {key: value for key, value in params.items() if value}
+
+    def page_query(self, before: int | None) -> sa_exp.Select:
+        # The resolved condition is always there for the partial indexes to apply
+        query = (
+            sa_exp.select(Order.order_id)
+            .where(Order.canceled_at.isnot(None) | Order.completed_at.isnot(None))
+            .order_by(Order.order_id.desc())
+            .limit(RESOLVED_PAGE_SIZE)
+        )
+        if self.status == "completed":
+            query = query.where(Order.completed_at.isnot(None))
+        elif self.status == "canceled":
+            query = query.where(Order.canceled_at.isnot(None))
+        # Order ids go up with `ordered_at`, so the time range is turned into a
+        # range of ids with a seek on `ordered_at` each, and the page stays a
+        # range scan of the ids
+        if self.since is not None:
+            first = (
+                sa_exp.select(Order.order_id)
+                .where(Order.ordered_at >= _to_epoch_ms(self.since))
+                .order_by(Order.ordered_at.asc())
+                .limit(1)
+            )
+            query = query.where(Order.order_id >= first.scalar_subquery())
+        if self.until is not None:
+            last = (
+                sa_exp.select(Order.order_id)
+                .where(Order.ordered_at < _to_epoch_ms(self.until))
+                .order_by(Order.ordered_at.desc())
+                .limit(1)
+            )
+            query = query.where(Order.order_id <= last.scalar_subquery())
+        if before is not None:
+            query = query.where(Order.order_id < before)
+        return query
+
+
+def _to_epoch_ms(local: datetime) -> int:
+    return int(local.timestamp() * 1000)
+
+
+async def load_resolved_orders_page(
+    filter: ResolvedFilter, before: int | None = None
+) -> tuple[list[order_t], int | None]:
+    """
+    Load up to `RESOLVED_PAGE_SIZE` resolved orders older than the order
+    `before`, newest first, along with the `before` of the next page if there
+    may be one. Each page is a range scan of the index on the ids from where
+    the last one stopped, rather than an OFFSET counting past all of them.
+    """
+    rows = await read_pool.fetch_all(filter.page_query(before))
+    order_ids: list[int] = [row[0] for row in rows]
+    if not order_ids:
+        return [], None
 
-async def load_one_resolved_order(order_id: int) -> order_t | None:
-    query = query_resolved.where(Order.order_id == order_id)
+    orders: list[order_t] = []
+    # `databases` cannot expand IN lists of parameters, hence the literal binds
+    query = query_resolved.where(Order.order_id.in_(order_ids))
+    compiled = query.compile(compile_kwargs={"literal_binds": True})
+    await _agen_query_executor(
+        str(compiled), "order_id", *callbacks_orders_resolved(orders)
+    )
+    orders.reverse()
+    next_before = order_ids[-1] if len(order_ids) == RESOLVED_PAGE_SIZE else None
+    return orders, next_before
+
+
+async def load_incoming_orders() -> list[order_t]:
+    await OpenOrderState.sync()
+    return _incoming_orders(await ProductTable.select_all())
 
-    rows_agen = database.iterate(query)
-    if (row := await anext(rows_agen, None)) is None:
+
+def _incoming_orders(catalog: list[ProductRow]) -> list[order_t]:
+    products = {p.product_id: p for p in catalog}
+    orders: list[order_t] = []
+    for order in OpenOrderState.orders():
+        items: list[item_t] = [
+            {
+                "product_id": product_id,
+                "count": item.count,
+                "name": products[product_id].name,
+                "supplied_at": _to_time(item.supplied_at) if item.supplied_at else None,
+            }
+            for product_id, item in sorted(order.items.items())
+            if product_id in products
+        ]
+        if items:
+            orders.append(
+                {
+                    "order_id": order.order_id,
+                    "ordered_at": _to_time(order.ordered_at),
+                    "items": items,
+                }
+            )
+    return orders
+
+
+_ONE_RESOLVED_ORDER = Statement(
+    "orders.one_resolved",
+    query_resolved.where(Order.order_id == sa_exp.bindparam("order_id")),
+)
+
+
+async def load_one_resolved_order(order_id: int) -> order_t | None:
+    rows = await _ONE_RESOLVED_ORDER.fetch_all(read_pool, order_id=order_id)
+    if not rows:
         return None
 
-    canceled_at, completed_at = row["canceled_at"], row["completed_at"]
+    _, ordered_at, canceled_at, completed_at, *_ = rows[0]
     order: order_t = {
         "order_id": order_id,
-        "ordered_at": _to_time(row["ordered_at"]),
+        "ordered_at": _to_time(ordered_at),
         "canceled_at": _to_time(canceled_at) if canceled_at else None,
         "completed_at": _to_time(completed_at) if completed_at else None,
     }
 
     total_price = 0
-
-    def to_item(row: Mapping) -> item_t:
-        count, price = row["count"], row["price"]
-        nonlocal total_price
+    items: list[item_t] = []
+    for *_, product_id, supplied_at, count, name, price in rows:
         total_price += count * price
-        supplied_at = row["supplied_at"]
-        return {
-            "product_id": row["product_id"],
-            "count": count,
-            "name": row["name"],
-            "price": Product.to_price_str(price),
-            "supplied_at": _to_time(supplied_at) if supplied_at else None,
-        }
-
-    items = [to_item(row)]
-    async for row in rows_agen:
-        items.append(to_item(row))
+        items.append(
+            {
+                "product_id": product_id,
+                "count": count,
+                "name": name,
+                "price": Product.to_price_str(price),
+                "supplied_at": _to_time(supplied_at) if supplied_at else None,
+            }
+        )
     order["items"] = items
     order["total_price"] = Product.to_price_str(total_price)
 
@@ -482,50 +660,53 @@ def page_incoming_orders(req: Request) -> HTMLElement:
 
 
 def incoming_orders_component(orders: list[order_t]) -> Element:
-    def ordered_items(order: order_t) -> list[Element]:
-        return [
-            li(class_="flex flex-row items-start gap-x-2 px-1")[
-                (
-                    span(class_="text-green-500 font-bold")["✓"]
-                    if item["supplied_at"]
-                    else span(class_="text-red-500 font-bold")["✗"]
-                ),
-                span(class_="break-words")[item["name"]],
-                span(class_="ml-auto whitespace-nowrap")[f"x {item['count']}"],
-            ]
-            for item in order["items"]  # pyright: ignore[reportGeneralTypeIssues, reportOptionalIterable]
+    return elm_main_incoming_orders[[incoming_order_card(order) for order in orders]]
+
+
+def incoming_order_card(order: order_t) -> Element:
+    ordered_items = [
+        li(class_="flex flex-row items-start gap-x-2 px-1")[
+            (
+                span(class_="text-green-500 font-bold")["✓"]
+                if item["supplied_at"]
+                else span(class_="text-red-500 font-bold")["✗"]
+            ),
+            span(class_="break-words")[item["name"]],
+            span(class_="ml-auto whitespace-nowrap")[f"x {item['count']}"],
         ]
+        for item in order["items"]  # pyright: ignore[reportGeneralTypeIssues, reportOptionalIterable]
+    ]
 
-    return elm_main_incoming_orders[
-        [
-            div(
-                id=f"order-{order['order_id']}",
-                class_="w-full h-60 flex flex-col gap-y-1 border-2 border-gray-300 rounded-lg pb-2",
-            )[
-                div(class_="width-full flex flex-row p-2 items-start")[
-                    div(class_="grow flex flex-row items-end")[
-                        h3(class_="text-2xl")[f"#{order['order_id']}"],
-                        span(class_="ml-1")[f"@{order['ordered_at']}"],
-                    ],
-                    button(
-                        data_on_click=f"confirm('確定注文 #{order['order_id']} を取り消しますか？') && @post('/orders/{order['order_id']}/canceled-at')",
-                        class_="px-2 py-1 text-white bg-red-600 rounded-lg",
-                    )["取消"],
-                ],
-                ul(class_="grow overflow-y-auto px-2 divide-y-2 divide-gray-200")[
-                    ordered_items(order)
-                ],
-                button(
-                    data_on_click=f"@post('/orders/{order['order_id']}/completed-at')",
-                    class_="mx-10 py-1 text-white bg-blue-600 rounded-lg",
-                )["完了"],
-            ]
-            for order in orders
-        ]
+    return div(
+        id=f"order-{order['order_id']}",
+        class_="w-full h-60 flex flex-col gap-y-1 border-2 border-gray-300 rounded-lg pb-2",
+    )[
+        div(class_="width-full flex flex-row p-2 items-start")[
+            div(class_="grow flex flex-row items-end")[
+                h3(class_="text-2xl")[f"#{order['order_id']}"],
+                span(class_="ml-1")[f"@{order['ordered_at']}"],
+            ],
+            button(
+                data_on_click=f"confirm('確定注文 #{order['order_id']} を取り消しますか？') && @post('/orders/{order['order_id']}/canceled-at')",
+                class_="px-2 py-1 text-white bg-red-600 rounded-lg",
+            )["取消"],
+        ],
+        ul(class_="grow overflow-y-auto px-2 divide-y-2 divide-gray-200")[
+            ordered_items
+        ],
+        button(
+            data_on_click=f"@post('/orders/{order['order_id']}/completed-at')",
+            class_="mx-10 py-1 text-white bg-blue-600 rounded-lg",
+        )["完了"],
     ]
 
 
-def page_resolved_orders(req: Request, orders: list[order_t]) -> HTMLElement:
+def page_resolved_orders(
+    req: Request,
+    orders: list[order_t],
+    filter: ResolvedFilter,
+    next_before: int | None,
+) -> HTMLElement:
     inner = div(class_="flex flex-col")[
         header(
             class_="sticky z-10 inset-0 w-full px-16 py-3 flex gap-3 border-b border-gray-500 bg-white text-2xl"
@@ -538,21 +719,69 @@ def page_resolved_orders(req: Request, orders: list[order_t]) -> HTMLElement:
             ],
             clock,
         ],
+        resolved_orders_filter(filter),
         main(
             id="orders",
             class_="w-full grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 xl:grid-cols-4 auto-rows-min gap-3 py-2 px-16 overflow-y-auto",
-        )[
-            [
-                resolved_order_completed(order)
-                if order["completed_at"]
-                else resolved_order_canceled(order)
-                for order in reversed(orders)
-            ]
-        ],
+        )[resolved_orders_page(orders, filter, next_before)],
     ]
     return page_layout(req, inner, title="処理済注文 - murchace")
 
 
+def resolved_orders_filter(filter: ResolvedFilter) -> Element:
+    since = filter.since.isoformat(timespec="minutes") if filter.since else ""
+    until = filter.until.isoformat(timespec="minutes") if filter.until else ""
+    return form(
+        action="/orders/resolved",
+        method="get",
+        class_="flex flex-row flex-wrap items-center gap-3 py-2 px-16",
+    )[
+        label(for_="resolved-status")["状態:"],
+        select(id="resolved-status", name="status", class_="px-2 py-1 border")[
+            option(value="", selected=filter.status is None)["すべて"],
+            option(value="completed", selected=filter.status == "completed")["完了"],
+            option(value="canceled", selected=filter.status == "canceled")["取消"],
+        ],
+        label(for_="resolved-since")["注文日時:"],
+        input(
+            type="datetime-local",
+            id="resolved-since",
+            name="since",
+            value=since,
+            class_="px-2 py-1 border",
+        ),
+        span["〜"],
+        input(
+            type="datetime-local",
+            name="until",
+            value=until,
+            class_="px-2 py-1 border",
+        ),
+        button(type="submit", class_="px-2 py-1 rounded-sm bg-gray-300")["絞り込む"],
+    ]
+
+
+def resolved_orders_page(
+    orders: list[order_t], filter: ResolvedFilter, next_before: int | None
+) -> list[Element]:
+    cards = [
+        resolved_order_completed(order)
+        if order["completed_at"]
+        else resolved_order_canceled(order)
+        for order in orders
+    ]
+    if next_before is None:
+        return cards
+    # Asks for the next page once scrolled into view, and gets replaced by it
+    params = urlencode(filter.params() | {"before": next_before})
+    sentinel = div(
+        {"data-on-intersect__once": f"@get('/orders/resolved/page?{params}')"},
+        id=f"resolved-page-{next_before}",
+        class_="col-span-full h-16",
+    )
+    return [*cards, sentinel]
+
+
 def resolved_order_completed(order: order_t) -> Element:
     return div(
         id=f"order-{order['order_id']}",
@@ -620,31 +849,207 @@ def _order_body(order: order_t) -> list[Element]:
     ]
 
 
-@router.get("/ordered-items/incoming", response_class=HTMLResponse)
-async def get_incoming_ordered_items(request: Request):
-    return HTMLResponse(page_ordered_items_incoming(request))
+# How many of the boards sent last a reconnecting tablet can resume from
+_RESUMABLE_BOARDS = 64
+
+
+@dataclass(slots=True)
+class _Board:
+    serial: int  # Goes up with every board rendered
+    cards: dict[str, str]  # The HTML of each card by its id, in the order shown
+    event: DatastarEvent  # Patches the whole board
+
+
+class _BoardSnapshot:
+    """
+    An order board shared by every tablet showing it. Whichever stream gets to
+    it first after the open orders or the products change renders the cards,
+    and works out the patches from the board it had sent before; the other
+    streams that had sent the same board send the same patches as they are.
+
+    The last event sent for each board carries its serial as the event ID. A
+    tablet that reconnects with it in `Last-Event-ID` is sent the patches from
+    that board as long as it is one of the `_RESUMABLE_BOARDS` rendered last,
+    or the whole board otherwise. The events before it carry IDs that resume
+    nothing, so that a tablet cut off halfway through the patches is sent the
+    whole board rather than the patches it has partly applied once more.
+    """
+
+    def __init__(
+        self,
+        elm_main: Element,
+        main_id: str,
+        render: Callable[[Request, list[ProductRow]], list[tuple[str, Element]]],
+    ):
+        self._elm_main = elm_main
+        self._main_id = main_id
+        # Since the board is shared, `render` must not use anything that differs
+        # from one request to another, such as the host in `url_for`.
+        self._render = render
+        self._version: tuple[int, int] | None = None
+        self._board = _Board(0, {}, DatastarEvent())
+        # Keyed by the serial of the board they bring up to date
+        self._patches: dict[int, list[DatastarEvent]] = {}
+        # Tells the serials of this board apart from the ones of the other
+        # board, or of this one before a restart or in another worker
+        self._event_id_prefix = uuid.uuid4().hex[:8]
+        self._recent: dict[int, _Board] = {}  # By serial, from the oldest
+
+    def resumed(self, last_event_id: str | None) -> _Board | None:
+        """The board a tablet had been sent, if it is still around."""
+        if last_event_id is None:
+            return None
+        prefix, _, serial = last_event_id.rpartition("-")
+        if prefix != self._event_id_prefix or not serial.isdigit():
+            return None
+        return self._recent.get(int(serial))
+
+    def _event_id(self, serial: int) -> str:
+        return f"{self._event_id_prefix}-{serial}"
+
+    async def patches(
+        self, req: Request, sent: _Board | None
+    ) -> tuple[_Board, list[DatastarEvent]]:
+        """
+        The current board and the events that bring a tablet from `sent` up to
+        it, i.e. the whole board when nothing has been sent yet.
+        """
+        await OpenOrderState.sync()
+        catalog = await ProductTable.select_all()
+        # Nothing is awaited from here on, so no other stream can change the
+        # model or the snapshot halfway through.
+        version = (OpenOrderState.version, ProductTable.catalog_version)
+        if version != self._version:
+            self._board = self._rendered(req, catalog)
+            self._version = version
+            self._patches.clear()
+            self._recent[self._board.serial] = self._board
+            while len(self._recent) > _RESUMABLE_BOARDS:
+                del self._recent[next(iter(self._recent))]
+
+        board = self._board
+        if sent is None:
+            return board, [board.event]
+        if (patches := self._patches.get(sent.serial)) is None:
+            patches = self._diff(sent.cards, board)
+            self._patches[sent.serial] = patches
+        return board, patches
+
+    def _rendered(self, req: Request, catalog: list[ProductRow]) -> _Board:
+        prev = self._board.cards
+        cards: dict[str, str] = {}
+        for id, card in self._render(req, catalog):
+            html = str(card)
+            # The unchanged cards keep the string sent before, which makes them
+            # quick to compare for every stream.
+            cards[id] = prev[id] if prev.get(id) == html else html
+        elm_main = self._elm_main[(Markup(html) for html in cards.values())]
+        serial = self._board.serial + 1
+        event = SSE.patch_elements(elm_main, event_id=self._event_id(serial))
+        return _Board(serial, cards, event)
+
+    def _diff(self, sent: dict[str, str], board: _Board) -> list[DatastarEvent]:
+        cards = board.cards
+        # Each takes its event ID
+        patches: list[partial[DatastarEvent]] = [
+            partial(SSE.remove_elements, f"#{id}") for id in sent if id not in cards
+        ]
+        patches += [
+            partial(SSE.patch_elements, html)
+            for id, html in cards.items()
+            if id in sent and sent[id] != html
+        ]
+        # The new cards go from the last, before the card that follows each,
+        # which is either on the tablet already or has just been put there.
+        ids = list(cards)
+        following = f"#{self._main_id}"
+        mode = ElementPatchMode.APPEND
+        for id in reversed(ids):
+            if id not in sent:
+                patches.append(
+                    partial(
+                        SSE.patch_elements, cards[id], selector=following, mode=mode
+                    )
+                )
+            following, mode = f"#{id}", ElementPatchMode.BEFORE
+
+        event_id = self._event_id(board.serial)
+        last = len(patches) - 1
+        events = [
+            patch(event_id=event_id if i == last else f"{event_id}.{i}")
+            for i, patch in enumerate(patches)
+        ]
+        # Such as when the products have been renamed
+        if sum(map(len, events)) >= len(board.event):
+            return [board.event]
+        return events
+
+
+ordered_items_board = _BoardSnapshot(
+    elm_main_ordered_items,
+    "ordered-items",
+    lambda req, catalog: [
+        (f"product-{ordered_item['product_id']}", ordered_item_card(req, ordered_item))
+        for ordered_item in _ordered_items_incoming(catalog)
+    ],
+)
+incoming_orders_board = _BoardSnapshot(
+    elm_main_incoming_orders,
+    "orders",
+    lambda _req, catalog: [
+        (f"order-{order['order_id']}", incoming_order_card(order))
+        for order in _incoming_orders(catalog)
+    ],
+)
 
 
-@router.get("/ordered-items/incoming-stream")
-async def ordered_items_incoming_stream(request: Request):
-    return DatastarResponse(_ordered_items_incoming_stream(request))
+# Ring the kitchen for these
+_NEW_ORDER = ModifiedFlag.INCOMING | ModifiedFlag.PUT_BACK
 
+_BOARD_PACING = Pacing[ModifiedFlag](
+    window_secs=BOARD_REFRESH_WINDOW_SECS,
+    max_window_secs=BOARD_REFRESH_MAX_WINDOW_SECS,
+    adaptive=BOARD_REFRESH_ADAPTIVE,
+    urgent=lambda flag: bool(flag & _NEW_ORDER),
+)
 
-async def _ordered_items_incoming_stream(req: Request) -> AsyncIterable[DatastarEvent]:
-    ordered_items = await load_ordered_items_incoming()
-    yield SSE.patch_elements(ordered_items_incoming_component(req, ordered_items))
-    async with OrderTable.modified_flag_bc.attach_receiver() as flag_rx:
+
+async def _board_stream(
+    board: _BoardSnapshot, req: Request, last_event_id: str | None
+) -> AsyncIterable[DatastarEvent]:
+    # Only what has changed since, for a tablet that has just reconnected
+    sent, patches = await board.patches(req, board.resumed(last_event_id))
+    for patch in patches:
+        yield patch
+    async with OrderTable.modified_flag_bc.attach_receiver(_BOARD_PACING) as flag_rx:
         while True:
             flag = await flag_rx.recv()
-            new_order = flag & (ModifiedFlag.INCOMING | ModifiedFlag.PUT_BACK)
-            ordered_items = await load_ordered_items_incoming()
-            yield SSE.patch_elements(
-                ordered_items_incoming_component(req, ordered_items)
-            )
+            new_order = flag & _NEW_ORDER
+            sent, patches = await board.patches(req, sent)
+            for patch in patches:
+                yield patch
             if new_order:
                 yield SSE.patch_signals({"_notifRingtone": "true"})
 
 
+@router.get("/ordered-items/incoming", response_class=HTMLResponse)
+async def get_incoming_ordered_items(request: Request):
+    return HTMLResponse(page_ordered_items_incoming(request))
+
+
+@router.get("/ordered-items/incoming-stream")
+async def ordered_items_incoming_stream(
+    request: Request, last_event_id: Annotated[str | None, Header()] = None
+):
+    return DatastarResponse(_ordered_items_incoming_stream(request, last_event_id))
+
+
+def _ordered_items_incoming_stream(
+    req: Request, last_event_id: str | None = None
+) -> AsyncIterable[DatastarEvent]:
+    return _board_stream(ordered_items_board, req, last_event_id)
+
+
 @router.post("/orders/{order_id}/products/{product_id}/supplied-at")
 async def supply_products(order_id: int, product_id: int):
     completed = await supply_and_complete_order_if_done(order_id, product_id)
@@ -661,46 +1066,62 @@ async def get_incoming_orders(request: Request):
 
 
 @router.get("/orders/incoming-stream")
-async def incoming_orders_stream():
-    return DatastarResponse(_incoming_orders_stream())
+async def incoming_orders_stream(
+    request: Request, last_event_id: Annotated[str | None, Header()] = None
+):
+    return DatastarResponse(_incoming_orders_stream(request, last_event_id))
 
 
-async def _incoming_orders_stream() -> AsyncIterable[DatastarEvent]:
-    orders = await load_incoming_orders()
-    yield SSE.patch_elements(incoming_orders_component(orders))
-    async with OrderTable.modified_flag_bc.attach_receiver() as flag_rx:
-        while True:
-            flag = await flag_rx.recv()
-            new_order = flag & (ModifiedFlag.INCOMING | ModifiedFlag.PUT_BACK)
-            orders = await load_incoming_orders()
-            yield SSE.patch_elements(incoming_orders_component(orders))
-            if new_order:
-                yield SSE.patch_signals({"_notifRingtone": "true"})
+def _incoming_orders_stream(
+    req: Request, last_event_id: str | None = None
+) -> AsyncIterable[DatastarEvent]:
+    return _board_stream(incoming_orders_board, req, last_event_id)
 
 
 @router.get("/orders/resolved", response_class=HTMLResponse)
-async def get_resolved_orders(request: Request):
-    orders = await load_resolved_orders()
-    return HTMLResponse(page_resolved_orders(request, orders))
+async def get_resolved_orders(
+    request: Request,
+    status_: Annotated[str, Query(alias="status")] = "",
+    since: str = "",
+    until: str = "",
+):
+    filter = ResolvedFilter.from_query(status_, since, until)
+    orders, next_before = await load_resolved_orders_page(filter)
+    return HTMLResponse(page_resolved_orders(request, orders, filter, next_before))
+
+
+@router.get("/orders/resolved/page")
+async def get_resolved_orders_page(
+    before: int,
+    status_: Annotated[str, Query(alias="status")] = "",
+    since: str = "",
+    until: str = "",
+):
+    filter = ResolvedFilter.from_query(status_, since, until)
+    orders, next_before = await load_resolved_orders_page(filter, before)
+    sentinel = f"#resolved-page-{before}"
+    page = fragment[resolved_orders_page(orders, filter, next_before)]
+    return DatastarResponse(
+        [
+            SSE.patch_elements(page, selector=sentinel, mode=ElementPatchMode.BEFORE),
+            SSE.remove_elements(sentinel),
+        ]
+    )
 
 
 @router.delete("/orders/{order_id}/resolved-at")
 async def reset(order_id: int):
-    await OrderTable.reset(order_id)
+    await reset_order(order_id)
     return DatastarResponse(SSE.remove_elements(f"#order-{order_id}"))
 
 
 @router.post("/orders/{order_id}/completed-at")
 async def complete(order_id: int, card_response: bool = False):
+    await supply_all_and_complete(order_id)
     if not card_response:
-        await supply_all_and_complete(order_id)
         return DatastarResponse(SSE.remove_elements(f"#order-{order_id}"))
 
-    async with database.transaction():
-        await supply_all_and_complete(order_id)
-        maybe_order = await load_one_resolved_order(order_id)
-
-    if (order := maybe_order) is None:
+    if (order := await load_one_resolved_order(order_id)) is None:
         detail = f"Order {order_id} not found"
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
 
@@ -710,15 +1131,11 @@ async def complete(order_id: int, card_response: bool = False):
 
 @router.post("/orders/{order_id}/canceled-at")
 async def cancel(order_id: int, card_response: bool = False):
+    await cancel_order(order_id)
     if not card_response:
-        await OrderTable.cancel(order_id)
         return
 
-    async with database.transaction():
-        await OrderTable.cancel(order_id)
-        maybe_order = await load_one_resolved_order(order_id)
-
-    if (order := maybe_order) is None:
+    if (order := await load_one_resolved_order(order_id)) is None:
         detail = f"Order {order_id} not found"
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
 
@@ -24,12 +24,12 @@ from htpy import (
 )
 
 from ..components import page_layout
-from ..store import Product, ProductTable, delete_product
+from ..store import Product, ProductRow, ProductTable, delete_product
 
 router = APIRouter()
 
 
-def page_products(req: Request, products: list[Product]) -> HTMLElement:
+def page_products(req: Request, products: list[ProductRow]) -> HTMLElement:
     product_figures = [
         figure(
             id=f"product-{p.product_id}",
@@ -88,7 +88,7 @@ def page_products(req: Request, products: list[Product]) -> HTMLElement:
     )
 
 
-def fragment_editor(req: Request, product: Product) -> Element:
+def fragment_editor(req: Request, product: ProductRow) -> Element:
     product_preview = div(id="product-preview", class_="grow")[
         figure(
             class_="w-2/3 mx-auto flex flex-col border-4 border-blue-400 rounded-md transition-colors ease-in-out active:bg-blue-300"
@@ -1,6 +1,6 @@
-from dataclasses import dataclass
-from typing import Annotated, Iterable
-from uuid import UUID, uuid4
+from dataclasses import asdict, dataclass
+from typing import Annotated, Callable, Iterable, Mapping
+from uuid import UUID
 
 from datastar_py.fastapi import DatastarResponse
 from datastar_py.sse import ServerSentEventGenerator as SSE
@@ -26,7 +26,8 @@ from htpy import (
 )
 
 from ..components import clock, page_layout
-from ..store import OrderedItemTable, OrderTable, Product, ProductTable
+from ..store import Product, ProductRow, ProductTable, SessionStore, place_order
+from ..store.session import Cart
 
 router = APIRouter()
 
@@ -39,40 +40,35 @@ class OrderSession:
         price: str
         count: int = 1
 
-    items: dict[UUID, Product]
+    items: dict[int, ProductRow]
     counted_products: dict[int, CountedProduct]
     total_count: int = 0
     total_price: int = 0
 
-    def clear(self):
-        self.total_count = 0
-        self.total_price = 0
-        self.items = {}
-        self.counted_products = {}
+    @classmethod
+    def from_cart(
+        cls, cart: Cart, products: Mapping[int, ProductRow]
+    ) -> "OrderSession":
+        session = cls(items={}, counted_products={})
+        for item_id, product_id in cart.items.items():
+            # Skip products that have been deleted since they were added
+            if (product := products.get(product_id)) is not None:
+                session._add(item_id, product)
+        return session
 
     def total_price_str(self) -> str:
         return Product.to_price_str(self.total_price)
 
-    def add(self, p: Product):
+    def _add(self, item_id: int, p: ProductRow):
         self.total_count += 1
         self.total_price += p.price
-        self.items[uuid4()] = p
+        self.items[item_id] = p
         if p.product_id in self.counted_products:
             self.counted_products[p.product_id].count += 1
         else:
             counted_product = self.CountedProduct(name=p.name, price=p.price_str())
             self.counted_products[p.product_id] = counted_product
 
-    def delete(self, item_id: UUID):
-        if item_id in self.items:
-            self.total_count -= 1
-            product = self.items.pop(item_id)
-            self.total_price -= product.price
-            if self.counted_products[product.product_id].count == 1:
-                self.counted_products.pop(product.product_id)
-            else:
-                self.counted_products[product.product_id].count -= 1
-
 
 def page_register(req: Request) -> HTMLElement:
     return page_layout(
@@ -83,7 +79,7 @@ def page_register(req: Request) -> HTMLElement:
 
 
 def register(
-    req: Request, products: list[Product], session: OrderSession
+    req: Request, products: list[ProductRow], session: OrderSession
 ) -> HTMLElement:
     inner = div(id="register", class_="h-dvh flex flex-row")[
         main(
@@ -125,7 +121,7 @@ def register(
 
 
 def order_session(session: OrderSession) -> Element:
-    def item(item_id: UUID, product: Product):
+    def item(item_id: int, product: ProductRow):
         return li(id=f"item-{item_id}", class_="flex justify-between")[
             div(
                 class_="overflow-x-auto whitespace-nowrap sm:flex sm:flex-1 sm:justify-between p-4"
@@ -285,37 +281,50 @@ def error_modal(message: str) -> Element:
     ]
 
 
-# NOTE: Do NOT store this data in database because the data is transient and should be kept in memory
-order_sessions: dict[UUID, OrderSession] = {}
 SESSION_COOKIE_KEY = "session_key"
+SessionKey = Annotated[UUID, Cookie()]
 
 
-async def order_session_dep(session_key: Annotated[UUID, Cookie()]) -> OrderSession:
-    if (order_session := order_sessions.get(session_key)) is None:
+async def cart_dep(session_key: SessionKey) -> Cart:
+    if (cart := await SessionStore.get(session_key)) is None:
         raise HTTPException(status_code=404, detail=f"Session {session_key} not found")
-    return order_session
+    return cart
+
+
+async def _update_cart(session_key: UUID, change: Callable[[Cart], object]) -> Cart:
+    # Read, changed and written back in one go, so that taps in quick succession
+    # are not lost
+    if (cart := await SessionStore.update(session_key, change)) is None:
+        raise HTTPException(status_code=404, detail=f"Session {session_key} not found")
+    return cart
+
 
+CartDeps = Annotated[Cart, Depends(cart_dep)]
 
-SessionDeps = Annotated[OrderSession, Depends(order_session_dep)]
+
+async def _order_session(cart: Cart) -> OrderSession:
+    products = await ProductTable.by_product_ids(cart.items.values())
+    return OrderSession.from_cart(cart, products)
 
 
 @router.get("/register", response_class=HTMLResponse)
 async def instruct_creation_of_new_session_or_get_existing_session(
     request: Request, session_key: Annotated[UUID | None, Cookie()] = None
 ):
-    if session_key is None or (session := order_sessions.get(session_key)) is None:
+    if session_key is None or (cart := await SessionStore.get(session_key)) is None:
         return HTMLResponse(page_register(request))
 
     products = await ProductTable.select_all()
+    session = OrderSession.from_cart(cart, {p.product_id: p for p in products})
     return HTMLResponse(register(request, products, session))
 
 
 @router.get("/register/confirm-modal")
-async def get_confirm_dialog(session: SessionDeps):
-    if session.total_count == 0:
+async def get_confirm_dialog(cart: CartDeps):
+    if not cart.items:
         fragment = error_modal("商品が選択されていません")
     else:
-        fragment = confirm_modal(session)
+        fragment = confirm_modal(await _order_session(cart))
     return DatastarResponse(SSE.patch_elements(fragment))
 
 
@@ -323,63 +332,63 @@ async def get_confirm_dialog(session: SessionDeps):
 async def create_new_session_or_place_order(
     session_key: Annotated[UUID | None, Cookie()] = None,
 ):
-    if session_key is None or (session := order_sessions.get(session_key)) is None:
-        session_key = _create_new_session()
+    if session_key is None or (cart := await SessionStore.get(session_key)) is None:
+        session_key = await SessionStore.create()
 
         res = DatastarResponse(SSE.execute_script("location.reload()"))
         res.headers["location"] = "/register"
         res.set_cookie(SESSION_COOKIE_KEY, str(session_key))
         return res
 
-    if session.total_count == 0:
+    if not cart.items:
         fragment = error_modal("商品が選択されていません")
         return DatastarResponse(SSE.patch_elements(fragment))
 
-    order_sessions.pop(session_key)
-    res = await _place_order(session)
+    # Of the requests confirming the same cart, e.g. on a double tap, only the
+    # one that takes it out of the store places the order.
+    if (cart := await SessionStore.pop(session_key)) is None:
+        return DatastarResponse()
+    res = await _place_order(cart)
     res.delete_cookie(SESSION_COOKIE_KEY)
     return res
 
 
-def _create_new_session() -> UUID:
-    session_key = uuid4()
-    order_sessions[session_key] = OrderSession(items={}, counted_products={})
-    return session_key
-
-
-async def _place_order(session: SessionDeps) -> Response:
-    product_ids = [item.product_id for item in session.items.values()]
-    order_id = await OrderedItemTable.issue(product_ids)
+async def _place_order(cart: Cart) -> Response:
     # TODO: add a branch for out of stock error
-    await OrderTable.insert(order_id)
-    fragment = issued_modal(order_id, session)
+    order_id = await place_order(cart.product_ids())
+    fragment = issued_modal(order_id, await _order_session(cart))
     return DatastarResponse(SSE.patch_elements(fragment))
 
 
 @router.post("/register/items")
-async def add_session_item(session: SessionDeps, product_id: int) -> Response:
-    if (product := await ProductTable.by_product_id(product_id)) is None:
+async def add_session_item(session_key: SessionKey, product_id: int) -> Response:
+    if await ProductTable.by_product_id(product_id) is None:
         raise HTTPException(status_code=404, detail=f"Product {product_id} not found")
 
-    session.add(product)
-    fragment = order_session(session)
+    cart = await _update_cart(session_key, lambda cart: cart.add(product_id))
+    fragment = order_session(await _order_session(cart))
     return DatastarResponse(SSE.patch_elements(fragment))
 
 
 @router.delete("/register/items/{item_id}")
-async def delete_session_item(session: SessionDeps, item_id: UUID):
-    session.delete(item_id)
-    fragment = order_session(session)
+async def delete_session_item(session_key: SessionKey, item_id: int):
+    cart = await _update_cart(session_key, lambda cart: cart.delete(item_id))
+    fragment = order_session(await _order_session(cart))
     return DatastarResponse(SSE.patch_elements(fragment))
 
 
 @router.delete("/register/items")
-async def clear_session_items(session: SessionDeps) -> Response:
-    session.clear()
-    fragment = order_session(session)
+async def clear_session_items(session_key: SessionKey) -> Response:
+    await _update_cart(session_key, Cart.clear)
+    fragment = order_session(OrderSession(items={}, counted_products={}))
     return DatastarResponse(SSE.patch_elements(fragment))
 
 
+@router.get("/register/sessions/stats")
+async def get_session_stats() -> dict[str, int]:
+    return asdict(await SessionStore.stats())
+
+
 # TODO: add proper path operation for order deferral
 # # TODO: Store this data in database
 # deferred_order_sessions: dict[int, OrderSession] = {}
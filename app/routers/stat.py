@@ -1,17 +1,27 @@
+import asyncio
 import csv
-from dataclasses import dataclass
+import io
+import time
+import uuid
+import zlib
+from contextlib import aclosing
+from dataclasses import asdict, dataclass
 from datetime import datetime
 from functools import lru_cache
 from pathlib import Path
-from typing import Annotated, Literal, Mapping
+from typing import Annotated, AsyncIterable, AsyncIterator, Literal, Mapping
 
 import sqlalchemy
 import sqlalchemy.sql.expression as sa_exp
 from sqlalchemy.sql.functions import func as sa_func
 from datastar_py.fastapi import DatastarResponse
+from datastar_py.sse import DatastarEvent
 from datastar_py.sse import ServerSentEventGenerator as SSE
 from fastapi import APIRouter, Header, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import (
+    FileResponse,
+    HTMLResponse,
+)
 from htpy import (
     Element,
     HTMLElement,
@@ -34,11 +44,25 @@ from htpy import (
 )
 
 from ..components import clock, page_layout
-from ..store import Order, OrderedItem, Product, database, unixepoch
+from ..store import (
+    Order,
+    Product,
+    SalesRollup,
+    ServiceTimeRollup,
+    archive,
+    columnar,
+    EPOCH_MS_NOW,
+    OrderTable,
+    read_pool,
+    version_of,
+)
+from ..store.order import ModifiedFlag
 
 router = APIRouter()
 
-CSV_OUTPUT_PATH = Path("./static/stat.csv")
+# Stored exports named after the database and the version of the data they hold
+EXPORT_CACHE_DIR = Path("./db/exports")
+EXPORT_CHUNK_SIZE = 64 * 1024
 GRAPH_OUTPUT_PATH = Path("./static/sales.png")
 
 
@@ -79,7 +103,7 @@ def page_stat(req: Request, stat: Stat) -> HTMLElement:
                 ],
                 li(class_="hidden sm:block")[
                     a(
-                        href="/static/stat.csv",
+                        href="/stat/orders.csv",
                         class_="px-2 py-1 text-white bg-blue-600 rounded-lg",
                     )["売上データの取得"]
                 ],
@@ -159,7 +183,7 @@ def _stat_table(stat: Stat) -> Element:
 
 def page_wait_estimate(req: Request) -> HTMLElement:
     inner_header = header(
-        {"data-on-interval__duration.5s.leading": "@get('/wait-estimates')"},
+        data_on_load="@get('/wait-estimates/stream')",
         class_="sticky z-10 inset-0 w-full px-16 py-3 border-b border-gray-500 bg-white text-2xl",
     )[
         ul(class_="flex flex-row")[
@@ -189,8 +213,8 @@ def wait_estimate_component(estimate: str, waiting_order_count: int) -> Element:
     ]
 
 
-def convert_unixepoch_to_localtime(unixepoch_time: int) -> str:
-    local_time = datetime.fromtimestamp(unixepoch_time).astimezone()
+def convert_epoch_ms_to_localtime(epoch_ms: int) -> str:
+    local_time = datetime.fromtimestamp(epoch_ms / 1000).astimezone()
     return local_time.strftime("%Y-%m-%d %H:%M:%S")
 
 
@@ -202,72 +226,170 @@ def zero_if_null[T](v: T | None) -> T | Literal[0]:
     return v if v is not None else 0
 
 
-# TODO: Use async operations for writing csv rows so that this function does not block
-async def export_orders():
-    query = """
-    SELECT 
-        orders.order_id,
-        ordered_items.item_no,
-        unixepoch(orders.ordered_at) AS ordered_at,
-        unixepoch(orders.completed_at) AS completed_at,
-        ordered_items.product_id,
-        products.name,
-        products.price
-    FROM
-        orders
-    INNER JOIN
-        ordered_items ON orders.order_id = ordered_items.order_id
-    INNER JOIN
-        products ON ordered_items.product_id = products.product_id
-    WHERE
-        orders.canceled_at IS NULL
-    ORDER BY
-        orders.order_id ASC;
+ORDERS_EXPORT_COLUMNS = (
+    "order_id",
+    "item_no",
+    "ordered_at",
+    "completed_at",
+    "product_id",
+    "name",
+    "price",
+)
+# All the orders, including the archived ones
+ORDERS_EXPORT_QUERY = f"""
+SELECT
+    orders.order_id,
+    ordered_items.item_no,
+    orders.ordered_at,
+    orders.completed_at,
+    ordered_items.product_id,
+    products.name,
+    products.price
+FROM
+    {archive.ALL_ORDERS} AS orders
+INNER JOIN
+    {archive.ALL_ORDERED_ITEMS} AS ordered_items ON orders.order_id = ordered_items.order_id
+INNER JOIN
+    products ON ordered_items.product_id = products.product_id
+WHERE
+    orders.canceled_at IS NULL
+ORDER BY
+    orders.order_id ASC
+"""
+_tables_version = version_of("orders", "ordered_items", "products").compile(
+    compile_kwargs={"literal_binds": True}
+)
+# Prefixed with the id that `app.store` gives each database, since the versions
+# start over in a new one
+_EXPORT_VERSION_QUERY = f"SELECT (SELECT user_version FROM pragma_user_version) || '-' || ({_tables_version})"
+
+
+async def export_orders(gzip: bool) -> FileResponse:
     """
+    Write the orders as CSV straight from the cursor, a chunk at a time, to a
+    file stored under the current version of the tables they are read from,
+    and serve that file. Later downloads are served from it until any of the
+    tables change. The connection goes back to the pool before the download
+    starts, so slow clients hold neither it nor a read transaction.
+    """
+    suffix = ".csv.gz" if gzip else ".csv"
+    media_type = "application/gzip" if gzip else "text/csv"
+
+    # Read before the orders, so the file never holds older data than its name
+    # says; it may hold newer data, which is harmless.
+    version = await read_pool.fetch_val(_EXPORT_VERSION_QUERY)
+    cached = EXPORT_CACHE_DIR / f"orders-{version}{suffix}"
+    if not cached.exists():
+        chunks = _csv_chunks()
+        if gzip:
+            chunks = _gzip_chunks(chunks)
+        await _write_chunks(chunks, cached)
+    return FileResponse(cached, media_type=media_type, filename=f"orders{suffix}")
+
+
+async def _csv_chunks() -> AsyncIterator[bytes]:
+    buffer = io.StringIO(newline="")
+    csv_writer = csv.writer(buffer)
+    csv_writer.writerow(ORDERS_EXPORT_COLUMNS)
+    async with aclosing(read_pool.iterate(ORDERS_EXPORT_QUERY)) as rows:
+        async for row in rows:
+            csv_writer.writerow(_filtered_row(row))
+            if buffer.tell() >= EXPORT_CHUNK_SIZE:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue().encode()
 
-    with open(CSV_OUTPUT_PATH, "w", newline="") as csv_file:
-        csv_writer = csv.writer(csv_file)
 
-        async_gen = database.iterate(query)
-        if (row := await anext(async_gen, None)) is None:
-            return
+async def _gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)  # gzip container
+    async for chunk in chunks:
+        if compressed := compressor.compress(chunk):
+            yield compressed
+    yield compressor.flush()
 
-        headers = [key for key in dict(row).keys()]
-        csv_writer.writerow(headers)
 
-        csv_writer.writerow(_filtered_row(row))
-        async for row in async_gen:
-            csv_writer.writerow(_filtered_row(row))
+async def _write_chunks(chunks: AsyncIterator[bytes], path: Path) -> None:
+    """
+    Write the chunks to `path`, which only appears once the last chunk has been
+    written, i.e. never for a failed export.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    part = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+    try:
+        with open(part, "wb") as f:
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+        part.replace(path)
+    finally:
+        part.unlink(missing_ok=True)
+
+    _remove_stale_exports(path)
+
+
+async def export_order_columns() -> FileResponse:
+    """
+    The orders in the `app.store.columnar` layout, stored under the current
+    version of the tables like the CSV export.
+    """
+    version = await read_pool.fetch_val(_EXPORT_VERSION_QUERY)
+    path = EXPORT_CACHE_DIR / f"orders-{version}.mcol"
+    if not path.exists():
+        async with read_pool.connection() as connection:
+            columns = await columnar.fetch(connection, archived=True)
+        await asyncio.to_thread(_write_order_columns, columns, path)
+    return FileResponse(
+        path, media_type="application/octet-stream", filename="orders.mcol"
+    )
+
+
+def _write_order_columns(columns: columnar.OrderColumns, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    part = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+    try:
+        with open(part, "wb") as f:
+            columnar.write(columns, f)
+        part.replace(path)
+    finally:
+        part.unlink(missing_ok=True)
+    _remove_stale_exports(path)
+
+
+def _remove_stale_exports(path: Path) -> None:
+    for stale in path.parent.glob(f"orders-*{''.join(path.suffixes)}"):
+        if stale != path:
+            stale.unlink(missing_ok=True)
 
 
 def _filtered_row(row: Mapping) -> list:
     filtered_row = []
     for column_name, value in dict(row).items():
         if column_name in ("ordered_at", "completed_at") and value is not None:
-            value = convert_unixepoch_to_localtime(value)
+            value = convert_epoch_ms_to_localtime(value)
         filtered_row.append(value)
     return filtered_row
 
 
-_ordered_today = sa_func.date(Order.ordered_at, "localtime") == sa_func.date(
-    "now", "localtime"
-)
+# Reads the rollups maintained alongside the orders instead of the order history,
+# so this costs the same whether a hundred or a million items have been sold.
+_sold_today = SalesRollup.business_day == sa_func.date("now", "localtime")
 TOTAL_SALES_QUERY: sqlalchemy.Compiled = (
     sa_exp.select(Product.product_id)
-    .select_from(sa_exp.join(OrderedItem, Order))
-    .join(Product)
+    .select_from(
+        sa_exp.join(SalesRollup, Product, SalesRollup.product_id == Product.product_id)
+    )
     .add_columns(
-        sa_func.count(Product.product_id).label("count"),
-        sa_func.count(Product.product_id).filter(_ordered_today).label("count_today"),
+        sa_func.sum(SalesRollup.count).label("count"),
+        sa_func.sum(SalesRollup.count).filter(_sold_today).label("count_today"),
         Product.name,
         Product.filename,
         Product.price,
-        sa_func.sum(Product.price).label("total_sales"),
-        sa_func.sum(Product.price).filter(_ordered_today).label("total_sales_today"),
+        sa_func.sum(SalesRollup.revenue).label("total_sales"),
+        sa_func.sum(SalesRollup.revenue).filter(_sold_today).label("total_sales_today"),
         Product.no_stock,
     )
-    .where(Order.canceled_at.is_(None))
     .group_by(Product.product_id)
+    .having(sa_func.sum(SalesRollup.count) > 0)
     .compile(compile_kwargs={"literal_binds": True})
 )
 
@@ -276,29 +398,39 @@ class AvgServiceTimeQuery:
     @classmethod
     @lru_cache(1)
     def all_and_recent(cls) -> sqlalchemy.Compiled:
-        return (
-            sa_exp.select(
-                sa_func.avg(cls._service_time_diff).label("all"),
-                sa_func.avg(cls._last_30mins).label("recent"),
-            )
-            .where(Order.completed_at.isnot(None))
-            .compile()
+        # Over all time from the rollups, which count the archived orders as
+        # well, so this costs the same however many orders have been completed.
+        # The recent orders are read as in `recent`.
+        all_time = sa_exp.select(
+            sa_func.total(ServiceTimeRollup.total_ms)
+            / sa_func.sum(ServiceTimeRollup.count)
+        ).scalar_subquery()
+        recent = (
+            sa_exp.select(sa_func.avg(cls._service_time_ms))
+            .where(cls._completed_recently)
+            .scalar_subquery()
         )
+        return sa_exp.select(all_time.label("all"), recent.label("recent")).compile()
 
     @classmethod
     @lru_cache(1)
     def recent(cls) -> sqlalchemy.Compiled:
+        # A range of `completed_at`, so only the recent orders are read through
+        # `ix_orders_completed_at`. The oldest of them is the first to leave the
+        # window.
         return (
-            sa_exp.select(sa_func.avg(cls._last_30mins).label("recent"))
-            .where(Order.completed_at.isnot(None))
+            sa_exp.select(
+                sa_func.avg(cls._service_time_ms).label("recent"),
+                sa_func.min(Order.completed_at).label("oldest"),
+            )
+            .where(cls._completed_recently)
             .compile()
         )
 
-    _service_time_diff = unixepoch(Order.completed_at) - unixepoch(Order.ordered_at)
-    _elapsed_secs = sa_func.unixepoch() - unixepoch(Order.completed_at)
-    _last_30mins = sa_exp.case(
-        (_elapsed_secs / sa_exp.text("60") < sa_exp.text("30"), _service_time_diff)
-    )
+    RECENT_WINDOW_MS = 30 * 60 * 1000
+    _recent_cutoff = sa_exp.literal_column(f"{EPOCH_MS_NOW} - {RECENT_WINDOW_MS}")
+    _service_time_ms = Order.completed_at - Order.ordered_at
+    _completed_recently = Order.completed_at >= _recent_cutoff
 
     @staticmethod
     def seconds_to_jpn_mmss(secs: int) -> str:
@@ -313,7 +445,7 @@ async def construct_stat() -> Stat:
     total_items_all_time = 0
     total_items_today = 0
 
-    async for row in database.iterate(str(TOTAL_SALES_QUERY)):
+    async for row in read_pool.iterate(str(TOTAL_SALES_QUERY)):
         product_id = row["product_id"]
         assert isinstance(product_id, int)
 
@@ -347,11 +479,11 @@ async def construct_stat() -> Stat:
 
     sales_summary_list = list(sales_summary_aggregated.values())
 
-    record = await database.fetch_one(str(AvgServiceTimeQuery.all_and_recent()))
+    record = await read_pool.fetch_one(str(AvgServiceTimeQuery.all_and_recent()))
     assert record is not None
     avg_service_time_all, avg_service_time_recent = (
-        AvgServiceTimeQuery.seconds_to_jpn_mmss(int(zero_if_null(record[0]))),
-        AvgServiceTimeQuery.seconds_to_jpn_mmss(int(zero_if_null(record[1]))),
+        AvgServiceTimeQuery.seconds_to_jpn_mmss(int(zero_if_null(record[0]) / 1000)),
+        AvgServiceTimeQuery.seconds_to_jpn_mmss(int(zero_if_null(record[1]) / 1000)),
     )
 
     return Stat(
@@ -367,10 +499,30 @@ async def construct_stat() -> Stat:
 
 @router.get("/stat", response_class=HTMLResponse)
 async def get_stat(request: Request):
-    await export_orders()
     return HTMLResponse(page_stat(request, await construct_stat()))
 
 
+@router.get("/stat/orders.csv")
+async def download_orders(gzip: bool = False) -> FileResponse:
+    return await export_orders(gzip)
+
+
+@router.get("/stat/orders.mcol")
+async def download_order_columns() -> FileResponse:
+    return await export_order_columns()
+
+
+@router.get("/stat/read-pool")
+async def get_read_pool_stats() -> dict[str, int | float]:
+    return asdict(read_pool.stats)
+
+
+@router.get("/stat/broadcast")
+async def get_broadcast_stats() -> dict[str, int | float]:
+    """How often the order boards of this worker are refreshed, see `app.bc.Pacing`."""
+    return asdict(OrderTable.modified_flag_bc.stats())
+
+
 WAITING_ORDER_COUNT_QUERY: sqlalchemy.Compiled = (
     sa_exp.select(sa_func.count(Order.order_id))
     .where(Order.completed_at.is_(None) & Order.canceled_at.is_(None))
@@ -378,24 +530,119 @@ WAITING_ORDER_COUNT_QUERY: sqlalchemy.Compiled = (
 )
 
 
+@dataclass(slots=True)
+class _Estimate:
+    generation: int  # Of `OrderTable.modified_flag_bc` when it was computed
+    event: DatastarEvent
+    # When the oldest order in the window leaves it, as in `time.time()`
+    expires_at: float | None
+
+    def is_fresh(self) -> bool:
+        return self.expires_at is None or time.time() < self.expires_at
+
+
+class _WaitEstimate:
+    """
+    The wait estimate shared by every display showing it. It is computed again
+    only after an order has been placed or resolved, or once the window of
+    recent orders has moved on, by whichever display asks first; the others
+    wait for the same computation.
+    """
+
+    def __init__(self):
+        self._generation = -1
+        self._computing: asyncio.Task[_Estimate] | None = None
+
+    async def get(self, changed_at: int) -> _Estimate:
+        """
+        The estimate as of the generation of `OrderTable.modified_flag_bc` that
+        brought the latest change known to the caller, or later.
+        """
+        task = self._computing
+        if task is None or not self._is_reusable(task, changed_at):
+            generation = OrderTable.modified_flag_bc.generation
+            task = asyncio.create_task(self._compute(generation))
+            self._computing, self._generation = task, generation
+        # One display going away does not cancel it for the others
+        return await asyncio.shield(task)
+
+    def _is_reusable(self, task: asyncio.Task[_Estimate], changed_at: int) -> bool:
+        # The task may be left over from another event loop, e.g. in the tests
+        if task.get_loop() is not asyncio.get_running_loop():
+            return False
+        if self._generation < changed_at:
+            return False
+        if not task.done():
+            return True
+        return (
+            not task.cancelled()
+            and task.exception() is None
+            and task.result().is_fresh()
+        )
+
+    @staticmethod
+    async def _compute(generation: int) -> _Estimate:
+        async with read_pool.connection() as conn, conn.transaction():
+            estimate_record = await conn.fetch_one(str(AvgServiceTimeQuery.recent()))
+            waiting_order_count = await conn.fetch_val(str(WAITING_ORDER_COUNT_QUERY))
+
+        assert estimate_record is not None
+        estimate = int(zero_if_null(estimate_record[0]) / 1000)
+
+        if estimate == 0:
+            estimate_str = "待ち時間なし"
+        else:
+            estimate_str = AvgServiceTimeQuery.seconds_to_jpn_mmss(estimate)
+
+        expires_at = None
+        if (oldest := estimate_record[1]) is not None:
+            expires_at = (oldest + AvgServiceTimeQuery.RECENT_WINDOW_MS + 1) / 1000
+
+        fragment = wait_estimate_component(estimate_str, waiting_order_count)
+        return _Estimate(generation, SSE.patch_elements(fragment), expires_at)
+
+
+wait_estimate = _WaitEstimate()
+
+# The estimate and the number of waiting orders stay the same otherwise
+_WAITING_ORDERS_CHANGED = (
+    ModifiedFlag.INCOMING | ModifiedFlag.RESOLVED | ModifiedFlag.PUT_BACK
+)
+
+
 @router.get("/wait-estimates", response_class=HTMLResponse)
 async def get_estimates(
     request: Request, datastar_request: Annotated[str | None, Header()] = None
 ):
     if datastar_request != "true":
         return HTMLResponse(page_wait_estimate(request))
-
-    async with database.transaction():
-        estimate_record = await database.fetch_one(str(AvgServiceTimeQuery.recent()))
-        waiting_order_count = await database.fetch_val(str(WAITING_ORDER_COUNT_QUERY))
-
-    assert estimate_record is not None
-    estimate = int(zero_if_null(estimate_record[0]))
-
-    if estimate == 0:
-        estimate_str = "待ち時間なし"
-    else:
-        estimate_str = AvgServiceTimeQuery.seconds_to_jpn_mmss(estimate)
-
-    fragment = wait_estimate_component(estimate_str, waiting_order_count)
-    return DatastarResponse(SSE.patch_elements(fragment))
+    # Displays loaded before the estimates were streamed still poll for them
+    estimate = await wait_estimate.get(OrderTable.modified_flag_bc.generation)
+    return DatastarResponse(estimate.event)
+
+
+@router.get("/wait-estimates/stream")
+async def wait_estimates_stream():
+    return DatastarResponse(_wait_estimates_stream())
+
+
+async def _wait_estimates_stream() -> AsyncIterable[DatastarEvent]:
+    async with OrderTable.modified_flag_bc.attach_receiver() as flag_rx:
+        # Any value sent before is taken for a change, not knowing what it was
+        changed_at = flag_rx.generation
+        sent = await wait_estimate.get(changed_at)
+        yield sent.event
+        while True:
+            expires_at = sent.expires_at
+            delay = None if expires_at is None else max(expires_at - time.time(), 0)
+            try:
+                async with asyncio.timeout(delay):
+                    while not await flag_rx.recv() & _WAITING_ORDERS_CHANGED:
+                        pass
+                    changed_at = flag_rx.generation
+            except TimeoutError:
+                pass
+            estimate = await wait_estimate.get(changed_at)
+            if estimate.event != sent.event:
+                yield estimate.event
+            sent = estimate
@@ -1,6 +1,35 @@
+import asyncio
+import copy
+from dataclasses import replace
+from datetime import datetime
+import random
+import sqlite3
+from pathlib import Path
+
+import pytest
 import sqlparse
+from datastar_py.sse import DatastarEvent
+from fastapi import Request
 from inline_snapshot import snapshot
+from starlette.applications import Starlette
+from starlette.routing import Mount
 
+from ..store import (
+    EPOCH_MS_NOW,
+    OpenOrderState,
+    OrderTable,
+    OrderedItemTable,
+    ProductTable,
+    cancel_order,
+    delete_product,
+    place_order,
+    reset_order,
+    supply_all_and_complete,
+    supply_and_complete_order_if_done,
+)
+from ..store import statements
+from . import orders
+from .conftest import RunWithDb
 from .orders import query_incoming, query_ordered_items_incoming, query_resolved
 
 
@@ -12,7 +41,7 @@ def test_incoming_ordered_items_query():
     assert format_sql(str(query_ordered_items_incoming)) == snapshot(
         """\
 SELECT ordered_items.order_id, ordered_items.product_id, count(ordered_items.product_id) AS COUNT,
-       products.name, products.filename, unixepoch(orders.ordered_at) AS ordered_at
+       products.name, products.filename, orders.ordered_at
 FROM ordered_items
 JOIN products ON products.product_id = ordered_items.product_id
 JOIN orders ON orders.order_id = ordered_items.order_id
@@ -28,8 +57,8 @@ ORDER BY ordered_items.product_id ASC, ordered_items.order_id ASC\
 def test_incoming_orders_query():
     assert format_sql(str(query_incoming)) == snapshot(
         """\
-SELECT orders.order_id, unixepoch(orders.ordered_at) AS ordered_at, ordered_items.product_id,
-       unixepoch(ordered_items.supplied_at) AS supplied_at, count(ordered_items.product_id) AS COUNT, products.name
+SELECT orders.order_id, orders.ordered_at, ordered_items.product_id, ordered_items.supplied_at,
+       count(ordered_items.product_id) AS COUNT, products.name
 FROM orders
 JOIN ordered_items ON orders.order_id = ordered_items.order_id
 JOIN products ON products.product_id = ordered_items.product_id
@@ -44,9 +73,9 @@ ORDER BY orders.order_id ASC, ordered_items.product_id ASC\
 def test_resolved_orders_query():
     assert format_sql(str(query_resolved)) == snapshot(
         """\
-SELECT orders.order_id, unixepoch(orders.ordered_at) AS ordered_at,
-       unixepoch(orders.canceled_at) AS canceled_at, unixepoch(orders.completed_at) AS completed_at, ordered_items.product_id,
-       unixepoch(ordered_items.supplied_at) AS supplied_at, count(ordered_items.product_id) AS COUNT, products.name, products.price
+SELECT orders.order_id, orders.ordered_at, orders.canceled_at, orders.completed_at,
+       ordered_items.product_id, ordered_items.supplied_at, count(ordered_items.product_id) AS COUNT,
+       products.name, products.price
 FROM orders
 JOIN ordered_items ON orders.order_id = ordered_items.order_id
 JOIN products ON products.product_id = ordered_items.product_id
@@ -56,3 +85,411 @@ GROUP BY orders.order_id, ordered_items.product_id
 ORDER BY orders.order_id ASC, ordered_items.product_id ASC\
 """
     )
+
+
+def test_statements():
+    assert {
+        name: format_sql(statement.sql)
+        for name, statement in sorted(statements.registry.items())
+    } == snapshot(
+        {
+            "order.by_order_id": """\
+SELECT orders.order_id, orders.ordered_at, orders.canceled_at, orders.completed_at, orders.id
+FROM orders
+WHERE orders.order_id = :order_id\
+""",
+            "order.cancel": """\
+UPDATE orders
+SET canceled_at=:at, completed_at=NULL
+WHERE orders.order_id = :order_id\
+""",
+            "order.complete": """\
+UPDATE orders
+SET canceled_at=NULL, completed_at=:at
+WHERE orders.order_id = :order_id\
+""",
+            "order.reset": """\
+UPDATE orders
+SET canceled_at=NULL, completed_at=NULL
+WHERE orders.order_id = :order_id\
+""",
+            "order.select_all": """\
+SELECT orders.order_id, orders.ordered_at, orders.canceled_at, orders.completed_at, orders.id
+FROM orders\
+""",
+            "ordered_item.by_order_id": """\
+SELECT ordered_items.order_id, ordered_items.item_no, ordered_items.product_id, ordered_items.supplied_at,
+       ordered_items.price, ordered_items.id
+FROM ordered_items
+WHERE ordered_items.order_id = :order_id\
+""",
+            "ordered_item.select_all": """\
+SELECT ordered_items.order_id, ordered_items.item_no, ordered_items.product_id, ordered_items.supplied_at,
+       ordered_items.price, ordered_items.id
+FROM ordered_items\
+""",
+            "orders.one_resolved": """\
+SELECT orders.order_id, orders.ordered_at, orders.canceled_at, orders.completed_at,
+       ordered_items.product_id, ordered_items.supplied_at, count(ordered_items.product_id) AS COUNT,
+       products.name, products.price
+FROM orders
+JOIN ordered_items ON orders.order_id = ordered_items.order_id
+JOIN products ON products.product_id = ordered_items.product_id
+WHERE (orders.canceled_at IS NOT NULL
+       OR orders.completed_at IS NOT NULL)
+  AND orders.order_id = :order_id
+GROUP BY orders.order_id, ordered_items.product_id
+ORDER BY orders.order_id ASC, ordered_items.product_id ASC\
+""",
+            "product.select_all": """\
+SELECT products.product_id, products.name, products.filename, products.price, products.no_stock,
+       products.id
+FROM products
+ORDER BY products.product_id ASC\
+""",
+        }
+    )
+
+
+def test_resolved_order_statements(run_with_db: RunWithDb) -> None:
+    async def main():
+        for _ in range(3):
+            await place_order([1, 2, 2])
+        await cancel_order(1)
+        await supply_all_and_complete(2)
+
+        resolved = copy.deepcopy(await orders.load_resolved_orders())
+        assert [order["order_id"] for order in resolved] == [1, 2]
+        for order in resolved:
+            order_id = order["order_id"]
+            assert isinstance(order_id, int)
+            assert await orders.load_one_resolved_order(order_id) == order
+        assert await orders.load_one_resolved_order(3) is None
+
+        canceled, completed = (
+            await OrderTable.by_order_id(1),
+            await OrderTable.by_order_id(2),
+        )
+        assert canceled is not None and completed is not None
+        assert canceled.completed_at is None and canceled.canceled_at is not None
+        assert completed.completed_at is not None and completed.canceled_at is None
+        assert canceled.ordered_at <= canceled.canceled_at
+        await reset_order(1)
+        assert await OrderTable.by_order_id(1) == replace(canceled, canceled_at=None)
+
+        items = await OrderedItemTable.by_order_id(2)
+        assert [(i.item_no, i.product_id) for i in items] == [
+            (0, 1),
+            (1, 2),
+            (2, 2),
+        ]
+        assert all(i.supplied_at is not None for i in items)
+        assert items == [
+            i for i in await OrderedItemTable.select_all() if i.order_id == 2
+        ]
+
+    run_with_db(main)
+
+
+def test_resolved_orders_pages(
+    run_with_db: RunWithDb, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(orders, "RESOLVED_PAGE_SIZE", 2)
+
+    async def load_all(filter: orders.ResolvedFilter) -> list[int]:
+        order_ids: list[int] = []
+        before = None
+        while True:
+            page, before = await orders.load_resolved_orders_page(filter, before)
+            for order in page:
+                order_id = order["order_id"]
+                assert isinstance(order_id, int)
+                order_ids.append(order_id)
+            if before is None:
+                return order_ids
+
+    async def main():
+        for _ in range(7):
+            await place_order([1, 2])
+        for order_id in (2, 5):
+            await cancel_order(order_id)
+        for order_id in (1, 3, 4, 7):
+            await supply_all_and_complete(order_id)
+
+        resolved = copy.deepcopy(await orders.load_resolved_orders())
+        page, before = await orders.load_resolved_orders_page(orders.ResolvedFilter())
+        assert page == resolved[::-1][:2] and before == 5
+
+        ResolvedFilter = orders.ResolvedFilter
+        assert await load_all(ResolvedFilter()) == [7, 5, 4, 3, 2, 1]
+        assert await load_all(ResolvedFilter("completed")) == [7, 4, 3, 1]
+        assert await load_all(ResolvedFilter("canceled")) == [5, 2]
+        ordered_at = (await OrderTable.by_order_id(1)).ordered_at  # type: ignore
+        day = datetime.fromtimestamp(ordered_at / 1000).replace(hour=0, minute=0)
+        assert await load_all(ResolvedFilter(since=day)) == [7, 5, 4, 3, 2, 1]
+        assert await load_all(ResolvedFilter(until=day)) == []
+
+    run_with_db(main)
+
+
+@pytest.mark.parametrize(
+    "filter, indexes",
+    [
+        (orders.ResolvedFilter(), ["ix_orders_resolved"]),
+        (orders.ResolvedFilter("canceled"), ["ix_orders_resolved"]),
+        (
+            orders.ResolvedFilter(
+                since=datetime(2024, 1, 1), until=datetime(2024, 1, 2)
+            ),
+            ["ix_orders_resolved", "ix_orders_ordered_at", "ix_orders_ordered_at"],
+        ),
+    ],
+)
+def test_resolved_orders_page_query_plan(
+    workdir: Path,
+    run_with_db: RunWithDb,
+    filter: orders.ResolvedFilter,
+    indexes: list[str],
+) -> None:
+    run_with_db(lambda: asyncio.sleep(0))  # For the schema
+    query = filter.page_query(before=100)
+    sql = str(query.compile(compile_kwargs={"literal_binds": True}))
+    with sqlite3.connect(workdir / "db" / "app.db") as conn:
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+    # No step scans the whole table
+    assert [step.split(" INDEX ")[1].split()[0] for step in plan if "ix_" in step] == (
+        indexes
+    )
+    assert not any(step.startswith("SCAN") for step in plan)
+
+
+async def _assert_parity() -> None:
+    from_db = copy.deepcopy(await orders.load_incoming_orders_from_db())
+    assert await orders.load_incoming_orders() == from_db
+    from_db = copy.deepcopy(await orders.load_ordered_items_incoming_from_db())
+    assert await orders.load_ordered_items_incoming() == from_db
+
+
+def _cancel_from_another_worker(order_id: int) -> None:
+    with sqlite3.connect("db/app.db") as conn:
+        conn.execute(
+            f"UPDATE orders SET canceled_at = {EPOCH_MS_NOW} WHERE order_id = ?",
+            (order_id,),
+        )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_open_orders_parity(run_with_db: RunWithDb, seed: int) -> None:
+    rng = random.Random(seed)
+
+    async def main():
+        product_ids = [p.product_id for p in await ProductTable.select_all()]
+        order_ids: list[int] = []
+        for _ in range(200):
+            op = rng.choice(["place", "place", "supply", "supply", "all", "cancel"])
+            if op == "place" or not order_ids:
+                items = rng.choices(product_ids, k=rng.randint(1, 5))
+                order_ids.append(await place_order(items))
+                continue
+            order_id = rng.choice(order_ids)
+            if op == "supply":
+                if items := await OrderedItemTable.by_order_id(order_id):
+                    product_id = rng.choice(items).product_id
+                    await supply_and_complete_order_if_done(order_id, product_id)
+            elif op == "all":
+                await supply_all_and_complete(order_id)
+            elif rng.random() < 0.2:
+                _cancel_from_another_worker(order_id)
+            elif rng.random() < 0.5:
+                await cancel_order(order_id)
+            else:
+                await reset_order(order_id)
+            if rng.random() < 0.01:
+                await delete_product(rng.choice(product_ids))
+            await _assert_parity()
+
+    run_with_db(main)
+
+
+def _request(host: bytes) -> Request:
+    app = Starlette(routes=[Mount("/static", routes=[], name="static")])
+    return Request({"type": "http", "app": app, "headers": [(b"host", host)]})
+
+
+def _patched(cards: dict[str, str], patch: str) -> dict[str, str]:
+    """Apply `patch` to the cards on a tablet, the way Datastar would."""
+    data = dict(
+        line.removeprefix("data: ").split(" ", 1)
+        for line in patch.splitlines()
+        if line.startswith("data: ")
+    )
+    mode, selector, html = data.get("mode"), data.get("selector"), data.get("elements")
+    id = (selector or "").removeprefix("#") or html.split('id="')[1].split('"')[0]  # type: ignore
+    if mode == "remove":
+        return {k: v for k, v in cards.items() if k != id}
+    if mode is None:
+        assert id in cards
+        return cards | {id: html}  # type: ignore
+    new_id = html.split('id="')[1].split('"')[0]  # type: ignore
+    if mode == "append":
+        return cards | {new_id: html}  # type: ignore
+    assert mode == "before" and id in cards
+    items = list(cards.items())
+    at = [k for k, _ in items].index(id)
+    return dict([*items[:at], (new_id, html), *items[at:]])  # type: ignore
+
+
+def _last_event_id(events: list[DatastarEvent]) -> str | None:
+    """The `Last-Event-ID` a tablet sends back after `events`."""
+    ids = [
+        line.removeprefix("id: ")
+        for event in events
+        for line in event.splitlines()
+        if line.startswith("id: ")
+    ]
+    return ids[-1] if ids else None
+
+
+def test_boards_rendered_once_per_change(run_with_db: RunWithDb) -> None:
+    async def main():
+        await place_order([1, 2])
+        for board, added in [
+            (orders.incoming_orders_board, "data: mode append"),
+            (orders.ordered_items_board, 'data: elements <div id="product-1"'),
+        ]:
+            sent, [event] = await board.patches(_request(b"127.0.0.1"), None)
+            # Shared by the tablets whatever host name they use
+            other, [other_event] = await board.patches(
+                _request(b"murchace.local"), None
+            )
+            assert other is sent and other_event is event
+
+            await place_order([1])
+            board_1, patches_1 = await board.patches(_request(b"1"), sent)
+            board_2, patches_2 = await board.patches(_request(b"2"), sent)
+            assert board_1 is board_2 and patches_1 is patches_2
+            [patch] = patches_1
+            assert added in patch
+
+        sent, [event] = await orders.ordered_items_board.patches(
+            _request(b"127.0.0.1"), None
+        )
+        assert 'src="/static/' in event
+        _cancel_from_another_worker(1)
+        board, patches = await orders.ordered_items_board.patches(
+            _request(b"127.0.0.1"), sent
+        )
+        # Product 2 was only in order 1, while product 1 is still in order 2
+        removed, patched = patches
+        assert "data: selector #product-2" in removed
+        assert 'id="product-1"' in patched and "ordered-item-1-" not in patched
+
+    run_with_db(main)
+
+
+def test_board_resumed_from_last_event_id(
+    run_with_db: RunWithDb, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(orders, "_RESUMABLE_BOARDS", 2)
+    board = orders.incoming_orders_board
+
+    async def main():
+        await place_order([1, 2])
+        sent, events = await board.patches(_request(b"1"), None)
+        last_event_id = _last_event_id(events)
+        assert board.resumed(last_event_id) is sent
+
+        # Only the order placed while the tablet was away
+        await place_order([3])
+        stream = aiter(orders._incoming_orders_stream(_request(b"1"), last_event_id))
+        patch = await anext(stream)
+        assert "data: mode append" in patch and "order-1" not in patch
+        assert _last_event_id([patch]) != last_event_id
+
+        # Cut off halfway through the patches for two more orders
+        resumed = board.resumed(_last_event_id([patch]))
+        await place_order([1])
+        await place_order([2])
+        _, patches = await board.patches(_request(b"1"), resumed)
+        assert len(patches) == 2
+        assert board.resumed(_last_event_id(patches[:1])) is None
+        assert board.resumed(_last_event_id(patches)) is not None
+
+        for unknown in [None, "", "abc", "00000000-1", f"{last_event_id}0"]:
+            assert board.resumed(unknown) is None
+        # Too far behind for anything but the whole board
+        for _ in range(2):
+            await place_order([4])
+            await board.patches(_request(b"1"), None)
+        assert board.resumed(last_event_id) is None
+        stream = aiter(orders._incoming_orders_stream(_request(b"1"), last_event_id))
+        assert '<main id="orders"' in await anext(stream)
+
+    run_with_db(main)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_board_patches(run_with_db: RunWithDb, seed: int) -> None:
+    rng = random.Random(seed)
+
+    async def main():
+        boards = (orders.incoming_orders_board, orders.ordered_items_board)
+        tablets: list[tuple[orders._Board, dict[str, str], str | None]] = []
+        for board in boards:
+            sent, [event] = await board.patches(_request(b"127.0.0.1"), None)
+            tablets.append((sent, dict(sent.cards), _last_event_id([event])))
+
+        order_ids: list[int] = []
+        for _ in range(100):
+            op = rng.choice(["place", "place", "supply", "cancel", "reset"])
+            if op == "place" or not order_ids:
+                items = rng.choices(range(1, 6), k=rng.randint(1, 3))
+                order_ids.append(await place_order(items))
+            elif op == "supply":
+                await supply_and_complete_order_if_done(
+                    rng.choice(order_ids), rng.randint(1, 5)
+                )
+            elif op == "cancel":
+                await cancel_order(rng.choice(order_ids))
+            else:
+                await reset_order(rng.choice(order_ids))
+            if rng.random() < 0.5:
+                continue  # Let the changes pile up for the tablets
+
+            for i, board in enumerate(boards):
+                sent, cards, last_event_id = tablets[i]
+                if rng.random() < 0.2:
+                    # Reconnects with only what the tablet has been sent
+                    sent = board.resumed(last_event_id)
+                current, patches = await board.patches(_request(b"1"), sent)
+                for patch in patches:
+                    if patch is current.event:
+                        cards = dict(current.cards)
+                    else:
+                        cards = _patched(cards, patch)
+                assert list(cards.items()) == list(current.cards.items())
+                last_event_id = _last_event_id(patches) or last_event_id
+                tablets[i] = (current, cards, last_event_id)
+
+    run_with_db(main)
+
+
+def test_open_orders_kept_on_unrelated_commits(run_with_db: RunWithDb) -> None:
+    async def main():
+        await place_order([1, 2])
+        await OpenOrderState.sync()
+        version = OpenOrderState.version
+        with sqlite3.connect("db/app.db") as conn:
+            conn.execute(
+                "INSERT INTO register_sessions (session_key, cart) "
+                "VALUES ('00000000000000000000000000000000', x'')"
+            )
+        await OpenOrderState.sync()
+        assert OpenOrderState.version == version
+
+        _cancel_from_another_worker(1)
+        await OpenOrderState.sync()
+        assert OpenOrderState.version > version
+        assert OpenOrderState.orders() == []
+
+    run_with_db(main)
@@ -0,0 +1,158 @@
+import asyncio
+import multiprocessing as mp
+import sqlite3
+from dataclasses import replace
+
+import pytest
+
+from ..store import (
+    ProductTable,
+    SessionStore,
+    database,
+    delete_product,
+    place_order,
+    session,
+)
+from ..store.product import Table as CatalogTable
+from . import register
+from .conftest import RunWithDb
+
+
+async def _placed_orders() -> list[tuple[int, int]]:
+    query = """
+    SELECT orders.order_id, count(ordered_items.id)
+    FROM orders LEFT JOIN ordered_items ON orders.order_id = ordered_items.order_id
+    GROUP BY orders.id ORDER BY orders.order_id
+    """
+    return [(row[0], row[1]) for row in await database.fetch_all(query)]
+
+
+async def _place_through_register(product_id: int) -> None:
+    session_key = await SessionStore.create()
+    await register.add_session_item(session_key, product_id)
+    await register.create_new_session_or_place_order(session_key)
+
+
+def test_parallel_register_placements(run_with_db: RunWithDb) -> None:
+    count = 2000
+
+    async def main():
+        await asyncio.gather(*(_place_through_register(1) for _ in range(count)))
+        placed = await _placed_orders()
+        sessions = await database.fetch_all("SELECT * FROM register_sessions")
+        assert placed == [(order_id, 1) for order_id in range(1, count + 1)]
+        assert sessions == []
+
+    run_with_db(main)
+
+
+def test_concurrent_taps_on_one_cart(
+    run_with_db: RunWithDb, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    async def main():
+        memory = session.MemoryStore(idle_ttl_secs=60, max_count=10)
+        for store in [SessionStore, memory]:
+            monkeypatch.setattr(register, "SessionStore", store)
+            session_key = await store.create()
+            await asyncio.gather(
+                *(register.add_session_item(session_key, 1) for _ in range(10))
+            )
+            cart = await store.get(session_key)
+            assert cart is not None and cart.product_ids() == [1] * 10
+
+            # A double tap on the confirm button places a single order
+            await asyncio.gather(
+                *(
+                    register.create_new_session_or_place_order(session_key)
+                    for _ in range(2)
+                )
+            )
+        assert await _placed_orders() == [(1, 10), (2, 10)]
+
+    run_with_db(main)
+
+
+def _worker(count: int) -> None:
+    async def main():
+        await database.connect()
+        await asyncio.gather(*(place_order([1, 2]) for _ in range(count)))
+        await database.disconnect()
+
+    asyncio.run(main())
+
+
+def test_placements_from_multiple_workers(run_with_db: RunWithDb) -> None:
+    workers, count = 4, 50
+
+    def run_workers() -> None:
+        ctx = mp.get_context("spawn")
+        procs = [ctx.Process(target=_worker, args=(count,)) for _ in range(workers)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        assert all(proc.exitcode == 0 for proc in procs)
+
+    async def main():
+        await asyncio.to_thread(run_workers)
+        return await _placed_orders()
+
+    placed = run_with_db(main)
+    assert placed == [(order_id, 2) for order_id in range(1, workers * count + 1)]
+
+
+def test_database_session_eviction(run_with_db: RunWithDb) -> None:
+    async def main():
+        lru = session.Table(database, idle_ttl_secs=60, max_count=2)
+        keys = [await lru.create() for _ in range(3)]
+        assert await lru.evict() == 1
+        assert await lru.get(keys[0]) is None
+        assert await lru.stats() == session.Stats(count=2, cart_bytes=8)
+
+        idle = session.Table(database, idle_ttl_secs=0, max_count=2)
+        assert await idle.evict() == 2
+        assert await idle.stats() == session.Stats(count=0, cart_bytes=0)
+
+        # Looking at a cart counts as a use, as in the memory store
+        viewed, unused = await lru.create(), await lru.create()
+        await database.execute(
+            "UPDATE register_sessions SET updated_at = datetime('now', '-1 hour')"
+        )
+        assert await lru.get(viewed) == session.Cart()
+        assert await lru.evict() == 1
+        assert await lru.get(unused) is None
+
+    run_with_db(main)
+
+
+def test_catalog_cache(run_with_db: RunWithDb) -> None:
+    async def main():
+        product = await ProductTable.by_product_id(1)
+        assert product is not None
+
+        # A change made elsewhere is only picked up once its version arrives
+        with sqlite3.connect("db/app.db") as conn:
+            conn.execute("UPDATE products SET price = 1 WHERE product_id = 1")
+            (version,) = conn.execute(
+                "SELECT version FROM table_versions WHERE name = 'products'"
+            ).fetchone()
+        assert await ProductTable.by_product_id(1) is product
+        ProductTable.modified_version_bc.send_local(version)
+        assert (await ProductTable.by_product_ids([1]))[1].price == 1
+
+        await ProductTable.update(1, replace(product, price=2))
+        assert ProductTable.modified_version_bc.shared.value > version
+        assert (await ProductTable.by_product_id(1)).price == 2  # type: ignore
+
+        await delete_product(1)
+        assert await ProductTable.by_product_id(1) is None
+        assert 1 not in [p.product_id for p in await ProductTable.select_all()]
+
+        # Or once the version has been read again, in case it was lost
+        rechecked = CatalogTable(database, recheck_secs=0)
+        assert (await rechecked.by_product_id(2)) is not None
+        with sqlite3.connect("db/app.db") as conn:
+            conn.execute("UPDATE products SET price = 3 WHERE product_id = 2")
+        assert (await rechecked.by_product_id(2)).price == 3  # type: ignore
+
+    run_with_db(main)
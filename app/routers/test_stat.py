@@ -1,7 +1,46 @@
+import asyncio
+import csv
+import gzip
+import io
+import random
+import sqlite3
+import time
+from dataclasses import asdict, replace
+from pathlib import Path
+
+import pytest
 import sqlparse
 from inline_snapshot import snapshot
 
-from .stat import AvgServiceTimeQuery, WAITING_ORDER_COUNT_QUERY, TOTAL_SALES_QUERY
+from ..store import (
+    EPOCH_MS_NOW,
+    OrderTable,
+    Product,
+    ProductTable,
+    SalesRollup,
+    SalesRollupTable,
+    ServiceTimeRollup,
+    archive,
+    cancel_order,
+    columnar,
+    database,
+    delete_product,
+    place_order,
+    reset_order,
+    supply_all_and_complete,
+)
+from ..store.order import ModifiedFlag
+from .stat import (
+    AvgServiceTimeQuery,
+    WAITING_ORDER_COUNT_QUERY,
+    TOTAL_SALES_QUERY,
+    construct_stat,
+    export_order_columns,
+    export_orders,
+    _wait_estimates_stream,
+    wait_estimate,
+)
+from .conftest import RunWithDb
 
 
 def format_sql(sql: object):
@@ -11,21 +50,20 @@ def format_sql(sql: object):
 def test_total_sales_query():
     assert format_sql(str(TOTAL_SALES_QUERY)) == snapshot(
         """\
-SELECT products.product_id, count(products.product_id) AS COUNT,
-       count(products.product_id) FILTER (
-                                          WHERE date(orders.ordered_at,
-                                                  'localtime') = date('now',
-                                                                   'localtime')) AS count_today, products.name, products.filename, products.price,
-       sum(products.price) AS total_sales,
-       sum(products.price) FILTER (
-                                   WHERE date(orders.ordered_at,
-                                           'localtime') = date('now',
-                                                            'localtime')) AS total_sales_today, products.no_stock
-FROM ordered_items
-JOIN orders ON orders.order_id = ordered_items.order_id
-JOIN products ON products.product_id = ordered_items.product_id
-WHERE orders.canceled_at IS NULL
-GROUP BY products.product_id\
+SELECT products.product_id, sum(sales_rollups.count) AS COUNT,
+       sum(sales_rollups.count) FILTER (
+                                        WHERE sales_rollups.business_day = date('now',
+
+                                                                             'localtime')) AS count_today, products.name, products.filename, products.price,
+       sum(sales_rollups.revenue) AS total_sales,
+       sum(sales_rollups.revenue) FILTER (
+                                          WHERE sales_rollups.business_day = date('now',
+
+                                                                               'localtime')) AS total_sales_today, products.no_stock
+FROM sales_rollups
+JOIN products ON sales_rollups.product_id = products.product_id
+GROUP BY products.product_id
+HAVING sum(sales_rollups.count) > 0\
 """
     )
 
@@ -33,11 +71,9 @@ GROUP BY products.product_id\
 def test_avg_service_time_query_recent():
     assert format_sql(str(AvgServiceTimeQuery.recent())) == snapshot(
         """\
-SELECT avg(CASE
-               WHEN ((unixepoch() - unixepoch(orders.completed_at)) / CAST(60 AS NUMERIC) < 30) THEN unixepoch(orders.completed_at) - unixepoch(orders.ordered_at)
-           END) AS recent
+SELECT avg(orders.completed_at - orders.ordered_at) AS recent, min(orders.completed_at) AS oldest
 FROM orders
-WHERE orders.completed_at IS NOT NULL\
+WHERE orders.completed_at >= CAST(round((julianday('now') - 2440587.5) * 86400000) AS INTEGER) - 1800000\
 """
     )
 
@@ -45,12 +81,13 @@ WHERE orders.completed_at IS NOT NULL\
 def test_avg_service_time_query():
     assert format_sql(str(AvgServiceTimeQuery.all_and_recent())) == snapshot(
         """\
-SELECT avg(unixepoch(orders.completed_at) - unixepoch(orders.ordered_at)) AS "all",
-       avg(CASE
-               WHEN ((unixepoch() - unixepoch(orders.completed_at)) / CAST(60 AS NUMERIC) < 30) THEN unixepoch(orders.completed_at) - unixepoch(orders.ordered_at)
-           END) AS recent
-FROM orders
-WHERE orders.completed_at IS NOT NULL\
+SELECT
+  (SELECT total(service_time_rollups.total_ms) / CAST(sum(service_time_rollups.count) AS NUMERIC) AS anon_1
+   FROM service_time_rollups) AS "all",
+
+  (SELECT avg(orders.completed_at - orders.ordered_at) AS avg_1
+   FROM orders
+   WHERE orders.completed_at >= CAST(round((julianday('now') - 2440587.5) * 86400000) AS INTEGER) - 1800000) AS recent\
 """
     )
 
@@ -64,3 +101,235 @@ WHERE orders.completed_at IS NULL
   AND orders.canceled_at IS NULL\
 """
     )
+
+
+def test_wait_estimate_pushed_on_change(run_with_db: RunWithDb) -> None:
+    async def main():
+        # Closed along with the event loop
+        stream = aiter(_wait_estimates_stream())
+        # Computed once for all the displays
+        generation = OrderTable.modified_flag_bc.generation
+        first, second = await asyncio.gather(
+            wait_estimate.get(generation), wait_estimate.get(generation)
+        )
+        assert first is second and first.expires_at is None
+        assert "待ち時間なし" in await anext(stream)
+        assert "0件" in first.event
+
+        await place_order([1, 2])
+        assert "1件" in await anext(stream)
+
+        # Supplying an item changes neither, so nothing is queried
+        estimate = await wait_estimate.get(generation)
+        assert estimate.generation == generation + 1
+        OrderTable.modified_flag_bc.send(ModifiedFlag.SUPPLIED)
+        assert await wait_estimate.get(generation + 1) is estimate
+
+        # Completed 30 minutes ago, less a moment, after a minute's wait
+        completed_at = int(time.time() * 1000) - 30 * 60 * 1000 + 300
+        with sqlite3.connect("db/app.db") as conn:
+            conn.execute(
+                "UPDATE orders SET ordered_at = ?, completed_at = ?",
+                (completed_at - 60 * 1000, completed_at),
+            )
+        OrderTable.modified_flag_bc.send(ModifiedFlag.RESOLVED)
+        event = await anext(stream)
+        assert "1 分 0 秒" in event and "0件" in event
+        # Until the order leaves the window
+        assert "待ち時間なし" in await anext(stream)
+
+    run_with_db(main)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_sales_rollups_match_rebuild(run_with_db: RunWithDb, seed: int) -> None:
+    rng = random.Random(seed)
+
+    async def main():
+        product_ids = [p.product_id for p in await ProductTable.select_all()]
+        order_ids: list[int] = []
+        items_sold = 0
+        for _ in range(100):
+            ops = ["place", "place", "all", "cancel", "reset", "other", "price"]
+            op = rng.choice(ops)
+            if op == "place" or not order_ids:
+                items = rng.choices(product_ids, k=rng.randint(1, 5))
+                order_ids.append(await place_order(items))
+                items_sold += len(items)
+                continue
+            if op == "price":
+                product = await ProductTable.by_product_id(rng.choice(product_ids))
+                assert product is not None
+                price = product.price + rng.randint(-50, 1000)
+                await ProductTable.update(
+                    product.product_id, replace(product, price=price)
+                )
+                continue
+            order_id = rng.choice(order_ids)
+            if op == "all":
+                await supply_all_and_complete(order_id)
+            elif op == "cancel":
+                await cancel_order(order_id)
+            elif op == "reset":
+                await reset_order(order_id)
+            else:
+                with sqlite3.connect("db/app.db") as conn:
+                    conn.execute(
+                        f"UPDATE orders SET canceled_at = {EPOCH_MS_NOW} "
+                        "WHERE order_id = ?",
+                        (order_id,),
+                    )
+        await delete_product(rng.choice(product_ids))
+
+        maintained = [_without_id(r) for r in await SalesRollupTable.select_all()]
+        service_times = [
+            _without_id(r) for r in await SalesRollupTable.select_service_times()
+        ]
+        await SalesRollupTable.rebuild()
+        rebuilt = [_without_id(r) for r in await SalesRollupTable.select_all()]
+        assert maintained == rebuilt
+        assert service_times == [
+            _without_id(r) for r in await SalesRollupTable.select_service_times()
+        ]
+
+        query = "SELECT avg(completed_at - ordered_at) FROM orders"
+        expected = await database.fetch_val(query)
+        record = await database.fetch_one(str(AvgServiceTimeQuery.all_and_recent()))
+        assert record is not None and record[0] == pytest.approx(expected)
+
+        stat = await construct_stat()
+        assert 0 < stat.total_items_all_time <= items_sold
+        assert stat.total_items_today == stat.total_items_all_time
+        assert stat.total_items_all_time == sum(r["count"] for r in rebuilt)
+
+    run_with_db(main)
+
+
+def test_sales_rollups_after_price_change(run_with_db: RunWithDb) -> None:
+    async def main():
+        product = await ProductTable.by_product_id(1)
+        assert product is not None
+        first = await place_order([1])
+        await place_order([1])
+        await ProductTable.update(1, replace(product, price=product.price + 1000))
+
+        # Taken off at the price it was sold at
+        await cancel_order(first)
+        stat = await construct_stat()
+        assert stat.total_items_all_time == 1
+        assert stat.total_sales_all_time == Product.to_price_str(product.price)
+
+        await reset_order(first)
+        stat = await construct_stat()
+        assert stat.total_sales_all_time == Product.to_price_str(2 * product.price)
+
+    run_with_db(main)
+
+
+def _without_id(rollup: SalesRollup | ServiceTimeRollup) -> dict:
+    return asdict(rollup) | {"id": None}
+
+
+def test_export_orders_cached_per_version(run_with_db: RunWithDb) -> None:
+    async def download(compress: bool) -> tuple[Path, bytes]:
+        path = Path((await export_orders(compress)).path)
+        return path, path.read_bytes()
+
+    async def main():
+        for _ in range(3):
+            await place_order([1, 2])
+        await cancel_order(2)
+
+        path, body = await download(False)
+        rows = list(csv.reader(io.StringIO(body.decode())))
+        assert rows[0][:2] == ["order_id", "item_no"]
+        assert [row[0] for row in rows[1:]] == ["1", "1", "3", "3"]
+        mtime = path.stat().st_mtime_ns
+        assert await download(False) == (path, body)
+        assert path.stat().st_mtime_ns == mtime
+
+        gz_path, compressed = await download(True)
+        assert gzip.decompress(compressed) == body
+        assert await download(True) == (gz_path, compressed)
+
+        response = await export_order_columns()
+        columns = columnar.load(Path(response.path))
+        assert list(columns.item_order_id) == [1, 1, 3, 3]
+        assert (await export_order_columns()).path == response.path
+
+        await reset_order(2)
+        assert (await export_order_columns()).path != response.path
+        new_path, body = await download(False)
+        assert new_path != path
+        assert len(list(csv.reader(io.StringIO(body.decode())))) == 7
+        assert len(list(Path("db/exports").glob("orders-*.csv"))) == 1
+
+    run_with_db(main)
+
+
+def test_exports_not_shared_between_databases(run_with_db: RunWithDb) -> None:
+    def export(product_id: int) -> Path:
+        async def main():
+            await place_order([product_id])
+            return Path((await export_orders(False)).path)
+
+        return run_with_db(main)
+
+    first = export(1)
+    for path in Path("db").glob("*.db*"):
+        path.unlink()
+    # The table versions start over, at the same numbers for the same writes
+    second = export(2)
+    assert second != first
+    assert [row[4] for row in csv.reader(second.open())][1:] == ["2"]
+
+
+def test_archived_orders_still_counted(run_with_db: RunWithDb) -> None:
+    async def csv_rows() -> list[list[str]]:
+        body = Path((await export_orders(False)).path).read_text()
+        return list(csv.reader(io.StringIO(body)))
+
+    async def main():
+        for _ in range(5):
+            await place_order([1, 2])
+        for order_id in (1, 2, 4, 5):
+            await supply_all_and_complete(order_id)
+        await cancel_order(3)
+
+        stat = await construct_stat()
+        rows = await csv_rows()
+        columns = columnar.load(Path((await export_order_columns()).path))
+        rollups = [_without_id(r) for r in await SalesRollupTable.select_all()]
+
+        await asyncio.sleep(0.01)
+        assert await archive.Table(database, 0, 2).archive() == 4
+        # The newest order stays so that the order numbers carry on
+        assert [o.order_id for o in await OrderTable.select_all()] == [5]
+        assert await place_order([2]) == 6
+        await cancel_order(6)
+
+        assert await construct_stat() == stat
+        assert await csv_rows() == rows
+        archived = columnar.load(Path((await export_order_columns()).path))
+        assert list(archived.item_order_id) == list(columns.item_order_id)
+        assert list(archived.completed_at) == list(columns.completed_at)
+        maintained = [_without_id(r) for r in await SalesRollupTable.select_all()]
+        assert maintained == rollups
+        await SalesRollupTable.rebuild()
+        rebuilt = [_without_id(r) for r in await SalesRollupTable.select_all()]
+        assert rebuilt == rollups
+
+        await delete_product(1)
+        maintained = [_without_id(r) for r in await SalesRollupTable.select_all()]
+        service_times = [
+            _without_id(r) for r in await SalesRollupTable.select_service_times()
+        ]
+        await SalesRollupTable.rebuild()
+        rebuilt = [_without_id(r) for r in await SalesRollupTable.select_all()]
+        assert maintained == rebuilt
+        assert service_times == [
+            _without_id(r) for r in await SalesRollupTable.select_service_times()
+        ]
+        assert {r["product_id"] for r in rebuilt} == {2}
+
+    run_with_db(main)
@@ -1,44 +1,117 @@
-from datetime import datetime, timezone
+import secrets
+from pathlib import Path
 
 import sqlalchemy
-import sqlalchemy.orm as sa_orm
 import sqlalchemy.sql.expression as sae
-from databases import Database
+from sqlalchemy.dialects.sqlite import dialect as sqlite_dialect
 from sqlalchemy.sql.functions import func as sa_func
 
-from . import order, ordered_item, product
-from .base import Base
-from .order import ModifiedFlag, Order
-from .ordered_item import OrderedItem
-from .product import Product
+from ..env import (
+    ARCHIVE_AFTER_SECS,
+    ARCHIVE_BATCH_SIZE,
+    BACKUP_KEEP,
+    BACKUP_PAGES_PER_STEP,
+    BACKUP_STEP_PAUSE_SECS,
+    CATALOG_RECHECK_SECS,
+    GROUP_COMMIT_WINDOW_SECS,
+    READ_POOL_SIZE,
+    SESSION_IDLE_TTL_SECS,
+    SESSION_MAX_COUNT,
+    SESSION_STORE,
+    SQLITE_PRAGMAS,
+)
+from . import (
+    archive,
+    backup,
+    columnar,
+    open_orders,
+    order,
+    ordered_item,
+    product,
+    sales_rollup,
+    session,
+    table_version,
+)
+from .base import EPOCH_MS_NOW, Base, epoch_ms  # noqa: F401
+from .group_commit import GroupCommit
+from .connections import ReadPool, Writer, connection_factory
+from .order import ModifiedFlag, Order, OrderRow  # noqa: F401
+from .ordered_item import OrderedItem, OrderedItemRow  # noqa: F401
+from .product import Product, ProductRow  # noqa: F401
+from .sales_rollup import SalesRollup, ServiceTimeRollup  # noqa: F401
+from .table_version import version_of  # noqa: F401
 
-DATABASE_URL = "sqlite:///db/app.db"
-database = Database(DATABASE_URL)
 
-ProductTable = product.Table(database)
+DATABASE_PATH = "db/app.db"
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+ARCHIVE_PATH = "db/archive.db"
+BACKUP_DIR = Path("db/backups")
+# Indexes that the databases created before a migration dropped them still have
+_DROPPED_INDEXES = ("ix_orders_canceled",)
+database = Writer(
+    DATABASE_URL,
+    factory=connection_factory(SQLITE_PRAGMAS, {archive.SCHEMA: ARCHIVE_PATH}),
+)
+# For the order boards and the statistics, which only need committed data
+read_pool = ReadPool(
+    "sqlite:///file:db/app.db?mode=ro",
+    READ_POOL_SIZE,
+    uri=True,
+    factory=connection_factory(
+        SQLITE_PRAGMAS, {archive.SCHEMA: f"file:{ARCHIVE_PATH}?mode=ro"}
+    ),
+)
+
+ProductTable = product.Table(database, CATALOG_RECHECK_SECS)
 OrderedItemTable = ordered_item.Table(database)
 OrderTable = order.Table(database)
+SalesRollupTable = sales_rollup.Table(database)
+TableVersionTable = table_version.Table(database)
+ArchiveTable = archive.Table(database, ARCHIVE_AFTER_SECS, ARCHIVE_BATCH_SIZE)
+OpenOrderState = open_orders.OpenOrders(database)
+# Supply, complete, cancel and reset clicks tend to come in bursts from the
+# kitchen, so they are committed and broadcast in batches.
+order_writes = GroupCommit(
+    database, OrderTable.modified_flag_bc, GROUP_COMMIT_WINDOW_SECS
+)
+SessionStore: session.Store = (
+    session.MemoryStore(SESSION_IDLE_TTL_SECS, SESSION_MAX_COUNT)
+    if SESSION_STORE == "memory"
+    else session.Table(database, SESSION_IDLE_TTL_SECS, SESSION_MAX_COUNT)
+)
 
 
 async def delete_product(product_id: int):
-    async with database.transaction():
-        query = sae.delete(Product).where(Product.product_id == product_id)
-        await database.execute(query)
+    with OpenOrderState.write_through():
+        async with database.transaction():
+            # The items go first so that the sales rollups can still look up the
+            # price to take off.
+            query = sae.delete(OrderedItem).where(OrderedItem.product_id == product_id)
+            await database.execute(query)
+            await ArchiveTable._delete_product(product_id)
+            # The triggers do not see the archived items, which are still counted
+            query = sae.delete(SalesRollup).where(SalesRollup.product_id == product_id)
+            await database.execute(query)
 
-        query = sae.delete(OrderedItem).where(OrderedItem.product_id == product_id)
-        await database.execute(query)
+            query = sae.delete(Product).where(Product.product_id == product_id)
+            await database.execute(query)
+            OpenOrderState._remove_product(product_id)
+    await ProductTable._modified()
 
 
-# TODO: there should be a way to use the unixepoch function without this boiler plate
-def unixepoch(attr: sa_orm.Mapped) -> sqlalchemy.Label:
-    colname = attr.label(None)  # Fully resolved name in the `table.field` format
-    alias = getattr(attr, "name")
-    return sae.literal_column(f"unixepoch({colname})").label(alias)
+async def place_order(product_ids: list[int]) -> int:
+    with OpenOrderState.write_through():
+        async with database.transaction():
+            order_id = await OrderTable._insert()
+            await OrderedItemTable._issue(order_id, product_ids)
+            await OpenOrderState._load_order(order_id)
+    OrderTable.modified_flag_bc.send(ModifiedFlag.INCOMING)
+    return order_id
 
 
 async def supply_and_complete_order_if_done(order_id: int, product_id: int) -> bool:
-    async with database.transaction():
-        await OrderedItemTable._supply(order_id, product_id)
+    async def op() -> tuple[bool, ModifiedFlag]:
+        supplied_at = await OrderedItemTable._supply(order_id, product_id)
 
         update_query = (
             sae.update(Order)
@@ -54,26 +127,61 @@ async def supply_and_complete_order_if_done(order_id: int, product_id: int) -> b
             .returning(Order.order_id.isnot(None))
         )
 
-        values = {"completed_at": datetime.now(timezone.utc)}
+        values = {"completed_at": epoch_ms()}
         completed: bool | None = await database.fetch_val(update_query, values)
 
-    flag = ModifiedFlag.SUPPLIED
-    if completed is not None:
-        flag |= ModifiedFlag.RESOLVED
-    OrderTable.modified_flag_bc.send(flag)
-    return True if completed is not None else False
+        if completed is None:
+            OpenOrderState._supply(order_id, product_id, supplied_at)
+            return False, ModifiedFlag.SUPPLIED
+        OpenOrderState._remove_order(order_id)
+        return True, ModifiedFlag.SUPPLIED | ModifiedFlag.RESOLVED
+
+    with OpenOrderState.write_through():
+        return await order_writes.submit(op)
 
 
-async def supply_all_and_complete(order_id: int):
-    async with database.transaction():
+async def supply_all_and_complete(order_id: int) -> None:
+    async def op() -> tuple[None, ModifiedFlag]:
         await OrderedItemTable._supply_all(order_id)
         await OrderTable._complete(order_id)
-    OrderTable.modified_flag_bc.send(ModifiedFlag.SUPPLIED | ModifiedFlag.RESOLVED)
+        OpenOrderState._remove_order(order_id)
+        return None, ModifiedFlag.SUPPLIED | ModifiedFlag.RESOLVED
+
+    with OpenOrderState.write_through():
+        await order_writes.submit(op)
+
+
+async def cancel_order(order_id: int) -> None:
+    async def op() -> tuple[None, ModifiedFlag]:
+        await OrderTable._cancel(order_id)
+        OpenOrderState._remove_order(order_id)
+        return None, ModifiedFlag.RESOLVED
+
+    with OpenOrderState.write_through():
+        await order_writes.submit(op)
+
+
+async def reset_order(order_id: int) -> None:
+    async def op() -> tuple[None, ModifiedFlag]:
+        await OrderTable._reset(order_id)
+        await OpenOrderState._load_order(order_id)
+        return None, ModifiedFlag.PUT_BACK
+
+    with OpenOrderState.write_through():
+        await order_writes.submit(op)
 
 
 async def _startup_db() -> None:
     await database.connect()
+    await _create_schema()
+    await ProductTable.ainit()
+    await SalesRollupTable.ainit()
+    OpenOrderState.invalidate()  # `data_version` is only comparable per connection
+    await OpenOrderState.sync()
+    await read_pool.open()
+
 
+async def _create_schema() -> None:
     # from alembic.config import Config
     # from alembic import command
     # command.upgrade(Config("alembic.ini"), "head")
@@ -86,12 +194,93 @@ async def _startup_db() -> None:
         schema = sqlalchemy.schema.CreateTable(table, if_not_exists=True)
         query = str(schema.compile())
         await database.execute(query)
+        for index in table.indexes:
+            schema = sqlalchemy.schema.CreateIndex(index, if_not_exists=True)
+            query = str(schema.compile(dialect=sqlite_dialect()))
+            await database.execute(query)
+    for name in _DROPPED_INDEXES:
+        await database.execute(f"DROP INDEX IF EXISTS {name}")
+    # A random id that tells this database apart from the others created at the
+    # same path, whose table versions start over, e.g. for the exports cached by
+    # `app.routers.stat`
+    if not await database.fetch_val("PRAGMA user_version"):
+        database_id = secrets.randbelow(2**31 - 1) + 1
+        await database.execute(f"PRAGMA user_version = {database_id}")
+    await ArchiveTable.create_tables()
+    await SalesRollupTable.create_triggers()
+    await TableVersionTable.create_triggers()
 
-    await ProductTable.ainit()
-    await OrderedItemTable.ainit()
+
+async def archive_resolved_orders() -> int:
+    """
+    Move the orders resolved long ago to the archive, see `app.store.archive`,
+    and return how many were moved.
+    """
+    moved = await ArchiveTable.archive()
+    if moved:
+        OrderTable.modified_flag_bc.send(ModifiedFlag.RESOLVED)
+    return moved
+
+
+async def archive_orders() -> int:
+    """
+    Same as `archive_resolved_orders` but on its own connection. Run it with
+    `doit archive-orders`.
+    """
+    await database.connect()
+    try:
+        await _create_schema()
+        return await ArchiveTable.archive()
+    finally:
+        await database.disconnect()
+
+
+async def backup_databases(compress: bool) -> backup.Backup:
+    """
+    Copy the main database and the archive to a new directory in `BACKUP_DIR`
+    while they are in use. Run it with `doit backup` as well.
+    """
+    sources = {"main": Path(DATABASE_PATH), archive.SCHEMA: Path(ARCHIVE_PATH)}
+    return await backup.create(
+        sources,
+        BACKUP_DIR,
+        compress=compress,
+        keep=BACKUP_KEEP,
+        pages_per_step=BACKUP_PAGES_PER_STEP,
+        step_pause_secs=BACKUP_STEP_PAUSE_SECS,
+    )
+
+
+async def rebuild_sales_rollups() -> None:
+    """
+    Recount the sales rollups of an existing database from its orders, e.g.
+    after editing it by hand. Run it with `doit rebuild-sales-rollups`.
+    """
+    await database.connect()
+    try:
+        await _create_schema()
+        await SalesRollupTable.rebuild()
+    finally:
+        await database.disconnect()
+
+
+async def export_order_columns(path: Path) -> None:
+    """
+    Write the orders to `path` in the layout described in `app.store.columnar`.
+    Run it with `doit export-orders`.
+    """
+    await database.connect()
+    try:
+        await _create_schema()
+        columns = await columnar.fetch(database.connection(), archived=True)
+    finally:
+        await database.disconnect()
+    with open(path, "wb") as f:
+        columnar.write(columns, f)
 
 
 async def _shutdown_db() -> None:
+    await read_pool.close()
     await database.disconnect()
 
 
@@ -0,0 +1,170 @@
+# Resolved orders moved out of the hot tables
+#
+# Orders pile up over the days of an event, while the order boards and the
+# resolved orders page only ever look at the recent ones. The orders that have
+# been canceled or completed for a while are moved together with their items to
+# `db/archive.db`, which every connection attaches as the `archive` schema. The
+# all-time views, i.e. `/stat` and the exports, read both through `all_time`.
+
+import asyncio
+import sqlite3
+from typing import Awaitable, Callable
+
+import sqlalchemy
+import sqlalchemy.sql.expression as sa_exp
+from sqlalchemy.dialects.sqlite import dialect as sqlite_dialect
+from sqlalchemy.schema import Index, MetaData
+from sqlalchemy.sql.functions import func as sa_func
+
+from .base import Base, epoch_ms
+from .connections import Writer
+from .order import Order
+from .ordered_item import OrderedItem
+
+SCHEMA = "archive"
+
+# Kept apart from `Base.metadata`, which describes the main database for
+# `create_all` and Alembic.
+metadata = MetaData(naming_convention=Base.metadata.naming_convention)
+
+
+def _archived(table: sqlalchemy.Table) -> sqlalchemy.Table:
+    """
+    The same columns as `table` in the archive. Foreign keys are left out since
+    SQLite cannot refer to the products in the main database.
+    """
+    columns = (
+        sqlalchemy.Column(
+            column.name,
+            column.type,
+            primary_key=column.primary_key,
+            nullable=column.nullable,
+        )
+        for column in table.columns
+    )
+    return sqlalchemy.Table(table.name, metadata, *columns, schema=SCHEMA)
+
+
+_orders = Base.metadata.tables[Order.__tablename__]
+_ordered_items = Base.metadata.tables[OrderedItem.__tablename__]
+ARCHIVED_TABLES = {
+    _orders: _archived(_orders),
+    _ordered_items: _archived(_ordered_items),
+}
+Index("ix_archive_orders_order_id", ARCHIVED_TABLES[_orders].c.order_id)
+Index("ix_archive_ordered_items_order_id", ARCHIVED_TABLES[_ordered_items].c.order_id)
+
+
+def all_time(model: type[Order] | type[OrderedItem]) -> sa_exp.Subquery:
+    """The rows of `model` followed by the archived ones, e.g. for `/stat`."""
+    table = Base.metadata.tables[model.__tablename__]
+    union = sa_exp.union_all(
+        sa_exp.select(table), sa_exp.select(ARCHIVED_TABLES[table])
+    )
+    return union.subquery(f"all_{table.name}")
+
+
+def _all_time_sql(table: sqlalchemy.Table) -> str:
+    # The columns are listed, since a column added by a migration comes last in
+    # one database and in the order of the model in the other.
+    columns = ", ".join(table.columns.keys())
+    return (
+        f"(SELECT {columns} FROM main.{table.name}"
+        f" UNION ALL SELECT {columns} FROM {SCHEMA}.{table.name})"
+    )
+
+
+# The same for the queries written in SQL
+ALL_ORDERS = _all_time_sql(_orders)
+ALL_ORDERED_ITEMS = _all_time_sql(_ordered_items)
+
+
+class Table:
+    def __init__(self, database: Writer, after_secs: float, batch_size: int):
+        self._db = database
+        self._after_secs = after_secs
+        self._batch_size = batch_size
+
+    async def create_tables(self) -> None:
+        for table in ARCHIVED_TABLES.values():
+            schema = sqlalchemy.schema.CreateTable(table, if_not_exists=True)
+            await self._db.execute(str(schema.compile(dialect=sqlite_dialect())))
+            await self._add_missing_columns(table)
+            for index in table.indexes:
+                schema = sqlalchemy.schema.CreateIndex(index, if_not_exists=True)
+                await self._db.execute(str(schema.compile(dialect=sqlite_dialect())))
+
+    async def _add_missing_columns(self, table: sqlalchemy.Table) -> None:
+        """
+        Add the columns added to the main database by the migrations since the
+        archive was created, which Alembic does not know about.
+        """
+        query = f"SELECT name FROM pragma_table_info('{table.name}', '{SCHEMA}')"
+        existing = {row[0] for row in await self._db.fetch_all(query)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=sqlite_dialect())
+                await self._db.execute(
+                    f"ALTER TABLE {SCHEMA}.{table.name}"
+                    f" ADD COLUMN {column.name} {column_type}"
+                )
+
+    async def archive(self) -> int:
+        """
+        Move the orders resolved more than `after_secs` ago and their items to
+        the archive, and return how many orders were moved. Each batch of
+        `batch_size` orders is a transaction of its own, so the clicks queued
+        on the writer in the meantime go in between.
+        """
+        moved = 0
+        while archived := await self._archive_batch():
+            moved += archived
+        return moved
+
+    async def _archive_batch(self) -> int:
+        resolved_at = sa_func.coalesce(Order.completed_at, Order.canceled_at)
+        # The newest order always stays, so that the order numbers and the ids
+        # carry on from it instead of starting over in an empty table.
+        newest = sa_exp.select(sa_func.max(Order.order_id)).scalar_subquery()
+        query = (
+            sa_exp.select(Order.order_id)
+            .where(Order.canceled_at.isnot(None) | Order.completed_at.isnot(None))
+            .where(resolved_at < epoch_ms() - int(self._after_secs * 1000))
+            .where(Order.order_id < newest)
+            .order_by(Order.order_id)
+            .limit(self._batch_size)
+        )
+        async with self._db.transaction():
+            order_ids = [row[0] for row in await self._db.fetch_all(query)]
+            if not order_ids:
+                return 0
+            # Transactions are not atomic across the databases in WAL mode, so
+            # the copies are written such that a batch can be retried after
+            # only the archive has been committed.
+            for table, archived in ARCHIVED_TABLES.items():
+                rows = sa_exp.select(table).where(table.c.order_id.in_(order_ids))
+                copy = sa_exp.insert(archived).from_select(table.columns.keys(), rows)
+                await self._db.execute(copy.prefix_with("OR IGNORE"))
+            # The orders go first so that the sales rollups, which find no order
+            # to take the deleted items off from, keep counting them.
+            for table in ARCHIVED_TABLES:
+                delete = sa_exp.delete(table).where(table.c.order_id.in_(order_ids))
+                await self._db.execute(delete)
+        return len(order_ids)
+
+    async def _delete_product(self, product_id: int) -> None:
+        """Use `delete_product` to delete the items of the main database as well."""
+        archived = ARCHIVED_TABLES[_ordered_items]
+        query = sa_exp.delete(archived).where(archived.c.product_id == product_id)
+        await self._db.execute(query)
+
+
+async def sweep(archive: Callable[[], Awaitable[int]], interval_secs: float) -> None:
+    """Archive the resolved orders every `interval_secs` until cancelled."""
+    while True:
+        await asyncio.sleep(interval_secs)
+        try:
+            await archive()
+        except sqlite3.OperationalError:
+            # Another worker kept the database locked; its sweep does the same.
+            continue
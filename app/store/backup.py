@@ -0,0 +1,123 @@
+# Online backups of the databases
+#
+# SQLite's backup API copies the pages of a live database to another file. The
+# copy runs in a worker thread on a read-only connection of its own, a few pages
+# per step, pausing in between, so the event loop and the writer carry on while
+# it runs. A read transaction is held over the whole copy: it pins a snapshot
+# of every database, so writes made in the meantime neither restart the copy
+# nor leave the main database and the archive out of step with each other.
+
+import asyncio
+import gzip
+import shutil
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Mapping
+
+
+_COMPRESS_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass(slots=True)
+class Backup:
+    path: Path  # A directory with a copy of each database
+    size: int  # In bytes, after compression
+
+
+def _copy(
+    sources: Mapping[str, Path],
+    path: Path,
+    compress: bool,
+    pages_per_step: int,
+    step_pause_secs: float,
+) -> None:
+    def pause(_status: int, _remaining: int, _total: int) -> None:
+        time.sleep(step_pause_secs)
+
+    main = f"file:{sources['main']}?mode=ro"
+    src = sqlite3.connect(main, uri=True, isolation_level=None)
+    try:
+        for schema, source in sources.items():
+            if schema != "main":
+                src.execute(
+                    f"ATTACH DATABASE ? AS {schema}", (f"file:{source}?mode=ro",)
+                )
+        src.execute("BEGIN")
+        for schema in sources:
+            src.execute(f"SELECT count(*) FROM {schema}.sqlite_master").fetchone()
+
+        for schema, source in sources.items():
+            target = path / source.name
+            dst = sqlite3.connect(target)
+            try:
+                src.backup(dst, pages=pages_per_step, progress=pause, name=schema)
+                # A single file that opens without its WAL
+                dst.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                dst.close()
+            if compress:
+                _compress(target, step_pause_secs)
+        src.execute("COMMIT")
+    finally:
+        src.close()
+
+
+def _compress(path: Path, step_pause_secs: float) -> None:
+    # In chunks with the same pause as the copy, since the thread holds the GIL
+    # for a good part of each chunk
+    with open(path, "rb") as f, gzip.open(f"{path}.gz", "wb", compresslevel=6) as gz:
+        while chunk := f.read(_COMPRESS_CHUNK_SIZE):
+            gz.write(chunk)
+            time.sleep(step_pause_secs)
+    path.unlink()
+
+
+def _prune(directory: Path, keep: int) -> None:
+    """Remove all but the newest `keep` backups."""
+    backups = sorted(p for p in directory.iterdir() if p.suffix != ".part")
+    for stale in backups[: max(len(backups) - keep, 0)]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def _create(
+    sources: Mapping[str, Path],
+    directory: Path,
+    compress: bool,
+    keep: int,
+    pages_per_step: int,
+    step_pause_secs: float,
+) -> Backup:
+    # Named after the time it started, which sorts them from the oldest
+    name = f"{datetime.now():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+    part = directory / f"{name}.part"
+    part.mkdir(parents=True)
+    try:
+        _copy(sources, part, compress, pages_per_step, step_pause_secs)
+        path = part.rename(directory / name)
+    finally:
+        shutil.rmtree(part, ignore_errors=True)
+    _prune(directory, keep)
+    return Backup(path=path, size=sum(f.stat().st_size for f in path.iterdir()))
+
+
+async def create(
+    sources: Mapping[str, Path],
+    directory: Path,
+    *,
+    compress: bool,
+    keep: int,
+    pages_per_step: int,
+    step_pause_secs: float,
+) -> Backup:
+    """
+    Copy the database files in `sources`, keyed by schema name including
+    "main", to a new directory in `directory` and remove all but the newest
+    `keep` backups there. The copies are compressed with gzip if `compress`.
+    """
+    return await asyncio.to_thread(
+        _create, sources, directory, compress, keep, pages_per_step, step_pause_secs
+    )
@@ -1,3 +1,5 @@
+import time
+
 from sqlalchemy.orm import DeclarativeBase, Mapped, MappedAsDataclass, mapped_column
 from sqlalchemy.schema import MetaData
 
@@ -17,3 +19,14 @@ Base.metadata.naming_convention = MetaData(
         "pk": "pk_%(table_name)s",
     }
 ).naming_convention
+
+
+# Timestamps are stored as INTEGER milliseconds since the unix epoch, so that
+# they compare and subtract without parsing and keep sub-second precision.
+def epoch_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+# The same in SQL, e.g. for column defaults; `unixepoch('subsec')` would do but
+# needs SQLite 3.42.
+EPOCH_MS_NOW = "CAST(round((julianday('now') - 2440587.5) * 86400000) AS INTEGER)"
@@ -0,0 +1,179 @@
+"""
+Orders that are not canceled, exported as typed columns for offline analysis.
+Loading a file maps it into memory instead of parsing it, and each column can
+be handed to NumPy without a copy, e.g. `np.frombuffer(columns.ordered_at,
+dtype="<i8")`.
+
+File layout, little-endian throughout:
+
+    header   magic b"MCOL", u16 format version, u16 zero,
+             u32 orders, u32 items, u32 products, u32 bytes of product names
+    columns  the fields of `OrderColumns` in order, each zero-padded to a
+             multiple of 8 bytes so that every column is aligned
+
+Timestamps are seconds since the unix epoch, with 0 for orders that are not
+completed. Product names are UTF-8 strings concatenated in `product_names`;
+the name of the i-th product spans `product_name_offsets[i]` to
+`product_name_offsets[i + 1]`.
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import BinaryIO, Literal, Sequence
+
+from databases.core import Connection
+
+from .archive import ALL_ORDERED_ITEMS, ALL_ORDERS
+
+MAGIC = b"MCOL"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHHIIII")
+_ALIGN = 8
+
+
+@dataclass(slots=True)
+class OrderColumns:
+    # One entry per order
+    order_id: Sequence[int]
+    ordered_at: Sequence[int]
+    completed_at: Sequence[int]
+    # One entry per ordered item
+    item_order_id: Sequence[int]
+    item_no: Sequence[int]
+    item_product_id: Sequence[int]
+    # One entry per product, plus one more for the offsets
+    product_id: Sequence[int]
+    product_price: Sequence[int]
+    product_name_offsets: Sequence[int]
+    product_names: bytes | memoryview
+
+    def product_name(self, i: int) -> str:
+        start, end = self.product_name_offsets[i], self.product_name_offsets[i + 1]
+        return bytes(self.product_names[start:end]).decode()
+
+
+type _Typecode = Literal["i", "q", "B"]
+
+# Element type and length of each column as (typecode, what it is counted in)
+_LAYOUT: dict[str, tuple[_Typecode, str]] = {
+    "order_id": ("i", "orders"),
+    "ordered_at": ("q", "orders"),
+    "completed_at": ("q", "orders"),
+    "item_order_id": ("i", "items"),
+    "item_no": ("i", "items"),
+    "item_product_id": ("i", "items"),
+    "product_id": ("i", "products"),
+    "product_price": ("i", "products"),
+    "product_name_offsets": ("i", "offsets"),
+    "product_names": ("B", "names"),
+}
+assert list(_LAYOUT) == [f.name for f in fields(OrderColumns)]
+
+_ORDERS_QUERY = """
+SELECT
+    order_id,
+    ordered_at / 1000 AS ordered_at,
+    coalesce(completed_at / 1000, 0) AS completed_at
+FROM {orders} AS orders
+WHERE canceled_at IS NULL
+ORDER BY order_id
+"""
+# Same items as the CSV export, i.e. leaving out the ones of deleted products
+_ITEMS_QUERY = """
+SELECT ordered_items.order_id, ordered_items.item_no, ordered_items.product_id
+FROM {ordered_items} AS ordered_items
+JOIN {orders} AS orders ON orders.order_id = ordered_items.order_id
+JOIN products ON products.product_id = ordered_items.product_id
+WHERE orders.canceled_at IS NULL
+ORDER BY ordered_items.order_id, ordered_items.item_no
+"""
+_PRODUCTS_QUERY = "SELECT product_id, price, name FROM products ORDER BY product_id"
+
+
+async def fetch(connection: Connection, *, archived: bool = False) -> OrderColumns:
+    """
+    Read the columns in one transaction so that they agree with each other,
+    including the orders in `app.store.archive` if `archived`.
+    """
+    tables = (
+        {"orders": ALL_ORDERS, "ordered_items": ALL_ORDERED_ITEMS}
+        if archived
+        else {"orders": "orders", "ordered_items": "ordered_items"}
+    )
+    columns = {
+        name: array(typecode)
+        for name, (typecode, _) in _LAYOUT.items()
+        if name != "product_names"
+    }
+    names = bytearray()
+    async with connection.transaction():
+        async for row in connection.iterate(_ORDERS_QUERY.format(**tables)):
+            columns["order_id"].append(row[0])
+            columns["ordered_at"].append(row[1])
+            columns["completed_at"].append(row[2])
+        async for row in connection.iterate(_ITEMS_QUERY.format(**tables)):
+            columns["item_order_id"].append(row[0])
+            columns["item_no"].append(row[1])
+            columns["item_product_id"].append(row[2])
+        columns["product_name_offsets"].append(0)
+        async for row in connection.iterate(_PRODUCTS_QUERY):
+            columns["product_id"].append(row[0])
+            columns["product_price"].append(row[1])
+            names += row[2].encode()
+            columns["product_name_offsets"].append(len(names))
+    return OrderColumns(**columns, product_names=bytes(names))
+
+
+def write(columns: OrderColumns, f: BinaryIO) -> None:
+    header = _HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        0,
+        len(columns.order_id),
+        len(columns.item_order_id),
+        len(columns.product_id),
+        len(columns.product_names),
+    )
+    f.write(header)
+    for name, (typecode, _) in _LAYOUT.items():
+        column = array(typecode, getattr(columns, name))
+        if sys.byteorder == "big":
+            column.byteswap()
+        data = column.tobytes()
+        f.write(data)
+        f.write(bytes(-len(data) % _ALIGN))
+
+
+def load(path: Path) -> OrderColumns:
+    """
+    Map the file at `path` into memory. The columns are views of the mapping,
+    so only the pages that are actually read are loaded from disk.
+    """
+    with open(path, "rb") as f:
+        buffer = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    magic, version, _, orders, items, products, names = _HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"{path} is not an order export of version {FORMAT_VERSION}")
+    lengths = {
+        "orders": orders,
+        "items": items,
+        "products": products,
+        "offsets": products + 1,
+        "names": names,
+    }
+
+    columns: dict[str, Sequence[int] | memoryview] = {}
+    offset = _HEADER.size
+    for name, (typecode, counted_in) in _LAYOUT.items():
+        size = array(typecode).itemsize * lengths[counted_in]
+        column = buffer[offset : offset + size].cast(typecode)
+        if sys.byteorder == "big":
+            column = array(typecode, column)
+            column.byteswap()
+        columns[name] = column
+        offset += size + -size % _ALIGN
+    return OrderColumns(**columns)  # type: ignore[arg-type]
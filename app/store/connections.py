@@ -0,0 +1,234 @@
+# SQLite connections shared by the whole worker
+#
+# Every statement that writes goes through `Writer`, which keeps one connection
+# open and lets transactions take turns on it. Heavy reads such as the order
+# boards and the statistics go through `ReadPool`, a handful of read-only
+# connections, so that they never hold up a supply click or an order.
+
+import asyncio
+import sqlite3
+import time
+from contextlib import AsyncExitStack, aclosing, asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, AsyncIterator, Mapping
+
+import aiosqlite
+from databases import Database
+from databases.core import Connection, Transaction
+from databases.interfaces import Record
+from sqlalchemy.sql import ClauseElement
+
+
+def connection_factory(
+    pragmas: Mapping[str, str], attached: Mapping[str, str] | None = None
+) -> type[sqlite3.Connection]:
+    """
+    Make a connection class that runs `pragmas` as soon as it is opened, since
+    most PRAGMAs only apply to the connection they are run on. The databases in
+    `attached`, file names keyed by schema name, are attached beforehand so
+    that PRAGMAs such as `journal_mode` apply to them as well.
+    """
+
+    class PragmaConnection(sqlite3.Connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            for schema, filename in (attached or {}).items():
+                self.execute(f"ATTACH DATABASE ? AS {schema}", (filename,))
+            for name, value in pragmas.items():
+                self.execute(f"PRAGMA {name} = {value}")
+
+    return PragmaConnection
+
+
+class Writer(Database):
+    """
+    A `Database` that runs every statement on a single connection opened by
+    `connect`. A transaction has the connection to itself until it ends;
+    statements and transactions from other tasks wait for their turn, while
+    the ones nested in it run right away.
+    """
+
+    _turn: asyncio.Lock
+    _turn_owner: asyncio.Task | None = None
+
+    async def connect(self) -> None:
+        await super().connect()
+        self._turn = asyncio.Lock()
+        connection = Connection(self, self._backend)
+        await connection.__aenter__()
+        # `Database.connection` hands out this one instead of a new connection
+        # for each task, which is what `force_rollback` relies on as well.
+        self._global_connection = connection
+
+    async def disconnect(self) -> None:
+        if (connection := self._global_connection) is not None:
+            self._global_connection = None
+            await connection.__aexit__()
+        await super().disconnect()
+
+    @asynccontextmanager
+    async def _take_turn(self) -> AsyncIterator[None]:
+        task = asyncio.current_task()
+        if self._turn_owner is task:
+            yield
+            return
+        async with self._turn:
+            self._turn_owner = task
+            try:
+                yield
+            finally:
+                self._turn_owner = None
+
+    def transaction(self, *, force_rollback: bool = False, **kwargs: Any):
+        return _TurnTransaction(self, force_rollback, **kwargs)
+
+    @asynccontextmanager
+    async def raw_connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """The underlying aiosqlite connection, for `app.store.statements`."""
+        async with self._take_turn():
+            yield self.connection().raw_connection
+
+    async def fetch_all(
+        self, query: ClauseElement | str, values: dict | None = None
+    ) -> list[Record]:
+        async with self._take_turn():
+            return await super().fetch_all(query, values)
+
+    async def fetch_one(
+        self, query: ClauseElement | str, values: dict | None = None
+    ) -> Record | None:
+        async with self._take_turn():
+            return await super().fetch_one(query, values)
+
+    async def fetch_val(
+        self, query: ClauseElement | str, values: dict | None = None, column: Any = 0
+    ) -> Any:
+        async with self._take_turn():
+            return await super().fetch_val(query, values, column)
+
+    async def execute(
+        self, query: ClauseElement | str, values: dict | None = None
+    ) -> Any:
+        async with self._take_turn():
+            return await super().execute(query, values)
+
+    async def execute_many(self, query: ClauseElement | str, values: list) -> None:
+        async with self._take_turn():
+            return await super().execute_many(query, values)
+
+    async def iterate(
+        self, query: ClauseElement | str, values: dict | None = None
+    ) -> AsyncGenerator[Mapping, None]:
+        async with self._take_turn():
+            async for record in super().iterate(query, values):
+                yield record
+
+
+class _TurnTransaction(Transaction):
+    def __init__(self, writer: Writer, force_rollback: bool, **kwargs: Any):
+        super().__init__(writer.connection, force_rollback, **kwargs)
+        self._writer = writer
+        self._turn = AsyncExitStack()
+
+    async def __aenter__(self) -> Transaction:
+        async with AsyncExitStack() as stack:
+            await stack.enter_async_context(self._writer._take_turn())
+            await super().__aenter__()
+            self._turn = stack.pop_all()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        try:
+            await super().__aexit__(*exc_info)
+        finally:
+            await self._turn.aclose()
+
+
+@dataclass
+class PoolStats:
+    size: int
+    acquisitions: int = 0
+    waits: int = 0  # Acquisitions that found every connection busy
+    total_wait_secs: float = 0.0
+    max_wait_secs: float = 0.0
+
+
+class ReadPool:
+    """
+    A fixed number of connections opened by `open` and lent out one at a time.
+    Open it with a read-only URL such as `sqlite:///file:db/app.db?mode=ro` and
+    `uri=True`.
+    """
+
+    def __init__(self, url: str, size: int, **options: Any):
+        self._db = Database(url, **options)
+        self._size = size
+        self._idle: asyncio.Queue[Connection] | None = None
+        self.stats = PoolStats(size=size)
+
+    async def open(self) -> None:
+        await self._db.connect()
+        self._idle = asyncio.Queue()
+        for _ in range(self._size):
+            connection = Connection(self._db, self._db._backend)
+            await connection.__aenter__()
+            self._idle.put_nowait(connection)
+
+    async def close(self) -> None:
+        if (idle := self._idle) is None:
+            return
+        self._idle = None
+        for _ in range(self._size):
+            await (await idle.get()).__aexit__()
+        await self._db.disconnect()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[Connection]:
+        assert self._idle is not None, "ReadPool is not open"
+        idle = self._idle
+        if idle.empty():
+            started_at = time.perf_counter()
+            connection = await idle.get()
+            waited = time.perf_counter() - started_at
+            self.stats.waits += 1
+            self.stats.total_wait_secs += waited
+            self.stats.max_wait_secs = max(self.stats.max_wait_secs, waited)
+        else:
+            connection = idle.get_nowait()
+        self.stats.acquisitions += 1
+        try:
+            yield connection
+        finally:
+            idle.put_nowait(connection)
+
+    @asynccontextmanager
+    async def raw_connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """The underlying aiosqlite connection, for `app.store.statements`."""
+        async with self.connection() as connection:
+            yield connection.raw_connection
+
+    async def fetch_all(
+        self, query: ClauseElement | str, values: dict | None = None
+    ) -> list[Record]:
+        async with self.connection() as connection:
+            return await connection.fetch_all(query, values)
+
+    async def fetch_one(
+        self, query: ClauseElement | str, values: dict | None = None
+    ) -> Record | None:
+        async with self.connection() as connection:
+            return await connection.fetch_one(query, values)
+
+    async def fetch_val(
+        self, query: ClauseElement | str, values: dict | None = None, column: Any = 0
+    ) -> Any:
+        async with self.connection() as connection:
+            return await connection.fetch_val(query, values, column)
+
+    async def iterate(
+        self, query: ClauseElement | str, values: dict | None = None
+    ) -> AsyncGenerator[Mapping, None]:
+        async with self.connection() as connection:
+            async with aclosing(connection.iterate(query, values)) as records:
+                async for record in records:
+                    yield record
@@ -0,0 +1,80 @@
+import asyncio
+from typing import Awaitable, Callable
+
+from databases import Database
+
+from ..bc import Broadcaster
+from .order import ModifiedFlag
+
+# An operation runs its statements and returns its result along with the flag
+# to broadcast once it has been committed.
+type Operation[T] = Callable[[], Awaitable[tuple[T, ModifiedFlag]]]
+
+
+class GroupCommit:
+    """
+    Commits the operations submitted within `window_secs` of each other in a
+    single transaction and broadcasts their flags as one.
+
+    Each operation runs in a savepoint of its own, so a failing one is rolled
+    back and reported to its caller without affecting the rest of the batch.
+    Never submit from inside a transaction of `database`; the batch would wait
+    for that transaction to end while it waits for the batch.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        bc: Broadcaster[ModifiedFlag],
+        window_secs: float,
+    ):
+        self._db = database
+        self._bc = bc
+        self._window_secs = window_secs
+        self._pending: list[tuple[Operation, asyncio.Future]] = []
+        self._flusher: asyncio.Task[None] | None = None
+
+    async def submit[T](self, op: Operation[T]) -> T:
+        """Run `op` in the next batch and return its result after the commit."""
+        future: asyncio.Future[T] = asyncio.get_running_loop().create_future()
+        self._pending.append((op, future))
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self) -> None:
+        try:
+            while self._pending:
+                await asyncio.sleep(self._window_secs)
+                batch, self._pending = self._pending, []
+                await self._commit(batch)
+        finally:
+            self._flusher = None
+
+    async def _commit(self, batch: list[tuple[Operation, asyncio.Future]]) -> None:
+        outcomes: list[tuple[asyncio.Future, object, BaseException | None]] = []
+        flag = ModifiedFlag(0)
+        try:
+            async with self._db.transaction():
+                for op, future in batch:
+                    try:
+                        async with self._db.transaction():
+                            result, op_flag = await op()
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+                        continue
+                    outcomes.append((future, result, None))
+                    flag |= op_flag
+        except Exception as e:
+            outcomes = [(future, None, e) for _, future in batch]
+            flag = ModifiedFlag(0)
+
+        for future, result, error in outcomes:
+            if future.done():  # The caller has been cancelled
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        if flag:
+            self._bc.send(flag)
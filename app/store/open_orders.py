@@ -0,0 +1,185 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from databases import Database
+
+from .table_version import version_of
+
+# The orders that are neither canceled nor completed with their items counted
+# per product. Timestamps are in milliseconds since the unix epoch.
+_SELECT_OPEN = """
+SELECT
+    orders.order_id,
+    orders.ordered_at,
+    ordered_items.product_id,
+    count(ordered_items.id) AS count,
+    count(ordered_items.supplied_at) AS supplied,
+    max(ordered_items.supplied_at) AS supplied_at
+FROM orders
+JOIN ordered_items ON orders.order_id = ordered_items.order_id
+WHERE orders.canceled_at IS NULL AND orders.completed_at IS NULL
+"""
+_GROUP_BY = "GROUP BY orders.order_id, ordered_items.product_id"
+_LOAD_ALL_QUERY = f"{_SELECT_OPEN} {_GROUP_BY}"
+_LOAD_ONE_QUERY = f"{_SELECT_OPEN} AND orders.order_id = :order_id {_GROUP_BY}"
+_VERSION_QUERY = version_of("orders", "ordered_items")
+
+
+@dataclass(slots=True)
+class OpenItem:
+    count: int
+    supplied: int = 0
+    supplied_at: int | None = None
+
+    @property
+    def unsupplied(self) -> int:
+        return self.count - self.supplied
+
+
+@dataclass(slots=True)
+class OpenOrder:
+    order_id: int
+    ordered_at: int
+    items: dict[int, OpenItem] = field(default_factory=dict)  # Keyed by product_id
+
+
+class OpenOrders:
+    """
+    The orders that are neither canceled nor completed, kept in memory so that
+    the order boards can be rendered without querying the database.
+
+    The functions in `app.store` that write orders update this model right
+    after their statements succeed, in the same transaction. Changes made by
+    other workers are picked up by `sync`, which reloads everything when
+    `PRAGMA data_version` says another connection has committed since the last
+    load and the `app.store.table_version` counters of the order tables say the
+    commit touched them, i.e. not for the register sessions. That check only
+    works because every write of this worker goes through the single connection
+    of `app.store.connections.Writer`.
+    """
+
+    def __init__(self, database: Database):
+        self._db = database
+        self._orders: dict[int, OpenOrder] = {}
+        # product_id -> order_ids of the open orders with unsupplied items of it
+        self._by_product: dict[int, set[int]] = {}
+        self._data_version: int | None = None  # `None` once out of sync
+        # The counters as of `_data_version`, read again after the writes of
+        # this worker, which bump them as well
+        self._tables_version: int | None = None
+        self._written = False
+        # Goes up with every change to the model, so that whatever is rendered
+        # from it can be reused until then. See `app.routers.orders`.
+        self.version = 0
+
+    async def sync(self) -> None:
+        async with self._db.transaction():
+            data_version = await self._db.fetch_val("PRAGMA data_version")
+            if data_version == self._data_version:
+                if self._written:
+                    self._tables_version = await self._db.fetch_val(_VERSION_QUERY)
+                    self._written = False
+                return
+            # Such as another worker writing the register sessions
+            tables_version = await self._db.fetch_val(_VERSION_QUERY)
+            in_sync = self._data_version is not None and not self._written
+            if in_sync and tables_version == self._tables_version:
+                self._data_version = data_version
+                return
+            rows = await self._db.fetch_all(_LOAD_ALL_QUERY)
+
+            self._orders.clear()
+            self._by_product.clear()
+            for row in rows:
+                order_id = row["order_id"]
+                if (order := self._orders.get(order_id)) is None:
+                    order = OpenOrder(order_id=order_id, ordered_at=row["ordered_at"])
+                    self._orders[order_id] = order
+                item = OpenItem(row["count"], row["supplied"], row["supplied_at"])
+                self._add_item(order, row["product_id"], item)
+            self._data_version = data_version
+            self._tables_version = tables_version
+            self._written = False
+            self.version += 1
+
+    def invalidate(self) -> None:
+        """Reload everything on the next `sync`."""
+        self._data_version = None
+
+    @contextmanager
+    def write_through(self) -> Iterator[None]:
+        """
+        Invalidate the model when a write fails, since it may have been updated
+        before the transaction was rolled back.
+        """
+        try:
+            yield
+        except BaseException:
+            self.invalidate()
+            raise
+        self._written = True
+
+    def orders(self) -> list[OpenOrder]:
+        return sorted(self._orders.values(), key=lambda order: order.order_id)
+
+    def by_order_id(self, order_id: int) -> OpenOrder | None:
+        return self._orders.get(order_id)
+
+    def by_product_id(self, product_id: int) -> list[OpenOrder]:
+        """The open orders waiting for `product_id` to be supplied."""
+        order_ids = sorted(self._by_product.get(product_id, ()))
+        return [self._orders[order_id] for order_id in order_ids]
+
+    def waiting_product_ids(self) -> list[int]:
+        return sorted(self._by_product)
+
+    async def _load_order(self, order_id: int) -> None:
+        """Put the order back in the model after it has been placed or reset."""
+        rows = await self._db.fetch_all(_LOAD_ONE_QUERY, {"order_id": order_id})
+        self._remove_order(order_id)
+        self.version += 1
+        if not rows:
+            return
+        order = OpenOrder(order_id=order_id, ordered_at=rows[0]["ordered_at"])
+        self._orders[order_id] = order
+        for row in rows:
+            item = OpenItem(row["count"], row["supplied"], row["supplied_at"])
+            self._add_item(order, row["product_id"], item)
+
+    def _supply(self, order_id: int, product_id: int, supplied_at: int) -> None:
+        if (order := self._orders.get(order_id)) is None:
+            return
+        if (item := order.items.get(product_id)) is None:
+            return
+        item.supplied = item.count
+        item.supplied_at = supplied_at
+        self.version += 1
+        self._discard_waiting(product_id, order_id)
+
+    def _remove_order(self, order_id: int) -> None:
+        if (order := self._orders.pop(order_id, None)) is None:
+            return
+        self.version += 1
+        for product_id in order.items:
+            self._discard_waiting(product_id, order_id)
+
+    def _remove_product(self, product_id: int) -> None:
+        self.version += 1
+        self._by_product.pop(product_id, None)
+        for order in list(self._orders.values()):
+            order.items.pop(product_id, None)
+            if not order.items:
+                self._orders.pop(order.order_id)
+
+    def _add_item(self, order: OpenOrder, product_id: int, item: OpenItem) -> None:
+        order.items[product_id] = item
+        if item.unsupplied > 0:
+            self._by_product.setdefault(product_id, set()).add(order.order_id)
+
+    def _discard_waiting(self, product_id: int, order_id: int) -> None:
+        if (order_ids := self._by_product.get(product_id)) is None:
+            return
+        order_ids.discard(order_id)
+        if not order_ids:
+            del self._by_product[product_id]
@@ -1,28 +1,60 @@
-from datetime import datetime, timezone
+import operator
+from dataclasses import dataclass, fields
 from enum import Flag, auto
 
 import sqlalchemy.sql.expression as sa_exp
-from databases import Database
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy.sql.sqltypes import DateTime
+from sqlalchemy.schema import Index
+from sqlalchemy.sql.functions import func as sa_func
 
 from ..bc import Broadcaster
-from .base import Base
+from .base import EPOCH_MS_NOW, Base, epoch_ms
+from .connections import Writer
+from .statements import Statement
 
 
 class Order(Base):
     __tablename__ = "orders"
 
-    order_id: Mapped[int]
-    ordered_at: Mapped[datetime] = mapped_column(
-        server_default=sa_exp.text("CURRENT_TIMESTAMP")
-    )
-    canceled_at: Mapped[datetime | None] = mapped_column(
-        DateTime(timezone=True), default=None
-    )
-    completed_at: Mapped[datetime | None] = mapped_column(
-        DateTime(timezone=True), default=None
+    order_id: Mapped[int] = mapped_column(index=True)
+    # Milliseconds since the unix epoch, see `app.store.base.epoch_ms`
+    ordered_at: Mapped[int] = mapped_column(
+        server_default=sa_exp.text(f"({EPOCH_MS_NOW})")
     )
+    canceled_at: Mapped[int | None] = mapped_column(default=None)
+    completed_at: Mapped[int | None] = mapped_column(default=None)
+
+
+# The order boards only ever look at the orders that are neither canceled nor
+# completed, which are a tiny fraction of the orders placed over an event.
+Index(
+    "ix_orders_open",
+    Order.order_id,
+    sqlite_where=Order.canceled_at.is_(None) & Order.completed_at.is_(None),
+)
+# For the service times of the orders completed in the last minutes
+Index("ix_orders_completed_at", Order.completed_at)
+# For paging through the resolved orders from the newest and for narrowing them
+# down to a time range. The canceled ones are filtered on the same index: one
+# narrower partial index for them would tie with this one, and SQLite would then
+# pick either depending on the order the two were created in.
+Index(
+    "ix_orders_resolved",
+    Order.order_id,
+    sqlite_where=Order.canceled_at.isnot(None) | Order.completed_at.isnot(None),
+)
+Index("ix_orders_ordered_at", Order.ordered_at)
+
+
+@dataclass(slots=True)
+class OrderRow:
+    """A row of `orders` as read by `Table`, like `product.ProductRow`."""
+
+    order_id: int
+    ordered_at: int
+    canceled_at: int | None
+    completed_at: int | None
+    id: int | None = None
 
 
 class ModifiedFlag(Flag):
@@ -33,45 +65,73 @@ class ModifiedFlag(Flag):
     PUT_BACK = auto()
 
 
+_by_order_id = Order.order_id == sa_exp.bindparam("order_id")
+_SELECT_ALL = Statement("order.select_all", sa_exp.select(Order))
+_BY_ORDER_ID = Statement("order.by_order_id", sa_exp.select(Order).where(_by_order_id))
+assert _SELECT_ALL.columns == tuple(f.name for f in fields(OrderRow))
+_CANCEL = Statement(
+    "order.cancel",
+    sa_exp.update(Order)
+    .where(_by_order_id)
+    .values(canceled_at=sa_exp.bindparam("at"), completed_at=sa_exp.null()),
+)
+_COMPLETE = Statement(
+    "order.complete",
+    sa_exp.update(Order)
+    .where(_by_order_id)
+    .values(canceled_at=sa_exp.null(), completed_at=sa_exp.bindparam("at")),
+)
+_RESET = Statement(
+    "order.reset",
+    sa_exp.update(Order)
+    .where(_by_order_id)
+    .values(canceled_at=sa_exp.null(), completed_at=sa_exp.null()),
+)
+
+
 class Table:
-    modified_flag_bc = Broadcaster(ModifiedFlag.ORIGINAL)
+    # The receivers get every flag sent since they last looked
+    modified_flag_bc = Broadcaster(ModifiedFlag.ORIGINAL, merge=operator.or_)
 
-    def __init__(self, database: Database):
+    def __init__(self, database: Writer):
         self._db = database
 
-    async def insert(self, order_id: int) -> None:
-        await self._db.execute(sa_exp.insert(Order), {"order_id": order_id})
-        self.modified_flag_bc.send(ModifiedFlag.INCOMING)
-
-    @staticmethod
-    def _update(order_id: int) -> sa_exp.Update:
-        return sa_exp.update(Order).where(Order.order_id == order_id)
+    async def _insert(self) -> int:
+        """
+        Insert a new order under the next order number and return the number.
+        Use `place_order` to insert the ordered items in the same transaction.
 
-    async def cancel(self, order_id: int) -> None:
-        values = {"canceled_at": datetime.now(timezone.utc), "completed_at": None}
-        await self._db.execute(self._update(order_id), values)
-        self.modified_flag_bc.send(ModifiedFlag.RESOLVED)
+        The number is computed and written by a single statement, so it cannot
+        be handed out twice even if several workers place orders at once.
+        """
+        next_order_id = sa_func.coalesce(sa_func.max(Order.order_id), 0) + 1
+        query = (
+            sa_exp.insert(Order)
+            .from_select([Order.order_id], sa_exp.select(next_order_id))
+            .returning(Order.order_id)
+        )
+        return await self._db.fetch_val(query)
+
+    async def _cancel(self, order_id: int) -> None:
+        """Use `cancel_order` to commit and broadcast the change in a batch."""
+        await _CANCEL.execute(self._db, order_id=order_id, at=epoch_ms())
 
     async def _complete(self, order_id: int) -> None:
         """
         Use `supply_all_and_complete` when the `supplied_at` fields of
         `ordered_items` table should be updated as well.
         """
-        values = {"canceled_at": None, "completed_at": datetime.now(timezone.utc)}
-        await self._db.execute(self._update(order_id), values)
-
-    async def reset(self, order_id: int) -> None:
-        values = {"canceled_at": None, "completed_at": None}
-        await self._db.execute(self._update(order_id), values)
-        self.modified_flag_bc.send(ModifiedFlag.PUT_BACK)
-
-    async def by_order_id(self, order_id: int) -> Order | None:
-        query = sa_exp.select(Order).where(Order.order_id == order_id)
-        maybe_record = await self._db.fetch_one(query)
-        if (record := maybe_record) is None:
+        await _COMPLETE.execute(self._db, order_id=order_id, at=epoch_ms())
+
+    async def _reset(self, order_id: int) -> None:
+        """Use `reset_order` to commit and broadcast the change in a batch."""
+        await _RESET.execute(self._db, order_id=order_id)
+
+    async def by_order_id(self, order_id: int) -> OrderRow | None:
+        if (row := await _BY_ORDER_ID.fetch_one(self._db, order_id=order_id)) is None:
             return None
-        return Order(**record._mapping)
+        return OrderRow(*row)
 
-    async def select_all(self) -> list[Order]:
-        query = sa_exp.select(Order)
-        return [Order(**m) async for m in self._db.iterate(query)]
+    async def select_all(self) -> list[OrderRow]:
+        rows = await _SELECT_ALL.fetch_all(self._db)
+        return [OrderRow(*row) for row in rows]
@@ -1,15 +1,14 @@
-from datetime import datetime, timezone
+from dataclasses import dataclass, fields
 
 import sqlalchemy.sql.expression as sa_exp
-from databases import Database
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy.schema import ForeignKey
-from sqlalchemy.sql.functions import func as sa_func
-from sqlalchemy.sql.sqltypes import DateTime
+from sqlalchemy.schema import ForeignKey, Index
 
-from .base import Base
+from .base import Base, epoch_ms
+from .connections import Writer
 from .order import Order
 from .product import Product
+from .statements import Statement
 
 
 class OrderedItem(Base):
@@ -18,44 +17,77 @@ class OrderedItem(Base):
     order_id: Mapped[int] = mapped_column(ForeignKey(Order.order_id))
     item_no: Mapped[int]
     product_id: Mapped[int] = mapped_column(ForeignKey(Product.product_id))
-    supplied_at: Mapped[datetime | None] = mapped_column(
-        DateTime(timezone=True), default=None
-    )
+    supplied_at: Mapped[int | None] = mapped_column(default=None)  # In epoch_ms
+    # The price of the product when it was ordered, recorded by the sales rollup
+    # triggers. NULL for the items ordered before it was recorded.
+    price: Mapped[int | None] = mapped_column(default=None)
+
+
+Index(
+    "ix_ordered_items_order_id_product_id", OrderedItem.order_id, OrderedItem.product_id
+)
+# Same as above but only covers the items still waiting to be supplied
+Index(
+    "ix_ordered_items_unsupplied",
+    OrderedItem.product_id,
+    OrderedItem.order_id,
+    sqlite_where=OrderedItem.supplied_at.is_(None),
+)
+
+
+@dataclass(slots=True)
+class OrderedItemRow:
+    """A row of `ordered_items` as read by `Table`, like `product.ProductRow`."""
+
+    order_id: int
+    item_no: int
+    product_id: int
+    supplied_at: int | None
+    price: int | None
+    id: int | None = None
+
+
+_SELECT_ALL = Statement("ordered_item.select_all", sa_exp.select(OrderedItem))
+_BY_ORDER_ID = Statement(
+    "ordered_item.by_order_id",
+    sa_exp.select(OrderedItem).where(
+        OrderedItem.order_id == sa_exp.bindparam("order_id")
+    ),
+)
+assert _SELECT_ALL.columns == tuple(f.name for f in fields(OrderedItemRow))
 
 
 class Table:
-    _last_order_id: int | None
-    _db: Database
+    _db: Writer
 
-    def __init__(self, database: Database):
+    def __init__(self, database: Writer):
         self._db = database
 
-    async def ainit(self) -> None:
-        query = sa_func.max(OrderedItem.order_id).select()
-        self._last_order_id = await self._db.fetch_val(query)
-
-    async def select_all(self) -> list[OrderedItem]:
-        query = sa_exp.select(OrderedItem)
-        return [OrderedItem(**m) async for m in self._db.iterate(query)]
+    async def select_all(self) -> list[OrderedItemRow]:
+        rows = await _SELECT_ALL.fetch_all(self._db)
+        return [OrderedItemRow(*row) for row in rows]
 
-    async def by_order_id(self, order_id: int) -> list[OrderedItem]:
-        query = sa_exp.select(OrderedItem).where(OrderedItem.order_id == order_id)
-        return [OrderedItem(**m) async for m in self._db.iterate(query)]
+    async def by_order_id(self, order_id: int) -> list[OrderedItemRow]:
+        rows = await _BY_ORDER_ID.fetch_all(self._db, order_id=order_id)
+        return [OrderedItemRow(*row) for row in rows]
 
-    async def issue(self, product_ids: list[int]) -> int:
-        order_id = (self._last_order_id or 0) + 1
+    async def _issue(self, order_id: int, product_ids: list[int]) -> None:
+        """
+        Use `place_order` to reserve `order_id` and insert the ordered items in
+        one transaction.
+        """
         await self._db.execute_many(
             sa_exp.insert(OrderedItem).values(order_id=order_id),
             [{"item_no": i, "product_id": pid} for i, pid in enumerate(product_ids)],
         )
-        self._last_order_id = order_id
-        return order_id
 
-    async def _supply(self, order_id: int, product_id: int):
+    async def _supply(self, order_id: int, product_id: int) -> int:
         query = sa_exp.update(OrderedItem).where(
             (OrderedItem.order_id == order_id) & (OrderedItem.product_id == product_id)
         )
-        await self._db.execute(query, {"supplied_at": datetime.now(timezone.utc)})
+        supplied_at = epoch_ms()
+        await self._db.execute(query, {"supplied_at": supplied_at})
+        return supplied_at
 
     async def _supply_all(self, order_id: int):
         """
@@ -63,9 +95,8 @@ class Table:
         `orders` table should be updated as well.
         """
         query = sa_exp.update(OrderedItem).where(OrderedItem.order_id == order_id)
-        await self._db.execute(query, {"supplied_at": datetime.now(timezone.utc)})
+        await self._db.execute(query, {"supplied_at": epoch_ms()})
 
     # NOTE: this function needs authorization since it destroys all receipts
     # async def clear(self) -> None:
     #     await self._db.execute(sa_exp.delete(OrderedItem))
-    #     self._last_order_id = None
@@ -1,13 +1,17 @@
 import csv
-from dataclasses import asdict
+import time
+from dataclasses import asdict, dataclass, fields
 from typing import Any, Iterable
 
 import sqlalchemy.sql.expression as sae
-from databases import Database
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.sql.sqltypes import String
 
+from ..bc import Broadcaster
 from .base import Base
+from .connections import Writer
+from .statements import Statement
+from .table_version import version_of
 
 
 class Product(Base):
@@ -27,11 +31,62 @@ class Product(Base):
         return f"¥{price:,}"
 
 
+@dataclass(slots=True)
+class ProductRow:
+    """
+    A row of `products` as read by `Table`. `Product` is kept for the schema
+    and the writes, since building an instance of it is several times slower.
+    """
+
+    product_id: int
+    name: str
+    filename: str
+    price: int
+    no_stock: int | None
+    id: int | None = None
+
+    def price_str(self) -> str:
+        return Product.to_price_str(self.price)
+
+
+_SELECT_ALL = Statement(
+    "product.select_all", sae.select(Product).order_by(Product.product_id.asc())
+)
+assert _SELECT_ALL.columns == tuple(f.name for f in fields(ProductRow))
+
+_VERSION_QUERY = str(
+    version_of("products").compile(compile_kwargs={"literal_binds": True})
+)
+
+
 class Table:
-    def __init__(self, database: Database):
+    """
+    The catalog changes a few times a day but is looked up on every tap in the
+    register, so the lookups are served from a copy in memory. The copy is
+    tagged with the version of the products table it was read at, and is
+    reloaded on the next lookup once a newer version is sent to
+    `modified_version_bc`, which happens after every change made through this
+    class or `app.store.delete_product`, in any worker. In case such a version
+    is lost, e.g. while the relay between the workers is being set up again,
+    the lookups also read the version from the database once every
+    `recheck_secs`.
+
+    The products handed out are shared by every caller and must not be mutated.
+    """
+
+    modified_version_bc = Broadcaster(0)
+
+    def __init__(self, database: Writer, recheck_secs: float):
         self._db = database
+        self._recheck_secs = recheck_secs
+        self._catalog: dict[int, ProductRow] | None = None  # Ordered by product_id
+        self._catalog_version = -1
+        self._recheck_at = 0.0
 
     async def ainit(self) -> None:
+        # Start over in case the database has been replaced since the last run
+        self._catalog = None
+        self.modified_version_bc.shared.value = 0
         if not await self._empty():
             return
         await self.renew_from_static_csv()
@@ -59,6 +114,7 @@ class Table:
         async with self._db.transaction():
             await self._db.execute(sae.delete(Product))
             await self._insert_many(products)
+        await self._modified()
 
     async def _empty(self) -> bool:
         return await self._db.fetch_one(sae.select(Product)) is None
@@ -67,25 +123,32 @@ class Table:
         query = sae.insert(Product)
         await self._db.execute_many(query, [asdict(p) for p in products])
 
-    async def select_all(self) -> list[Product]:
-        query = sae.select(Product).order_by(Product.product_id.asc())
-        return [Product(**m) async for m in self._db.iterate(query)]
+    @property
+    def catalog_version(self) -> int:
+        """The version of the products table that the catalog was last read at."""
+        return self._catalog_version
 
-    async def by_product_id(self, product_id: int) -> Product | None:
-        query = sae.select(Product).where(Product.product_id == product_id)
-        maybe_record = await self._db.fetch_one(query)
-        if (record := maybe_record) is None:
-            return None
-        return Product(**dict(record._mapping))
+    async def select_all(self) -> list[ProductRow]:
+        return list((await self._products()).values())
 
-    async def insert(self, product: Product) -> Product | None:
+    async def by_product_id(self, product_id: int) -> ProductRow | None:
+        return (await self._products()).get(product_id)
+
+    async def by_product_ids(self, product_ids: Iterable[int]) -> dict[int, ProductRow]:
+        catalog = await self._products()
+        return {pid: catalog[pid] for pid in set(product_ids) if pid in catalog}
+
+    async def insert(self, product: Product) -> ProductRow | None:
         query = sae.insert(Product).returning(sae.literal_column("*"))
         maybe_record = await self._db.fetch_one(query, asdict(product))
         if (record := maybe_record) is None:
             return None
-        return Product(**record._mapping)
+        await self._modified()
+        return ProductRow(**record._mapping)
 
-    async def update(self, product_id: int, new_product: Product) -> Product | None:
+    async def update(
+        self, product_id: int, new_product: Product | ProductRow
+    ) -> ProductRow | None:
         dump = asdict(new_product)
         dump.pop("id")
 
@@ -106,4 +169,31 @@ class Table:
         maybe_record = await self._db.fetch_one(query)
         if (record := maybe_record) is None:
             return None
-        return Product(**dict(record._mapping))
+        await self._modified()
+        return ProductRow(**record._mapping)
+
+    async def _products(self) -> dict[int, ProductRow]:
+        if (
+            self._catalog is None
+            or self.modified_version_bc.shared.value > self._catalog_version
+        ):
+            await self._reload()
+        elif time.monotonic() >= self._recheck_at:
+            self._recheck_at = time.monotonic() + self._recheck_secs
+            if await self._db.fetch_val(_VERSION_QUERY) != self._catalog_version:
+                await self._reload()
+        assert self._catalog is not None
+        return self._catalog
+
+    async def _reload(self) -> None:
+        async with self._db.transaction():
+            version = await self._db.fetch_val(_VERSION_QUERY)
+            rows = await _SELECT_ALL.fetch_all(self._db)
+        self._catalog = {row[0]: ProductRow(*row) for row in rows}
+        self._catalog_version = version
+        self._recheck_at = time.monotonic() + self._recheck_secs
+
+    async def _modified(self) -> None:
+        """Reload the catalog after a committed change and tell the other workers."""
+        await self._reload()
+        self.modified_version_bc.send(self._catalog_version)
@@ -0,0 +1,234 @@
+from datetime import date
+
+import sqlalchemy
+import sqlalchemy.sql.expression as sa_exp
+from databases import Database
+from sqlalchemy import event
+from sqlalchemy.orm import Mapped
+from sqlalchemy.schema import UniqueConstraint
+
+from .archive import ALL_ORDERED_ITEMS, ALL_ORDERS
+from .base import Base
+from .order import Order
+
+
+class SalesRollup(Base):
+    """
+    The number of items sold and the revenue per product and business day, i.e.
+    the local date of `Order.ordered_at`. Canceled orders are not counted.
+    """
+
+    __tablename__ = "sales_rollups"
+    __table_args__ = (UniqueConstraint("business_day", "product_id"),)
+
+    business_day: Mapped[date]
+    product_id: Mapped[int]
+    count: Mapped[int]
+    revenue: Mapped[int]
+
+
+class ServiceTimeRollup(Base):
+    """
+    The number of orders completed and the sum of their service times, from
+    `Order.ordered_at` to `Order.completed_at`, per business day, for the
+    average service time over all orders.
+    """
+
+    __tablename__ = "service_time_rollups"
+    __table_args__ = (UniqueConstraint("business_day"),)
+
+    business_day: Mapped[date]
+    count: Mapped[int]
+    total_ms: Mapped[int]
+
+
+# The rollups are kept up to date by the database itself, so that every write
+# to the orders and their items is counted in the same transaction, no matter
+# which worker or tool makes it. Items are valued at the price of the product
+# when they are ordered, which is recorded in `ordered_items.price` so that
+# taking them off, with negative counts and revenues, takes off the same amount
+# after the price has changed. The items ordered before the price was recorded
+# are valued at the current price.
+TRIGGERS: tuple[str, ...] = (
+    """
+CREATE TRIGGER IF NOT EXISTS sales_rollups_item_insert
+AFTER INSERT ON ordered_items
+BEGIN
+    UPDATE ordered_items
+    SET price = (SELECT price FROM products WHERE product_id = NEW.product_id)
+    WHERE id = NEW.id AND price IS NULL;
+    INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+    SELECT
+        date(ordered_at / 1000, 'unixepoch', 'localtime'),
+        NEW.product_id,
+        1,
+        coalesce((SELECT price FROM ordered_items WHERE id = NEW.id), 0)
+    FROM orders WHERE order_id = NEW.order_id AND canceled_at IS NULL
+    ON CONFLICT (business_day, product_id) DO UPDATE SET
+        count = count + excluded.count, revenue = revenue + excluded.revenue;
+END
+""",
+    """
+CREATE TRIGGER IF NOT EXISTS sales_rollups_item_delete
+AFTER DELETE ON ordered_items
+BEGIN
+    INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+    SELECT
+        date(ordered_at / 1000, 'unixepoch', 'localtime'),
+        OLD.product_id,
+        -1,
+        -coalesce(
+            OLD.price,
+            (SELECT price FROM products WHERE product_id = OLD.product_id),
+            0
+        )
+    FROM orders WHERE order_id = OLD.order_id AND canceled_at IS NULL
+    ON CONFLICT (business_day, product_id) DO UPDATE SET
+        count = count + excluded.count, revenue = revenue + excluded.revenue;
+    DELETE FROM sales_rollups WHERE product_id = OLD.product_id AND count <= 0;
+END
+""",
+    # Takes the items off on cancel and puts them back on reset or complete
+    """
+CREATE TRIGGER IF NOT EXISTS sales_rollups_order_cancel
+AFTER UPDATE OF canceled_at ON orders
+WHEN (OLD.canceled_at IS NULL) != (NEW.canceled_at IS NULL)
+BEGIN
+    INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+    SELECT
+        date(NEW.ordered_at / 1000, 'unixepoch', 'localtime'),
+        ordered_items.product_id,
+        iif(NEW.canceled_at IS NULL, 1, -1) * count(*),
+        iif(NEW.canceled_at IS NULL, 1, -1)
+            * coalesce(sum(coalesce(ordered_items.price, products.price)), 0)
+    FROM ordered_items
+    LEFT JOIN products ON products.product_id = ordered_items.product_id
+    WHERE ordered_items.order_id = NEW.order_id
+    GROUP BY ordered_items.product_id
+    ON CONFLICT (business_day, product_id) DO UPDATE SET
+        count = count + excluded.count, revenue = revenue + excluded.revenue;
+    DELETE FROM sales_rollups
+    WHERE business_day = date(NEW.ordered_at / 1000, 'unixepoch', 'localtime')
+        AND count <= 0;
+END
+""",
+    # Like the sales rollups, archiving deletes the orders without taking them off
+    """
+CREATE TRIGGER IF NOT EXISTS service_time_rollups_order_insert
+AFTER INSERT ON orders
+WHEN NEW.completed_at IS NOT NULL
+BEGIN
+    INSERT INTO service_time_rollups (business_day, count, total_ms)
+    VALUES (
+        date(NEW.ordered_at / 1000, 'unixepoch', 'localtime'),
+        1,
+        NEW.completed_at - NEW.ordered_at
+    )
+    ON CONFLICT (business_day) DO UPDATE SET
+        count = count + excluded.count, total_ms = total_ms + excluded.total_ms;
+END
+""",
+    """
+CREATE TRIGGER IF NOT EXISTS service_time_rollups_order_update
+AFTER UPDATE OF ordered_at, completed_at ON orders
+WHEN OLD.completed_at IS NOT NEW.completed_at OR OLD.ordered_at != NEW.ordered_at
+BEGIN
+    INSERT INTO service_time_rollups (business_day, count, total_ms)
+    SELECT
+        date(OLD.ordered_at / 1000, 'unixepoch', 'localtime'),
+        -1,
+        OLD.ordered_at - OLD.completed_at
+    WHERE OLD.completed_at IS NOT NULL
+    ON CONFLICT (business_day) DO UPDATE SET
+        count = count + excluded.count, total_ms = total_ms + excluded.total_ms;
+    INSERT INTO service_time_rollups (business_day, count, total_ms)
+    SELECT
+        date(NEW.ordered_at / 1000, 'unixepoch', 'localtime'),
+        1,
+        NEW.completed_at - NEW.ordered_at
+    WHERE NEW.completed_at IS NOT NULL
+    ON CONFLICT (business_day) DO UPDATE SET
+        count = count + excluded.count, total_ms = total_ms + excluded.total_ms;
+    DELETE FROM service_time_rollups
+    WHERE business_day = date(OLD.ordered_at / 1000, 'unixepoch', 'localtime')
+        AND count <= 0;
+END
+""",
+)
+
+# After all the tables, since the triggers refer to the other ones
+for trigger in TRIGGERS:
+    event.listen(Base.metadata, "after_create", sqlalchemy.DDL(trigger))
+
+# Archived orders included, since moving them to the archive leaves them counted
+_REBUILD_QUERY = f"""
+INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+SELECT
+    date(orders.ordered_at / 1000, 'unixepoch', 'localtime'),
+    ordered_items.product_id,
+    count(*),
+    coalesce(sum(coalesce(ordered_items.price, products.price)), 0)
+FROM {ALL_ORDERED_ITEMS} AS ordered_items
+JOIN {ALL_ORDERS} AS orders ON orders.order_id = ordered_items.order_id
+LEFT JOIN products ON products.product_id = ordered_items.product_id
+WHERE orders.canceled_at IS NULL
+GROUP BY 1, 2
+"""
+_REBUILD_SERVICE_TIMES_QUERY = f"""
+INSERT INTO service_time_rollups (business_day, count, total_ms)
+SELECT
+    date(ordered_at / 1000, 'unixepoch', 'localtime'),
+    count(*),
+    sum(completed_at - ordered_at)
+FROM {ALL_ORDERS} AS orders
+WHERE completed_at IS NOT NULL
+GROUP BY 1
+"""
+_ANY_COMPLETED_QUERY = (
+    f"SELECT 1 FROM {ALL_ORDERS} AS orders WHERE completed_at IS NOT NULL LIMIT 1"
+)
+
+
+class Table:
+    def __init__(self, database: Database):
+        self._db = database
+
+    async def create_triggers(self) -> None:
+        for trigger in TRIGGERS:
+            await self._db.execute(trigger)
+
+    async def ainit(self) -> None:
+        """Count the existing orders when the rollups have just been created."""
+        if await self._db.fetch_one(sa_exp.select(Order.id)) is None:
+            return
+        no_sales = await self._db.fetch_one(sa_exp.select(SalesRollup.id)) is None
+        no_service_times = (
+            await self._db.fetch_one(sa_exp.select(ServiceTimeRollup.id)) is None
+            and await self._db.fetch_one(_ANY_COMPLETED_QUERY) is not None
+        )
+        if no_sales or no_service_times:
+            await self.rebuild()
+
+    async def rebuild(self) -> None:
+        """
+        Recount the rollups from every order, valuing the items at the prices
+        they were sold at, or at the current prices if those are not recorded.
+        The service times are summed up again as well.
+        """
+        async with self._db.transaction():
+            await self._db.execute(sa_exp.delete(SalesRollup))
+            await self._db.execute(_REBUILD_QUERY)
+            await self._db.execute(sa_exp.delete(ServiceTimeRollup))
+            await self._db.execute(_REBUILD_SERVICE_TIMES_QUERY)
+
+    async def select_all(self) -> list[SalesRollup]:
+        query = sa_exp.select(SalesRollup).order_by(
+            SalesRollup.business_day, SalesRollup.product_id
+        )
+        return [SalesRollup(**m) async for m in self._db.iterate(query)]
+
+    async def select_service_times(self) -> list[ServiceTimeRollup]:
+        query = sa_exp.select(ServiceTimeRollup).order_by(
+            ServiceTimeRollup.business_day
+        )
+        return [ServiceTimeRollup(**m) async for m in self._db.iterate(query)]
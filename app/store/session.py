@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Protocol
+from uuid import UUID, uuid4
+
+import sqlalchemy.sql.expression as sa_exp
+from databases import Database
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql.functions import func as sa_func
+
+from .base import Base
+
+logger = logging.getLogger(__name__)
+
+
+class RegisterSession(Base):
+    __tablename__ = "register_sessions"
+
+    session_key: Mapped[UUID] = mapped_column(unique=True)
+    cart: Mapped[bytes]
+    updated_at: Mapped[datetime] = mapped_column(
+        server_default=sa_exp.text("CURRENT_TIMESTAMP")
+    )
+
+
+@dataclass
+class Cart:
+    """
+    The products put in a register session, in the order they were added.
+
+    Items are keyed by a number that is unique within the cart so that they can
+    be removed individually even if the same product is added more than once.
+    """
+
+    items: dict[int, int] = field(default_factory=dict)  # item_id -> product_id
+    next_item_id: int = 0
+
+    def add(self, product_id: int) -> int:
+        item_id = self.next_item_id
+        self.items[item_id] = product_id
+        self.next_item_id += 1
+        return item_id
+
+    def delete(self, item_id: int) -> None:
+        self.items.pop(item_id, None)
+
+    def clear(self) -> None:
+        self.items.clear()
+
+    def product_ids(self) -> list[int]:
+        return list(self.items.values())
+
+    def counts(self) -> dict[int, int]:
+        counts: dict[int, int] = {}
+        for product_id in self.items.values():
+            counts[product_id] = counts.get(product_id, 0) + 1
+        return counts
+
+    # The encoded cart is a flat array of unsigned ints:
+    # `next_item_id, item_id_0, product_id_0, item_id_1, product_id_1, ...`
+    def encode(self) -> bytes:
+        encoded = array("I", [self.next_item_id])
+        for item_id, product_id in self.items.items():
+            encoded.extend((item_id, product_id))
+        return encoded.tobytes()
+
+    @classmethod
+    def decode(cls, data: bytes) -> "Cart":
+        decoded = array("I")
+        decoded.frombytes(data)
+        items = dict(zip(decoded[1::2], decoded[2::2]))
+        return cls(items=items, next_item_id=decoded[0])
+
+
+@dataclass
+class Stats:
+    count: int
+    cart_bytes: int  # The total size of the encoded carts
+
+
+class Store(Protocol):
+    async def create(self) -> UUID: ...
+    async def get(self, session_key: UUID) -> Cart | None: ...
+    async def update(
+        self, session_key: UUID, change: Callable[[Cart], object]
+    ) -> Cart | None: ...
+    async def pop(self, session_key: UUID) -> Cart | None: ...
+    async def evict(self) -> int: ...
+    async def stats(self) -> Stats: ...
+
+
+class MemoryStore:
+    """
+    Keeps carts in the memory of the current worker, from the least to the most
+    recently used one. Creating a session beyond `max_count` drops the least
+    recently used cart right away.
+    """
+
+    def __init__(self, idle_ttl_secs: float, max_count: int):
+        self._idle_ttl_secs = idle_ttl_secs
+        self._max_count = max_count
+        # session_key -> (time of the last use, encoded cart)
+        self._carts: OrderedDict[UUID, tuple[float, bytes]] = OrderedDict()
+
+    async def create(self) -> UUID:
+        session_key = uuid4()
+        self._carts[session_key] = (time.monotonic(), Cart().encode())
+        while len(self._carts) > self._max_count:
+            self._carts.popitem(last=False)
+        return session_key
+
+    async def get(self, session_key: UUID) -> Cart | None:
+        if (entry := self._carts.get(session_key)) is None:
+            return None
+        self._carts[session_key] = (time.monotonic(), entry[1])
+        self._carts.move_to_end(session_key)
+        return Cart.decode(entry[1])
+
+    async def update(
+        self, session_key: UUID, change: Callable[[Cart], object]
+    ) -> Cart | None:
+        """Apply `change` to the cart and return it, unless it is gone."""
+        if (entry := self._carts.get(session_key)) is None:
+            return None
+        cart = Cart.decode(entry[1])
+        change(cart)
+        self._carts[session_key] = (time.monotonic(), cart.encode())
+        self._carts.move_to_end(session_key)
+        return cart
+
+    async def pop(self, session_key: UUID) -> Cart | None:
+        """Remove the cart and return it, to the only caller that removed it."""
+        if (entry := self._carts.pop(session_key, None)) is None:
+            return None
+        return Cart.decode(entry[1])
+
+    async def evict(self) -> int:
+        """Drop the carts that have not been used for `idle_ttl_secs`."""
+        deadline = time.monotonic() - self._idle_ttl_secs
+        evicted = 0
+        while self._carts:
+            session_key, (last_used, _) = next(iter(self._carts.items()))
+            if last_used > deadline:
+                break
+            self._carts.pop(session_key)
+            evicted += 1
+        return evicted
+
+    async def stats(self) -> Stats:
+        cart_bytes = sum(len(cart) for _, cart in self._carts.values())
+        return Stats(count=len(self._carts), cart_bytes=cart_bytes)
+
+
+class Table:
+    """
+    Keeps carts in the database so that every worker sees the same carts. The
+    `max_count` bound is enforced by `evict` rather than on every creation so
+    that starting a session costs a single insert.
+    """
+
+    def __init__(self, database: Database, idle_ttl_secs: float, max_count: int):
+        self._db = database
+        self._idle_ttl_secs = idle_ttl_secs
+        self._max_count = max_count
+
+    async def create(self) -> UUID:
+        session_key = uuid4()
+        values = {"session_key": session_key, "cart": Cart().encode()}
+        await self._db.execute(sa_exp.insert(RegisterSession), values)
+        return session_key
+
+    async def get(self, session_key: UUID) -> Cart | None:
+        # Counts as a use, as in `MemoryStore`, so that a cart looked at but not
+        # changed is not evicted as idle
+        query = (
+            sa_exp.update(RegisterSession)
+            .where(RegisterSession.session_key == session_key)
+            .values(updated_at=sa_func.current_timestamp())
+            .returning(RegisterSession.cart)
+        )
+        if (data := await self._db.fetch_val(query)) is None:
+            return None
+        return Cart.decode(data)
+
+    async def update(
+        self, session_key: UUID, change: Callable[[Cart], object]
+    ) -> Cart | None:
+        """
+        Apply `change` to the cart and return it, unless it is gone. The cart is
+        written back only if it is still the one read, so that the changes made
+        in the meantime, by this worker or another, are applied on top of each
+        other rather than lost; `change` is run again on the newer cart.
+        """
+        by_session_key = RegisterSession.session_key == session_key
+        select = sa_exp.select(RegisterSession.cart).where(by_session_key)
+        while (data := await self._db.fetch_val(select)) is not None:
+            cart = Cart.decode(data)
+            change(cart)
+            query = (
+                sa_exp.update(RegisterSession)
+                .where(by_session_key & (RegisterSession.cart == data))
+                .values(cart=cart.encode(), updated_at=sa_func.current_timestamp())
+                .returning(RegisterSession.id)
+            )
+            if await self._db.fetch_val(query) is not None:
+                return cart
+        return None
+
+    async def pop(self, session_key: UUID) -> Cart | None:
+        """Remove the cart and return it, to the only caller that removed it."""
+        query = (
+            sa_exp.delete(RegisterSession)
+            .where(RegisterSession.session_key == session_key)
+            .returning(RegisterSession.cart)
+        )
+        if (data := await self._db.fetch_val(query)) is None:
+            return None
+        return Cart.decode(data)
+
+    async def evict(self) -> int:
+        """
+        Drop the carts that have not been used for `idle_ttl_secs`, then the
+        least recently used ones beyond `max_count`.
+        """
+        deadline = sa_func.datetime("now", f"-{int(self._idle_ttl_secs)} seconds")
+        idle = (
+            sa_exp.delete(RegisterSession)
+            .where(RegisterSession.updated_at <= deadline)
+            .returning(RegisterSession.id)
+        )
+        recent = (
+            sa_exp.select(RegisterSession.id)
+            .order_by(RegisterSession.updated_at.desc(), RegisterSession.id.desc())
+            .limit(self._max_count)
+        )
+        overflow = (
+            sa_exp.delete(RegisterSession)
+            .where(RegisterSession.id.not_in(recent.scalar_subquery()))
+            .returning(RegisterSession.id)
+        )
+        async with self._db.transaction():
+            evicted = len(await self._db.fetch_all(idle))
+            evicted += len(await self._db.fetch_all(overflow))
+        return evicted
+
+    async def stats(self) -> Stats:
+        query = sa_exp.select(
+            sa_func.count(RegisterSession.id),
+            sa_func.coalesce(sa_func.sum(sa_func.length(RegisterSession.cart)), 0),
+        )
+        record = await self._db.fetch_one(query)
+        assert record is not None
+        return Stats(count=record[0], cart_bytes=record[1])
+
+
+async def sweep(store: Store, interval_secs: float) -> None:
+    """Evict idle sessions every `interval_secs` until cancelled."""
+    while True:
+        await asyncio.sleep(interval_secs)
+        try:
+            await store.evict()
+        except Exception:
+            # Such as the database being locked by another worker; the sessions
+            # are still there for the next sweep.
+            logger.exception("Failed to evict the idle register sessions")
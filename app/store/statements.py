@@ -0,0 +1,101 @@
+# Precompiled statements for the hot paths
+#
+# `databases` compiles the SQLAlchemy expression it is given and wraps each row
+# of the result in two objects on every call, which costs more than SQLite
+# itself takes for the point lookups and updates done on every click. A
+# `Statement` is compiled once at import time and runs straight on the
+# aiosqlite connection, returning plain tuples.
+
+from typing import Any, AsyncContextManager, Callable, Protocol, cast
+
+import aiosqlite
+from sqlalchemy.dialects.sqlite import dialect as sqlite_dialect
+from sqlalchemy.sql import ClauseElement
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.expression import ReturnsRows
+from sqlalchemy.types import TypeEngine
+
+_DIALECT = sqlite_dialect(paramstyle="named")
+
+# Every statement by name, so that the SQL of all of them can be reviewed in the
+# snapshot tests
+registry: dict[str, "Statement"] = {}
+
+
+def _impl(type_: TypeEngine) -> TypeEngine:
+    """The SQLite implementation of `type_`, which converts the values."""
+    return type_.dialect_impl(_DIALECT)
+
+
+class Source(Protocol):
+    """`app.store.connections.Writer` or `app.store.connections.ReadPool`"""
+
+    def raw_connection(self) -> AsyncContextManager[aiosqlite.Connection]: ...
+
+
+class Statement:
+    """
+    A query compiled into SQLite's SQL with named parameters, e.g. with
+    `bindparam("order_id")`, which are passed to the methods as keywords.
+    Parameters and columns are converted the same way as in `databases`, so
+    datetimes are written and read back as such.
+    """
+
+    def __init__(self, name: str, query: ClauseElement):
+        compiled = query.compile(dialect=_DIALECT)
+        assert isinstance(compiled, SQLCompiler)
+        self.name = name
+        self.sql = str(compiled)
+
+        self._bind_processors: dict[str, Callable[[Any], Any]] = {}
+        for key, bind in compiled.binds.items():
+            if (processor := _impl(bind.type).bind_processor(_DIALECT)) is not None:
+                self._bind_processors[key] = processor
+
+        # The selected or returned columns, none for the other statements
+        columns = query.exported_columns if isinstance(query, ReturnsRows) else []
+        self.columns: tuple[str, ...] = tuple(column.name for column in columns)
+        processors = [
+            _impl(column.type).result_processor(_DIALECT, None) for column in columns
+        ]
+        self._result_processors = processors if any(processors) else None
+
+        assert name not in registry, f"duplicate statement name {name}"
+        registry[name] = self
+
+    async def fetch_all(self, source: Source, **values: Any) -> list[tuple]:
+        async with source.raw_connection() as connection:
+            async with connection.execute(self.sql, self._params(values)) as cursor:
+                rows = await cursor.fetchall()
+        # Without a row factory on the connections, the rows are plain tuples
+        if self._result_processors is None:
+            return cast(list[tuple], rows)
+        return [self._convert(row) for row in rows]
+
+    async def fetch_one(self, source: Source, **values: Any) -> tuple | None:
+        async with source.raw_connection() as connection:
+            async with connection.execute(self.sql, self._params(values)) as cursor:
+                row = await cursor.fetchone()
+        if row is None or self._result_processors is None:
+            return cast(tuple | None, row)
+        return self._convert(row)
+
+    async def execute(self, source: Source, **values: Any) -> None:
+        async with source.raw_connection() as connection:
+            await connection.execute(self.sql, self._params(values))
+
+    def _params(self, values: dict[str, Any]) -> dict[str, Any]:
+        processors = self._bind_processors
+        if not processors:
+            return values
+        return {
+            key: processors[key](value) if key in processors else value
+            for key, value in values.items()
+        }
+
+    def _convert(self, row: Any) -> tuple:
+        assert self._result_processors is not None
+        return tuple(
+            value if processor is None or value is None else processor(value)
+            for processor, value in zip(self._result_processors, row)
+        )
@@ -0,0 +1,66 @@
+import sqlalchemy
+import sqlalchemy.sql.expression as sa_exp
+from databases import Database
+from sqlalchemy import event
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql.functions import func as sa_func
+from sqlalchemy.sql.sqltypes import String
+
+from .base import Base
+
+
+class TableVersion(Base):
+    """
+    A counter per table that goes up with every row inserted, updated or
+    deleted, so that anything derived from the table can tell whether it is
+    still current without reading the table.
+    """
+
+    __tablename__ = "table_versions"
+
+    name: Mapped[str] = mapped_column(String(length=40), unique=True)
+    version: Mapped[int] = mapped_column(default=0)
+
+
+VERSIONED_TABLES = ("orders", "ordered_items", "products")
+
+# Bumped by the database itself, like the sales rollups, so that the writes of
+# other workers and tools are accounted for as well.
+TRIGGERS: tuple[str, ...] = tuple(
+    f"""
+CREATE TRIGGER IF NOT EXISTS table_versions_{table}_{op.lower()}
+AFTER {op} ON {table}
+BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+END
+"""
+    for table in VERSIONED_TABLES
+    for op in ("INSERT", "UPDATE", "DELETE")
+)
+_SEED_QUERY = (
+    "INSERT OR IGNORE INTO table_versions (name, version) VALUES "
+    + ", ".join(f"('{table}', 0)" for table in VERSIONED_TABLES)
+)
+
+for ddl in (_SEED_QUERY, *TRIGGERS):
+    event.listen(Base.metadata, "after_create", sqlalchemy.DDL(ddl))
+
+
+def version_of(*names: str) -> sa_exp.Select:
+    """
+    A single number that changes whenever any of the tables change, since each
+    of the counters only ever goes up.
+    """
+    return sa_exp.select(sa_func.sum(TableVersion.version)).where(
+        TableVersion.name.in_(names)
+    )
+
+
+class Table:
+    def __init__(self, database: Database):
+        self._db = database
+
+    async def create_triggers(self) -> None:
+        await self._db.execute(_SEED_QUERY)
+        for trigger in TRIGGERS:
+            await self._db.execute(trigger)
@@ -0,0 +1,42 @@
+import asyncio
+import gzip
+import sqlite3
+from pathlib import Path
+
+from . import backup
+
+
+def test_backups_are_copied_and_pruned(tmp_path: Path) -> None:
+    sources = {"main": tmp_path / "app.db", "archive": tmp_path / "archive.db"}
+    for i, path in enumerate(sources.values()):
+        with sqlite3.connect(path) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("CREATE TABLE t (x BLOB)")
+            conn.executemany("INSERT INTO t VALUES (zeroblob(1000))", [()] * 100)
+            conn.execute("INSERT INTO t VALUES (?)", (i,))
+
+    async def main() -> list[backup.Backup]:
+        return [
+            await backup.create(
+                sources,
+                tmp_path / "backups",
+                compress=compress,
+                keep=2,
+                pages_per_step=4,
+                step_pause_secs=0,
+            )
+            for compress in (False, False, True)
+        ]
+
+    _, plain, compressed = asyncio.run(main())
+    assert sorted((tmp_path / "backups").iterdir()) == [plain.path, compressed.path]
+    assert sorted(p.name for p in plain.path.iterdir()) == ["app.db", "archive.db"]
+    assert plain.size > compressed.size
+
+    with gzip.open(compressed.path / "archive.db.gz") as gz:
+        (tmp_path / "restored.db").write_bytes(gz.read())
+    for path in (plain.path / "archive.db", tmp_path / "restored.db"):
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone() == ("delete",)
+            assert conn.execute("SELECT count(*) FROM t").fetchone() == (101,)
+            assert conn.execute("SELECT x FROM t WHERE rowid = 101").fetchone() == (1,)
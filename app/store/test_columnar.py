@@ -0,0 +1,63 @@
+import asyncio
+import io
+from pathlib import Path
+
+import sqlalchemy
+from databases import Database
+
+from . import columnar
+from .base import Base
+
+
+def test_round_trip(tmp_path: Path) -> None:
+    path = tmp_path / "app.db"
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            sqlalchemy.text(
+                "INSERT INTO products (product_id, name, filename, price) "
+                "VALUES (1, 'コーヒー', 'a.png', 300), (2, 'tea', 'b.png', 250)"
+            )
+        )
+        conn.execute(
+            sqlalchemy.text(
+                "INSERT INTO orders (order_id, ordered_at, completed_at, canceled_at) "
+                "VALUES (1, 1704067200000, 1704067500999, NULL), "
+                "(2, 1704067260000, NULL, 1704067320000), "
+                "(3, 1704067380000, NULL, NULL)"
+            )
+        )
+        conn.execute(
+            sqlalchemy.text(
+                "INSERT INTO ordered_items (order_id, item_no, product_id) "
+                "VALUES (1, 0, 1), (1, 1, 2), (2, 0, 1), (3, 0, 2), (3, 1, 9)"
+            )
+        )
+    engine.dispose()
+
+    async def fetch() -> columnar.OrderColumns:
+        db = Database(f"sqlite:///{path}")
+        await db.connect()
+        try:
+            return await columnar.fetch(db.connection())
+        finally:
+            await db.disconnect()
+
+    columns = asyncio.run(fetch())
+    buffer = io.BytesIO()
+    columnar.write(columns, buffer)
+    export = tmp_path / "orders.mcol"
+    export.write_bytes(buffer.getvalue())
+    loaded = columnar.load(export)
+
+    assert list(loaded.order_id) == [1, 3]
+    assert list(loaded.ordered_at) == [1704067200, 1704067380]
+    assert list(loaded.completed_at) == [1704067500, 0]
+    assert list(loaded.item_order_id) == [1, 1, 3]
+    assert list(loaded.item_no) == [0, 1, 0]
+    assert list(loaded.item_product_id) == [1, 2, 2]
+    assert list(loaded.product_id) == [1, 2]
+    assert list(loaded.product_price) == [300, 250]
+    assert [loaded.product_name(i) for i in range(2)] == ["コーヒー", "tea"]
+    assert len(buffer.getvalue()) % 8 == 0
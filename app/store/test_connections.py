@@ -0,0 +1,58 @@
+import asyncio
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from .connections import ReadPool, Writer
+
+
+def test_writer_transactions_take_turns(tmp_path: Path) -> None:
+    async def main():
+        writer = Writer(f"sqlite:///{tmp_path / 'app.db'}")
+        await writer.connect()
+        await writer.execute("CREATE TABLE counter (n INTEGER)")
+        await writer.execute("INSERT INTO counter VALUES (0)")
+
+        async def increment():
+            async with writer.transaction():
+                n = await writer.fetch_val("SELECT n FROM counter")
+                await asyncio.sleep(0)
+                await writer.execute("UPDATE counter SET n = :n", {"n": n + 1})
+
+        async def fail():
+            async with writer.transaction():
+                await writer.execute("UPDATE counter SET n = -1")
+                raise RuntimeError
+
+        results = await asyncio.gather(
+            *(increment() for _ in range(50)), fail(), return_exceptions=True
+        )
+        assert sum(isinstance(r, RuntimeError) for r in results) == 1
+        assert await writer.fetch_val("SELECT n FROM counter") == 50
+        await writer.disconnect()
+
+    asyncio.run(main())
+
+
+def test_read_pool(tmp_path: Path) -> None:
+    path = tmp_path / "app.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE t (n INTEGER)")
+        conn.execute("INSERT INTO t VALUES (1)")
+
+    async def main():
+        pool = ReadPool(f"sqlite:///file:{path}?mode=ro", 2, uri=True)
+        await pool.open()
+        try:
+            values = await asyncio.gather(
+                *(pool.fetch_val("SELECT n FROM t") for _ in range(10))
+            )
+            assert values == [1] * 10
+            assert pool.stats.acquisitions == 10
+            with pytest.raises(sqlite3.OperationalError, match="readonly"):
+                await pool.fetch_all("DELETE FROM t")
+        finally:
+            await pool.close()
+
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+import asyncio
+from pathlib import Path
+
+from ..bc import Broadcaster
+from .connections import Writer
+from .group_commit import GroupCommit
+from .order import ModifiedFlag
+
+
+def test_group_commit(tmp_path: Path) -> None:
+    async def main():
+        writer = Writer(f"sqlite:///{tmp_path / 'app.db'}")
+        await writer.connect()
+        await writer.execute("CREATE TABLE t (n INTEGER)")
+
+        sent: list[ModifiedFlag] = []
+        bc = Broadcaster(ModifiedFlag.ORIGINAL)
+        bc.forward = sent.append
+        batch = GroupCommit(writer, bc, window_secs=0.01)
+
+        def insert(n: int, flag: ModifiedFlag):
+            async def op() -> tuple[int, ModifiedFlag]:
+                await writer.execute("INSERT INTO t VALUES (:n)", {"n": n})
+                if n < 0:
+                    raise ValueError(n)
+                return n * 2, flag
+
+            return op
+
+        flags = [ModifiedFlag.SUPPLIED, ModifiedFlag.RESOLVED]
+        results = await asyncio.gather(
+            *(batch.submit(insert(n, flags[n % 2])) for n in range(10)),
+            batch.submit(insert(-1, ModifiedFlag.PUT_BACK)),
+            return_exceptions=True,
+        )
+        assert results[:10] == [n * 2 for n in range(10)]
+        assert isinstance(results[10], ValueError)
+        assert sent == [ModifiedFlag.SUPPLIED | ModifiedFlag.RESOLVED]
+        rows = await writer.fetch_all("SELECT n FROM t ORDER BY n")
+        assert [row[0] for row in rows] == list(range(10))
+
+        assert await batch.submit(insert(10, ModifiedFlag.PUT_BACK)) == 20
+        assert sent[1:] == [ModifiedFlag.PUT_BACK]
+        await writer.disconnect()
+
+    asyncio.run(main())
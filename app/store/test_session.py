@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from inline_snapshot import snapshot
+
+from .session import Cart, MemoryStore, Stats, sweep
+
+
+def test_cart_roundtrip() -> None:
+    cart = Cart()
+    for product_id in [3, 1, 3, 2]:
+        cart.add(product_id)
+    cart.delete(1)
+
+    decoded = Cart.decode(cart.encode())
+    assert decoded == cart
+    assert decoded.product_ids() == snapshot([3, 3, 2])
+    assert decoded.counts() == snapshot({3: 2, 2: 1})
+    assert decoded.add(5) == snapshot(4)
+
+
+def test_cart_encoding_is_compact() -> None:
+    cart = Cart()
+    assert len(cart.encode()) == snapshot(4)
+    for _ in range(10):
+        cart.add(1)
+    assert len(cart.encode()) == snapshot(84)
+
+
+def test_memory_store_evicts_least_recently_used() -> None:
+    async def main():
+        store = MemoryStore(idle_ttl_secs=60, max_count=2)
+        first, second = await store.create(), await store.create()
+        await store.get(first)
+        third = await store.create()
+        assert await store.get(second) is None
+        assert await store.get(first) == Cart()
+        assert await store.get(third) == Cart()
+
+    asyncio.run(main())
+
+
+def test_memory_store_evicts_idle_sessions() -> None:
+    async def main():
+        store = MemoryStore(idle_ttl_secs=0, max_count=10)
+        session_key = await store.create()
+        await store.update(session_key, lambda cart: cart.add(1))
+        assert await store.stats() == Stats(count=1, cart_bytes=12)
+        assert await store.evict() == 1
+        assert await store.get(session_key) is None
+        assert await store.stats() == Stats(count=0, cart_bytes=0)
+
+    asyncio.run(main())
+
+
+def test_memory_store_pops_once() -> None:
+    async def main():
+        store = MemoryStore(idle_ttl_secs=60, max_count=10)
+        session_key = await store.create()
+        assert await store.update(session_key, Cart.clear) == Cart()
+        assert await store.pop(session_key) == Cart()
+        assert await store.pop(session_key) is None
+        assert await store.update(session_key, Cart.clear) is None
+
+    asyncio.run(main())
+
+
+def test_sweep_outlives_failed_evictions(caplog: pytest.LogCaptureFixture) -> None:
+    class FlakyStore(MemoryStore):
+        evictions = 0
+
+        async def evict(self) -> int:
+            self.evictions += 1
+            if self.evictions == 1:
+                raise RuntimeError("database is locked")
+            return await super().evict()
+
+    async def main():
+        store = FlakyStore(idle_ttl_secs=0, max_count=10)
+        await store.create()
+        task = asyncio.create_task(sweep(store, 0))
+        while store.evictions < 2:
+            await asyncio.sleep(0)
+        task.cancel()
+        assert await store.stats() == Stats(count=0, cart_bytes=0)
+
+    asyncio.run(main())
+    assert "Failed to evict" in caplog.text
@@ -0,0 +1,220 @@
+import asyncio
+import operator
+import random
+import selectors
+from typing import Any, Callable, Coroutine
+
+import pytest
+
+from .bc import Broadcaster, Pacing
+
+
+class _FakeClock(selectors.DefaultSelector):
+    """
+    Skips ahead to the next timer whenever the event loop would wait for one,
+    so that the paced tests run the same however busy the machine is.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def select(self, timeout: float | None = None):
+        if timeout is not None:
+            self.now += timeout
+        return super().select(0)
+
+
+class _FakeClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: _FakeClock):
+        super().__init__(clock)
+        self._fake_clock = clock
+
+    def time(self) -> float:
+        return self._fake_clock.now
+
+
+def _run_with_fake_clock(
+    main: Callable[[_FakeClock], Coroutine[Any, Any, None]],
+) -> None:
+    clock = _FakeClock()
+    with asyncio.Runner(loop_factory=lambda: _FakeClockLoop(clock)) as runner:
+        runner.run(main(clock))
+
+
+def test_values_are_merged_until_received() -> None:
+    async def main():
+        bc = Broadcaster(0, merge=operator.or_)
+        async with bc.attach_receiver() as rx, bc.attach_receiver() as other:
+            bc.send(1)
+            bc.send(2)
+            assert await rx.recv() == 3
+            bc.send(4)
+            assert await rx.recv() == 4
+            assert await other.recv() == 7
+        assert bc.stats().receivers == 0
+
+        last = Broadcaster(0)
+        async with last.attach_receiver() as rx:
+            last.send(1)
+            last.send(2)
+            assert await rx.recv() == 2
+
+    asyncio.run(main())
+
+
+def test_pacing_bounds_deliveries() -> None:
+    async def main(clock: _FakeClock):
+        pacing = Pacing[int](
+            window_secs=0.05,
+            max_window_secs=0.4,
+            adaptive=False,
+            urgent=lambda value: value & 8 != 0,
+            clock=clock,
+        )
+        bc = Broadcaster(0, merge=operator.or_)
+        async with bc.attach_receiver(pacing) as rx:
+            bc.send(1)
+            assert await rx.recv() == 1  # Right away after a quiet spell
+
+            async def burst():
+                for _ in range(20):
+                    bc.send(2)
+                    await asyncio.sleep(0.005)
+
+            sender = asyncio.create_task(burst())
+            started_at = clock()
+            assert await rx.recv() == 2
+            assert clock() - started_at == pytest.approx(0.05)
+            await sender
+            assert await rx.recv() == 2
+            assert rx.deliveries == 1 + 0.1 / 0.05
+
+            # A new order does not wait for the window
+            bc.send(8)
+            started_at = clock()
+            assert await rx.recv() == 8
+            assert clock() == started_at
+
+        stats = bc.stats()
+        assert stats.sends == 22 and stats.deliveries == rx.deliveries
+
+    _run_with_fake_clock(main)
+
+
+def test_adaptive_window() -> None:
+    async def main(clock: _FakeClock):
+        pacing = Pacing[int](
+            window_secs=0.01, max_window_secs=0.08, adaptive=True, clock=clock
+        )
+        bc = Broadcaster(0)
+        async with bc.attach_receiver(pacing) as rx:
+            bc.send(0)
+            await rx.recv()
+
+            stop = asyncio.Event()
+
+            async def flood():
+                while not stop.is_set():
+                    bc.send(1)
+                    await asyncio.sleep(0.001)
+
+            sender = asyncio.create_task(flood())
+            for _ in range(6):
+                await rx.recv()
+            assert rx.window_secs == 0.08
+            assert bc.stats().max_window_secs == 0.08
+            stop.set()
+            await sender
+
+            # One at a time once things quiet down
+            async def send_later():
+                await asyncio.sleep(0.1)
+                bc.send(1)
+
+            for _ in range(6):
+                sender = asyncio.create_task(send_later())
+                await rx.recv()
+                await sender
+            assert rx.window_secs == 0.01
+
+            # Slow refreshes keep the window wide
+            await asyncio.sleep(0.006)
+            bc.send(1)
+            await rx.recv()
+            assert rx.window_secs == pytest.approx(0.06)
+
+    _run_with_fake_clock(main)
+
+
+def test_thousands_of_receivers_and_senders() -> None:
+    pacing = Pacing[int](window_secs=0.001, max_window_secs=0.01, adaptive=True)
+    senders, sends_per_sender = 10, 20
+    total = senders * sends_per_sender
+
+    async def main():
+        bc = Broadcaster(0, merge=operator.or_)
+        rng = random.Random(0)
+
+        async def receive(paced: bool) -> tuple[int, int]:
+            """The values received, merged, and the generation attached at."""
+            async with bc.attach_receiver(pacing if paced else None) as rx:
+                attached_at, received = rx.generation, 0
+                while rx.generation < total:
+                    received |= await rx.recv()
+                    if rng.random() < 0.1:
+                        await asyncio.sleep(0.001)  # Falls behind for a while
+                return received, attached_at
+
+        async def send() -> None:
+            for _ in range(sends_per_sender):
+                # Each value is a bit of its own in the order they are sent
+                bc.send(1 << bc.stats().sends)
+                await asyncio.sleep(0 if rng.random() < 0.8 else 0.001)
+
+        receivers = [
+            asyncio.create_task(receive(paced=i % 4 == 0)) for i in range(2000)
+        ]
+        await asyncio.sleep(0)
+        sending = [asyncio.create_task(send()) for _ in range(senders)]
+        while bc.stats().sends < total // 2:
+            await asyncio.sleep(0)
+        late = [asyncio.create_task(receive(paced=False)) for _ in range(500)]
+
+        await asyncio.gather(*sending)
+        results = await asyncio.gather(*receivers, *late)
+        for received, attached_at in results:
+            assert received == (1 << total) - (1 << attached_at)
+        assert all(0 < attached_at < total for _, attached_at in results[-500:])
+        stats = bc.stats()
+        assert stats.receivers == 0 and stats.sends == total
+
+    asyncio.run(main())
+
+
+def test_receivers_come_and_go_without_sends() -> None:
+    async def main():
+        bc = Broadcaster(0)
+
+        async def reconnect():
+            async with bc.attach_receiver() as rx:
+                await rx.recv()
+
+        for _ in range(100):
+            tablets = [asyncio.create_task(reconnect()) for _ in range(100)]
+            await asyncio.sleep(0)
+            for tablet in tablets:
+                tablet.cancel()
+            await asyncio.gather(*tablets, return_exceptions=True)
+        assert bc.stats().receivers == 0
+        # The ones that stopped waiting do not pile up
+        assert len(bc._latest.waiters) <= 200
+
+        async with bc.attach_receiver() as rx:
+            bc.send(1)
+            assert await rx.recv() == 1
+
+    asyncio.run(main())
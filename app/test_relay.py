@@ -0,0 +1,59 @@
+import asyncio
+from pathlib import Path
+
+from .bc import Broadcaster
+from .relay import Relay
+
+
+def _relay(bc: Broadcaster[int], path: Path) -> Relay[int]:
+    return Relay(bc, path, encode=lambda v: v, decode=lambda v: v)
+
+
+async def _wait_for(bc: Broadcaster[int], value: int) -> None:
+    async with asyncio.timeout(1), bc.attach_receiver() as rx:
+        while bc.shared.value != value:
+            await rx.recv()
+
+
+def test_relay_fans_out_to_every_worker(tmp_path: Path) -> None:
+    async def main():
+        bcs = [Broadcaster(0) for _ in range(3)]
+        relays = [_relay(bc, tmp_path / "relay.sock") for bc in bcs]
+        for relay in relays:
+            await relay.start()
+        assert [relay.is_hub for relay in relays] == [True, False, False]
+
+        bcs[1].send(1)  # spoke -> hub and the other spoke
+        await asyncio.gather(_wait_for(bcs[0], 1), _wait_for(bcs[2], 1))
+        bcs[0].send(2)  # hub -> spokes
+        await asyncio.gather(_wait_for(bcs[1], 2), _wait_for(bcs[2], 2))
+
+        for relay in relays:
+            await relay.stop()
+
+    asyncio.run(main())
+
+
+def test_relay_elects_new_hub(tmp_path: Path) -> None:
+    async def main():
+        bcs = [Broadcaster(0) for _ in range(3)]
+        relays = [_relay(bc, tmp_path / "relay.sock") for bc in bcs]
+        for relay in relays:
+            await relay.start()
+        async with asyncio.timeout(1):
+            while relays[0].spoke_count != 2:
+                await asyncio.sleep(0.01)
+
+        await relays[0].stop()
+        async with asyncio.timeout(1):
+            while relays[1].spoke_count + relays[2].spoke_count != 1:
+                await asyncio.sleep(0.01)
+        assert relays[1].is_hub != relays[2].is_hub
+
+        bcs[2].send(3)
+        await _wait_for(bcs[1], 3)
+
+        for relay in relays[1:]:
+            await relay.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+"""
+Measure the latency of adding an item to a register cart, i.e. `POST
+/register/items`, while the databases are being backed up.
+
+    uv run --frozen doit bench backup_latency --orders 200000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Coroutine
+
+from app.routers import register
+from app.store import (
+    SessionStore,
+    backup_databases,
+    database,
+    startup_and_shutdown_db,
+)
+
+STATIC_DIR = Path(__file__).parents[1] / "static"
+
+Backup = Callable[[], Coroutine[Any, Any, object]]
+
+
+def _populate(orders: int) -> None:
+    rng = random.Random(0)
+    started_at = int(time.time() * 1000) - orders * 10_000
+    with sqlite3.connect("db/app.db") as conn:
+        conn.executemany(
+            "INSERT INTO orders (order_id, ordered_at, completed_at) VALUES (?, ?, ?)",
+            (
+                (i, started_at + i * 10_000, started_at + i * 10_000 + 300_000)
+                for i in range(1, orders + 1)
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO ordered_items (order_id, item_no, product_id) VALUES (?, ?, ?)",
+            (
+                (order_id, item_no, rng.randint(1, 5))
+                for order_id in range(1, orders + 1)
+                for item_no in range(rng.randint(1, 5))
+            ),
+        )
+
+
+async def _one_step_backup() -> None:
+    """The whole database in one step on the writer, as a baseline."""
+    target = sqlite3.connect("db/one-step.db", check_same_thread=False)
+    try:
+        async with database.raw_connection() as connection:
+            await connection.backup(target)
+    finally:
+        target.close()
+
+
+async def _latencies_during(backup: Backup | None) -> str:
+    session_key = await SessionStore.create()
+    latencies: list[float] = []
+    task = asyncio.create_task(backup() if backup else asyncio.sleep(1))
+    started_at = time.perf_counter()
+    while not task.done() or not latencies:
+        cart = await register.cart_dep(session_key)
+        if len(cart.items) >= 20:
+            await register.clear_session_items(session_key)
+            continue
+        t = time.perf_counter()
+        await register.add_session_item(session_key, 1)
+        latencies.append(time.perf_counter() - t)
+    secs = time.perf_counter() - started_at
+    await task
+
+    # The one step backup lets only a few through, once it is done
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    worst = latencies[-1] * 1000
+    return f"{secs:>7.2f}s {p50:>8.2f}ms {p99:>8.2f}ms {worst:>8.2f}ms"
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=200_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        (Path(tmpdir) / "db").mkdir()
+        (Path(tmpdir) / "static").symlink_to(STATIC_DIR)
+
+        startup_db, shutdown_db = startup_and_shutdown_db
+        await startup_db()
+        try:
+            _populate(args.orders)
+            # Most of the pages are still in the WAL, which the file size leaves out
+            with sqlite3.connect("db/app.db") as conn:
+                (size,) = conn.execute(
+                    "SELECT page_count * page_size"
+                    " FROM pragma_page_count(), pragma_page_size()"
+                ).fetchone()
+            print(f"{args.orders} orders, {size:,} bytes")
+            print(f"{'':>10} {'duration':>8} {'p50':>10} {'p99':>10} {'max':>10}")
+            cases: list[tuple[str, Backup | None]] = [
+                ("idle", None),
+                ("one step", _one_step_backup),
+                ("stepped", lambda: backup_databases(False)),
+                ("gzip", lambda: backup_databases(True)),
+            ]
+            for name, backup in cases:
+                print(f"{name:>10} {await _latencies_during(backup)}")
+        finally:
+            await shutdown_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+"""
+Measure how long the queries behind an order board refresh and a supply click
+take as the history of resolved orders grows, with and without the indexes.
+
+    uv run --frozen doit bench open_orders_refresh --history 10000 100000 1000000
+"""
+
+import argparse
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import sqlalchemy
+import sqlalchemy.sql.expression as sa_exp
+from sqlalchemy.sql.functions import func as sa_func
+
+from app.routers.orders import query_incoming, query_ordered_items_incoming
+from app.store import Base, OrderedItem
+
+ITEMS_PER_ORDER = 4
+PRODUCT_COUNT = 20
+
+# The `WHERE` clause of `supply_and_complete_order_if_done` without the update
+SUPPLY_COUNT_QUERY = (
+    sa_exp.select(
+        sa_func.count(OrderedItem.item_no) == sa_func.count(OrderedItem.supplied_at)
+    )
+    .where(OrderedItem.order_id == sa_exp.bindparam("order_id"))
+    .compile()
+)
+
+
+def _populate(path: Path, history_items: int, open_orders: int, indexes: bool) -> int:
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    if not indexes:
+        for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+        ).fetchall():
+            conn.execute(f"DROP INDEX {name}")
+
+    conn.executemany(
+        "INSERT INTO products (product_id, name, filename, price) VALUES (?, ?, ?, ?)",
+        [(pid, f"product {pid}", "no-image.png", 100) for pid in range(PRODUCT_COUNT)],
+    )
+
+    resolved_orders = history_items // ITEMS_PER_ORDER
+    order_count = resolved_orders + open_orders
+    conn.executemany(
+        """
+        INSERT INTO orders (order_id, ordered_at, completed_at)
+        VALUES (?, 1704067200000, ?)
+        """,
+        (
+            (oid, 1704067500000 if oid <= resolved_orders else None)
+            for oid in range(1, order_count + 1)
+        ),
+    )
+    rng = random.Random(0)
+    conn.executemany(
+        """
+        INSERT INTO ordered_items (order_id, item_no, product_id, supplied_at)
+        VALUES (?, ?, ?, ?)
+        """,
+        (
+            (
+                oid,
+                no,
+                rng.randrange(PRODUCT_COUNT),
+                1704067500000 if oid <= resolved_orders else None,
+            )
+            for oid in range(1, order_count + 1)
+            for no in range(ITEMS_PER_ORDER)
+        ),
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    return order_count
+
+
+def _time_ms(conn: sqlite3.Connection, query: str, params: dict, rounds: int) -> float:
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        conn.execute(query, params).fetchall()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--history", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--open-orders", type=int, default=30)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    queries = {
+        "incoming orders": (str(query_incoming.compile()), lambda _: {}),
+        "incoming items": (str(query_ordered_items_incoming.compile()), lambda _: {}),
+        "supply count": (str(SUPPLY_COUNT_QUERY), lambda last: {"order_id": last}),
+    }
+
+    print(
+        f"{args.open_orders} open orders, {ITEMS_PER_ORDER} items per order, "
+        f"median of {args.rounds} rounds"
+    )
+    print(f"{'history':>10} {'indexes':>8}" + "".join(f"{q:>18}" for q in queries))
+    for history_items in args.history:
+        for indexes in (False, True):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = Path(tmpdir) / "app.db"
+                last = _populate(path, history_items, args.open_orders, indexes)
+                conn = sqlite3.connect(path)
+                timings = [
+                    _time_ms(conn, query, params(last), args.rounds)
+                    for query, params in queries.values()
+                ]
+                conn.close()
+            cells = "".join(f"{ms:>16.2f}ms" for ms in timings)
+            print(f"{history_items:>10} {'yes' if indexes else 'no':>8}{cells}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Compare the CSV export of the orders with the columnar one in size, time to
+export and time to load into typed columns.
+
+    uv run --frozen doit bench order_export --orders 100000
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from array import array
+from datetime import datetime
+from pathlib import Path
+
+from app.routers.stat import export_order_columns, export_orders
+from app.store import columnar, startup_and_shutdown_db
+
+STATIC_DIR = Path(__file__).parents[1] / "static"
+
+
+def _populate(orders: int) -> None:
+    rng = random.Random(0)
+    started_at = int(time.time() * 1000) - orders * 10_000
+    with sqlite3.connect("db/app.db") as conn:
+        conn.executemany(
+            "INSERT INTO orders (order_id, ordered_at, completed_at) VALUES (?, ?, ?)",
+            (
+                (
+                    i,
+                    started_at + i * 10_000,
+                    started_at + i * 10_000 + rng.randint(60_000, 900_000),
+                )
+                for i in range(1, orders + 1)
+            ),
+        )
+        product_ids = [
+            row[0] for row in conn.execute("SELECT product_id FROM products")
+        ]
+        conn.executemany(
+            "INSERT INTO ordered_items (order_id, item_no, product_id) VALUES (?, ?, ?)",
+            (
+                (order_id, item_no, rng.choice(product_ids))
+                for order_id in range(1, orders + 1)
+                for item_no in range(rng.randint(1, 5))
+            ),
+        )
+
+
+async def _export(gzip: bool) -> tuple[bytes, float]:
+    started_at = time.perf_counter()
+    response = await export_orders(gzip)
+    chunks = [chunk async for chunk in response.body_iterator]  # type: ignore
+    return b"".join(chunks), time.perf_counter() - started_at  # type: ignore
+
+
+def _load_csv(data: bytes) -> float:
+    """Parse every column into typed arrays, as the columnar export has them."""
+    started_at = time.perf_counter()
+    ints = [array("i") for _ in range(3)]  # order_id, item_no, product_id
+    times = [array("q") for _ in range(2)]  # ordered_at, completed_at
+    names: list[str] = []
+    prices = array("i")
+    rows = csv.reader(io.StringIO(data.decode()))
+    next(rows)
+    for order_id, item_no, ordered_at, completed_at, product_id, name, price in rows:
+        ints[0].append(int(order_id))
+        ints[1].append(int(item_no))
+        ints[2].append(int(product_id))
+        times[0].append(int(datetime.fromisoformat(ordered_at).timestamp()))
+        completed = datetime.fromisoformat(completed_at) if completed_at else None
+        times[1].append(int(completed.timestamp()) if completed else 0)
+        names.append(name)
+        prices.append(int(price))
+    return time.perf_counter() - started_at
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        (Path(tmpdir) / "db").mkdir()
+        (Path(tmpdir) / "static").symlink_to(STATIC_DIR)
+
+        startup_db, shutdown_db = startup_and_shutdown_db
+        await startup_db()
+        try:
+            _populate(args.orders)
+            csv_data, csv_secs = await _export(False)
+            gz_data, gz_secs = await _export(True)
+            started_at = time.perf_counter()
+            path = Path((await export_order_columns()).path)
+            mcol_secs = time.perf_counter() - started_at
+        finally:
+            await shutdown_db()
+
+        csv_load_secs = _load_csv(csv_data)
+        started_at = time.perf_counter()
+        columns = columnar.load(path)
+        mcol_load_secs = time.perf_counter() - started_at
+        # Touch every item once, as an analysis would
+        started_at = time.perf_counter()
+        sum(columns.item_product_id)
+        mcol_scan_secs = time.perf_counter() - started_at
+
+        items = len(columns.item_order_id)
+        print(f"{len(columns.order_id)} orders, {items} items")
+        print(f"{'':>8} {'size':>12} {'export':>10} {'load':>10}")
+        print(
+            f"{'csv':>8} {len(csv_data):>12,} {csv_secs:>9.3f}s {csv_load_secs:>9.3f}s"
+        )
+        print(f"{'csv.gz':>8} {len(gz_data):>12,} {gz_secs:>9.3f}s")
+        print(
+            f"{'mcol':>8} {path.stat().st_size:>12,} {mcol_secs:>9.3f}s "
+            f"{mcol_load_secs:>9.3f}s  (+{mcol_scan_secs:.3f}s to scan the items)"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
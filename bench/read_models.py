@@ -0,0 +1,88 @@
+"""
+Compare loading the orders and their items as SQLAlchemy ORM instances, as the
+store used to, with the slotted rows that its read methods return now.
+
+    uv run --frozen doit bench read_models --orders 100000
+"""
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import sqlalchemy.sql.expression as sa_exp
+
+from app.store import (
+    Order,
+    OrderedItem,
+    OrderedItemTable,
+    OrderTable,
+    database,
+    startup_and_shutdown_db,
+)
+
+STATIC_DIR = Path(__file__).parents[1] / "static"
+
+
+def _populate(orders: int) -> None:
+    with sqlite3.connect("db/app.db") as conn:
+        conn.executemany(
+            "INSERT INTO orders (order_id, ordered_at, completed_at) "
+            "VALUES (?, 1704067200000, 1704067500123)",
+            ((i,) for i in range(1, orders + 1)),
+        )
+        conn.executemany(
+            "INSERT INTO ordered_items (order_id, item_no, product_id, supplied_at) "
+            "VALUES (?, 0, 1, 1704067440123)",
+            ((i,) for i in range(1, orders + 1)),
+        )
+
+
+async def _secs(fn: Callable[[], Awaitable[list]]) -> tuple[float, int]:
+    started_at = time.perf_counter()
+    rows = await fn()
+    return time.perf_counter() - started_at, len(rows)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        (Path(tmpdir) / "db").mkdir()
+        (Path(tmpdir) / "static").symlink_to(STATIC_DIR)
+
+        startup_db, shutdown_db = startup_and_shutdown_db
+        await startup_db()
+        try:
+            _populate(args.orders)
+
+            async def orders_orm():
+                query = sa_exp.select(Order)
+                return [Order(**m) async for m in database.iterate(query)]
+
+            async def items_orm():
+                query = sa_exp.select(OrderedItem)
+                return [OrderedItem(**m) async for m in database.iterate(query)]
+
+            cases = [
+                ("orders", orders_orm, OrderTable.select_all),
+                ("ordered_items", items_orm, OrderedItemTable.select_all),
+            ]
+            print(f"{'':>14} {'rows':>8} {'orm':>9} {'slotted':>9}")
+            for name, before, after in cases:
+                before_secs, count = await _secs(before)
+                after_secs, _ = await _secs(after)
+                print(f"{name:>14} {count:>8} {before_secs:>8.3f}s {after_secs:>8.3f}s")
+        finally:
+            await shutdown_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
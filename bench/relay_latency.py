@@ -0,0 +1,143 @@
+"""
+Measure how long a `ModifiedFlag` takes to wake up the SSE subscribers of every
+uvicorn worker when it is relayed through `app.relay.Relay`.
+
+    uv run --frozen doit bench relay_latency --workers 4 --subscribers 200
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import statistics
+import tempfile
+import time
+from multiprocessing.sharedctypes import Synchronized
+from multiprocessing.synchronize import Barrier
+from pathlib import Path
+
+from app.bc import Broadcaster
+from app.relay import Relay
+from app.store.order import ModifiedFlag
+
+
+def _worker(
+    idx: int,
+    args: argparse.Namespace,
+    sock: Path,
+    start_at: Synchronized,
+    sent_at: Synchronized,
+    barrier: Barrier,
+    results: "mp.Queue[tuple[list[int], list[int]]]",
+) -> None:
+    asyncio.run(_aworker(idx, args, sock, start_at, sent_at, barrier, results))
+
+
+async def _aworker(
+    idx: int,
+    args: argparse.Namespace,
+    sock: Path,
+    start_at: Synchronized,
+    sent_at: Synchronized,
+    barrier: Barrier,
+    results: "mp.Queue[tuple[list[int], list[int]]]",
+) -> None:
+    bc = Broadcaster(ModifiedFlag.ORIGINAL)
+    relay = Relay(bc, sock, encode=lambda f: f.value, decode=ModifiedFlag)
+    # Let the first worker become the hub, just like the first uvicorn worker
+    # to finish its startup would.
+    if idx == 0:
+        await relay.start()
+    barrier.wait()
+    if idx != 0:
+        await relay.start()
+
+    local: list[int] = []
+    remote: list[int] = []
+    origin = -1
+
+    async def subscriber():
+        async with bc.attach_receiver() as rx:
+            while True:
+                await rx.recv()
+                latency = time.monotonic_ns() - sent_at.value
+                (local if origin == idx else remote).append(latency)
+
+    subs_per_worker = args.subscribers // args.workers
+    tasks = [asyncio.create_task(subscriber()) for _ in range(subs_per_worker)]
+
+    if idx == 0:
+        start_at.value = time.monotonic() + 0.5
+    barrier.wait()
+
+    interval = args.interval_ms / 1000
+    for round in range(args.rounds):
+        await asyncio.sleep(start_at.value + round * interval - time.monotonic())
+        origin = round % args.workers
+        if origin == idx:
+            sent_at.value = time.monotonic_ns()
+            bc.send(ModifiedFlag.INCOMING)
+    await asyncio.sleep(interval)
+
+    for task in tasks:
+        task.cancel()
+    await relay.stop()
+    results.put((local, remote))
+
+
+def _summary(label: str, latencies_ns: list[int]) -> str:
+    if not latencies_ns:
+        return f"{label:>12}: no samples"
+    us = sorted(ns / 1000 for ns in latencies_ns)
+    q = statistics.quantiles(us, n=100)
+    return (
+        f"{label:>12}: n={len(us):>7}  p50={q[49]:8.1f}us  p90={q[89]:8.1f}us"
+        f"  p99={q[98]:8.1f}us  max={us[-1]:8.1f}us"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--subscribers", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=500)
+    parser.add_argument("--interval-ms", type=float, default=10)
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    start_at = ctx.Value("d", 0.0)
+    sent_at = ctx.Value("q", 0)
+    barrier = ctx.Barrier(args.workers)
+    results = ctx.Queue()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sock = Path(tmpdir) / "relay.sock"
+        procs = [
+            ctx.Process(
+                target=_worker,
+                args=(i, args, sock, start_at, sent_at, barrier, results),
+            )
+            for i in range(args.workers)
+        ]
+        for proc in procs:
+            proc.start()
+        local: list[int] = []
+        remote: list[int] = []
+        for _ in procs:
+            lo, re = results.get()
+            local += lo
+            remote += re
+        for proc in procs:
+            proc.join()
+
+    expected = args.rounds * (args.subscribers // args.workers) * args.workers
+    print(
+        f"{args.workers} workers, {args.subscribers} subscribers, "
+        f"{args.rounds} flags sent round-robin every {args.interval_ms}ms"
+    )
+    print(f"deliveries: {len(local) + len(remote)} / {expected}")
+    print(_summary("same worker", local))
+    print(_summary("cross worker", remote))
+
+
+if __name__ == "__main__":
+    main()
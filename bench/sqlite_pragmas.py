@@ -0,0 +1,171 @@
+"""
+Compare order placements under a concurrent order board read load with
+SQLite's default settings and with `app.env.SQLITE_PRAGMAS`. Each writer is a
+process placing orders through a `Writer` as the app does, and each reader a
+process of its own querying the incoming orders in a loop, so that they only
+contend for the database and not for an event loop or the GIL. The latency of
+each placement is reported along with the throughputs.
+
+    uv run --frozen doit bench sqlite_pragmas --writers 2 --readers 4 --duration 5
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import sqlite3
+import statistics
+import tempfile
+import time
+from multiprocessing.synchronize import Barrier
+from pathlib import Path
+from typing import Mapping
+
+import sqlalchemy
+
+from app.env import SQLITE_PRAGMAS
+from app.routers.orders import query_incoming
+from app.store import Base, Writer, connection_factory, order, ordered_item
+
+PROFILES: dict[str, Mapping[str, str]] = {
+    "default": {},
+    "tuned": SQLITE_PRAGMAS,
+}
+
+# (kind, placements or reads, errors, placement latencies in seconds)
+Result = tuple[str, int, int, list[float]]
+
+
+def _writer(
+    args: argparse.Namespace,
+    path: Path,
+    profile: str,
+    barrier: Barrier,
+    results: "mp.Queue[Result]",
+) -> None:
+    asyncio.run(_awriter(args, path, profile, barrier, results))
+
+
+async def _awriter(
+    args: argparse.Namespace,
+    path: Path,
+    profile: str,
+    barrier: Barrier,
+    results: "mp.Queue[Result]",
+) -> None:
+    db = Writer(f"sqlite:///{path}", factory=connection_factory(PROFILES[profile]))
+    await db.connect()
+    orders, ordered_items = order.Table(db), ordered_item.Table(db)
+
+    latencies: list[float] = []
+    errors = 0
+    barrier.wait()
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        started_at = time.perf_counter()
+        try:
+            async with db.transaction():
+                order_id = await orders._insert()
+                await ordered_items._issue(order_id, [1, 2, 3])
+        except sqlite3.OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started_at)
+    await db.disconnect()
+    results.put(("write", len(latencies), errors, latencies))
+
+
+def _reader(
+    args: argparse.Namespace,
+    path: Path,
+    profile: str,
+    barrier: Barrier,
+    results: "mp.Queue[Result]",
+) -> None:
+    factory = connection_factory(PROFILES[profile])
+    conn = sqlite3.connect(path, factory=factory, isolation_level=None)
+    query = str(query_incoming.compile())
+
+    reads = errors = 0
+    barrier.wait()
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        try:
+            conn.execute(query).fetchall()
+            reads += 1
+        except sqlite3.OperationalError:
+            errors += 1
+    conn.close()
+    results.put(("read", reads, errors, []))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5)
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    print(
+        f"{args.writers} writers and {args.readers} readers, "
+        f"{args.duration}s per profile"
+    )
+    print(
+        f"{'':>8} {'orders/s':>9} {'reads/s':>9} {'p50':>9} {'p99':>9} {'max':>9}"
+        f" {'errors':>7}"
+    )
+    for profile in PROFILES:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "app.db"
+            engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+            Base.metadata.create_all(engine)
+            with engine.begin() as conn:
+                conn.execute(
+                    sqlalchemy.text(
+                        "INSERT INTO products (product_id, name, filename, price) "
+                        "VALUES (1, 'a', 'a.png', 100), (2, 'b', 'b.png', 100), "
+                        "(3, 'c', 'c.png', 100)"
+                    )
+                )
+            engine.dispose()
+
+            barrier = ctx.Barrier(args.writers + args.readers)
+            results: "mp.Queue[Result]" = ctx.Queue()
+            targets = [_writer] * args.writers + [_reader] * args.readers
+            procs = [
+                ctx.Process(target=target, args=(args, path, profile, barrier, results))
+                for target in targets
+            ]
+            for proc in procs:
+                proc.start()
+            writes = reads = errors = 0
+            latencies: list[float] = []
+            for _ in procs:
+                kind, count, errs, lats = results.get()
+                if kind == "write":
+                    writes += count
+                    latencies += lats
+                else:
+                    reads += count
+                errors += errs
+            for proc in procs:
+                proc.join()
+
+        latencies.sort()
+        p50, p99, worst = (
+            (
+                statistics.median(latencies) * 1000,
+                latencies[int(len(latencies) * 0.99)] * 1000,
+                latencies[-1] * 1000,
+            )
+            if latencies
+            else (0.0, 0.0, 0.0)
+        )
+        print(
+            f"{profile:>8} {writes / args.duration:>9.1f} {reads / args.duration:>9.1f}"
+            f" {p50:>7.2f}ms {p99:>7.2f}ms {worst:>7.2f}ms {errors:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
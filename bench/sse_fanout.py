@@ -0,0 +1,144 @@
+"""
+Measure the CPU time spent on one change to the open orders against the number
+of tablets showing the incoming orders board, with every stream rendering the
+whole board for itself, as they used to, and with the one snapshot they share
+now, which sends the cards that have changed. Also shows the bytes sent to each
+tablet per change.
+
+    uv run --frozen doit bench sse_fanout --orders 40 --rounds 50
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from typing import AsyncIterable, Callable
+
+from datastar_py.sse import DatastarEvent
+from datastar_py.sse import ServerSentEventGenerator as SSE
+from fastapi import Request
+
+from app.main import app
+from app.routers import orders
+from app.store import (
+    EPOCH_MS_NOW,
+    OrderTable,
+    place_order,
+    startup_and_shutdown_db,
+)
+from app.store.order import ModifiedFlag
+
+STATIC_DIR = Path(__file__).parents[1] / "static"
+
+Stream = Callable[[Request], AsyncIterable[DatastarEvent]]
+
+
+async def _per_stream(_req: Request) -> AsyncIterable[DatastarEvent]:
+    """Every stream loads and renders the board itself on every change."""
+    incoming = await orders.load_incoming_orders()
+    yield SSE.patch_elements(orders.incoming_orders_component(incoming))
+    async with OrderTable.modified_flag_bc.attach_receiver() as flag_rx:
+        while True:
+            await flag_rx.recv()
+            incoming = await orders.load_incoming_orders()
+            yield SSE.patch_elements(orders.incoming_orders_component(incoming))
+
+
+def _toggle_supplied(order_id: int, product_id: int) -> None:
+    """
+    Supply or put back the items of a product in an order from another worker,
+    as far as this one knows, which changes one card on the board.
+    """
+    with sqlite3.connect("db/app.db") as conn:
+        conn.execute(
+            "UPDATE ordered_items SET supplied_at = CASE WHEN supplied_at IS NULL "
+            f"THEN {EPOCH_MS_NOW} END WHERE order_id = ? AND product_id = ?",
+            (order_id, product_id),
+        )
+
+
+async def _cost_per_event(
+    stream: Stream, subscribers: int, rounds: int, items: list[tuple[int, int]]
+) -> tuple[float, float]:
+    """The CPU time in milliseconds and the bytes sent to each stream."""
+    req = Request({"type": "http", "app": app, "headers": []})
+    received = 0
+    all_received = asyncio.Event()
+    sent_bytes = 0
+
+    async def subscriber():
+        nonlocal received, sent_bytes
+        async for event in stream(req):
+            sent_bytes += len(event.encode())
+            received += 1
+            if received == subscribers:
+                all_received.set()
+
+    async def wait_all():
+        await all_received.wait()
+        all_received.clear()
+        nonlocal received
+        received = 0
+
+    tasks = [asyncio.create_task(subscriber()) for _ in range(subscribers)]
+    await wait_all()  # The full board each stream starts with
+    sent_bytes = 0
+
+    rng = random.Random(0)
+    cpu_secs = 0.0
+    for _ in range(rounds):
+        _toggle_supplied(*rng.choice(items))
+        started_at = time.process_time()
+        OrderTable.modified_flag_bc.send(ModifiedFlag.SUPPLIED)
+        await wait_all()
+        cpu_secs += time.process_time() - started_at
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return cpu_secs / rounds * 1000, sent_bytes / subscribers / rounds
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[1, 10, 30, 100])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        (Path(tmpdir) / "db").mkdir()
+        (Path(tmpdir) / "static").symlink_to(STATIC_DIR)
+
+        startup_db, shutdown_db = startup_and_shutdown_db
+        await startup_db()
+        try:
+            rng = random.Random(0)
+            for _ in range(args.orders):
+                await place_order(rng.choices(range(1, 6), k=rng.randint(1, 5)))
+            with sqlite3.connect("db/app.db") as conn:
+                query = "SELECT DISTINCT order_id, product_id FROM ordered_items"
+                items = conn.execute(query).fetchall()
+
+            print(f"{args.orders} open orders, CPU time and bytes per event")
+            print(f"{'subscribers':>11} {'per stream':>21} {'shared':>21}")
+            for subscribers in args.subscribers:
+                (before, before_bytes), (after, after_bytes) = [
+                    await _cost_per_event(stream, subscribers, args.rounds, items)
+                    for stream in (_per_stream, orders._incoming_orders_stream)
+                ]
+                print(
+                    f"{subscribers:>11} {before:>10.2f}ms {before_bytes:>8.0f}B"
+                    f" {after:>10.2f}ms {after_bytes:>8.0f}B"
+                )
+        finally:
+            await shutdown_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
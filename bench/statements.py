@@ -0,0 +1,98 @@
+"""
+Compare the per-call cost of the hot statements when run through `databases`
+with a SQLAlchemy expression built on every call, as they used to be, and as
+precompiled `app.store.statements.Statement`s.
+
+    uv run --frozen doit bench statements --calls 5000
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import sqlalchemy.sql.expression as sa_exp
+
+from app.routers import orders
+from app.store import (
+    Order,
+    OrderTable,
+    cancel_order,
+    database,
+    epoch_ms,
+    place_order,
+    read_pool,
+    startup_and_shutdown_db,
+)
+
+STATIC_DIR = Path(__file__).parents[1] / "static"
+
+
+async def _per_call_usecs(calls: int, fn: Callable[[], Awaitable[object]]) -> float:
+    await fn()
+    started_at = time.perf_counter()
+    for _ in range(calls):
+        await fn()
+    return (time.perf_counter() - started_at) / calls * 1e6
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        (Path(tmpdir) / "db").mkdir()
+        (Path(tmpdir) / "static").symlink_to(STATIC_DIR)
+
+        startup_db, shutdown_db = startup_and_shutdown_db
+        await startup_db()
+        try:
+            for _ in range(100):
+                await place_order([1, 2, 3])
+            await cancel_order(50)
+
+            async def by_order_id_expression():
+                query = sa_exp.select(Order).where(Order.order_id == 50)
+                record = await database.fetch_one(query)
+                return Order(**record._mapping)  # type: ignore
+
+            async def cancel_expression():
+                query = sa_exp.update(Order).where(Order.order_id == 50)
+                values = {"canceled_at": epoch_ms()}
+                await database.execute(query, values | {"completed_at": None})
+
+            async def one_resolved_expression():
+                query = orders.query_resolved.where(Order.order_id == 50)
+                return await read_pool.fetch_all(query)
+
+            cases = [
+                (
+                    "by_order_id",
+                    by_order_id_expression,
+                    lambda: OrderTable.by_order_id(50),
+                ),
+                ("cancel", cancel_expression, lambda: OrderTable._cancel(50)),
+                (
+                    "one_resolved",
+                    one_resolved_expression,
+                    lambda: orders._ONE_RESOLVED_ORDER.fetch_all(
+                        read_pool, order_id=50
+                    ),
+                ),
+            ]
+            print(f"{'':>14} {'expression':>12} {'statement':>12}")
+            for name, before, after in cases:
+                before_usecs = await _per_call_usecs(args.calls, before)
+                after_usecs = await _per_call_usecs(args.calls, after)
+                print(f"{name:>14} {before_usecs:>10.1f}us {after_usecs:>10.1f}us")
+        finally:
+            await shutdown_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
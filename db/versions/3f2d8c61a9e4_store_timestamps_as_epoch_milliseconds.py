@@ -0,0 +1,230 @@
+"""Store the order timestamps as INTEGER milliseconds since the unix epoch
+
+Revision ID: 3f2d8c61a9e4
+Revises: 9e3f6a1b7c52
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f2d8c61a9e4"
+down_revision: Union[str, None] = "9e3f6a1b7c52"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same as `app.store.base.EPOCH_MS_NOW` at this revision
+EPOCH_MS_NOW = "CAST(round((julianday('now') - 2440587.5) * 86400000) AS INTEGER)"
+
+COLUMNS = {
+    "orders": ("ordered_at", "canceled_at", "completed_at"),
+    "ordered_items": ("supplied_at",),
+}
+
+VERSIONED_TABLES = ("orders", "ordered_items")
+VERSION_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS table_versions_{table}_{event}
+    AFTER {event} ON {table}
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+    END
+    """
+
+# Same as `app.store.sales_rollup.TRIGGERS` at this revision
+SALES_ROLLUP_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_rollups_item_insert
+    AFTER INSERT ON ordered_items
+    BEGIN
+        INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+        SELECT
+            date(ordered_at / 1000, 'unixepoch', 'localtime'),
+            NEW.product_id,
+            1,
+            coalesce((SELECT price FROM products WHERE product_id = NEW.product_id), 0)
+        FROM orders WHERE order_id = NEW.order_id AND canceled_at IS NULL
+        ON CONFLICT (business_day, product_id) DO UPDATE SET
+            count = count + excluded.count, revenue = revenue + excluded.revenue;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_rollups_item_delete
+    AFTER DELETE ON ordered_items
+    BEGIN
+        INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+        SELECT
+            date(ordered_at / 1000, 'unixepoch', 'localtime'),
+            OLD.product_id,
+            -1,
+            -coalesce((SELECT price FROM products WHERE product_id = OLD.product_id), 0)
+        FROM orders WHERE order_id = OLD.order_id AND canceled_at IS NULL
+        ON CONFLICT (business_day, product_id) DO UPDATE SET
+            count = count + excluded.count, revenue = revenue + excluded.revenue;
+        DELETE FROM sales_rollups WHERE product_id = OLD.product_id AND count <= 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_rollups_order_cancel
+    AFTER UPDATE OF canceled_at ON orders
+    WHEN (OLD.canceled_at IS NULL) != (NEW.canceled_at IS NULL)
+    BEGIN
+        INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+        SELECT
+            date(NEW.ordered_at / 1000, 'unixepoch', 'localtime'),
+            ordered_items.product_id,
+            iif(NEW.canceled_at IS NULL, 1, -1) * count(*),
+            iif(NEW.canceled_at IS NULL, 1, -1) * coalesce(sum(products.price), 0)
+        FROM ordered_items
+        LEFT JOIN products ON products.product_id = ordered_items.product_id
+        WHERE ordered_items.order_id = NEW.order_id
+        GROUP BY ordered_items.product_id
+        ON CONFLICT (business_day, product_id) DO UPDATE SET
+            count = count + excluded.count, revenue = revenue + excluded.revenue;
+        DELETE FROM sales_rollups
+        WHERE business_day = date(NEW.ordered_at / 1000, 'unixepoch', 'localtime')
+            AND count <= 0;
+    END
+    """,
+)
+SALES_ROLLUP_TRIGGER_NAMES = (
+    "sales_rollups_item_insert",
+    "sales_rollups_item_delete",
+    "sales_rollups_order_cancel",
+)
+
+
+def _drop_triggers() -> None:
+    # SQLite refuses to rename the tables recreated by `batch_alter_table` while
+    # triggers refer to them, so they are all put back afterwards.
+    for name in SALES_ROLLUP_TRIGGER_NAMES:
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    for table in VERSIONED_TABLES:
+        for event in ("insert", "update", "delete"):
+            op.execute(f"DROP TRIGGER IF EXISTS table_versions_{table}_{event}")
+
+
+def _create_version_triggers() -> None:
+    for table in VERSIONED_TABLES:
+        for event in ("insert", "update", "delete"):
+            op.execute(VERSION_TRIGGER.format(table=table, event=event))
+
+
+def _drop_partial_indexes() -> None:
+    # Recreated by hand rather than relying on `batch_alter_table` to reflect
+    # their WHERE clauses
+    op.drop_index("ix_orders_open", table_name="orders")
+    op.drop_index("ix_ordered_items_unsupplied", table_name="ordered_items")
+
+
+def _create_partial_indexes() -> None:
+    op.create_index(
+        "ix_orders_open",
+        "orders",
+        ["order_id"],
+        sqlite_where=sa.text("canceled_at IS NULL AND completed_at IS NULL"),
+    )
+    op.create_index(
+        "ix_ordered_items_unsupplied",
+        "ordered_items",
+        ["product_id", "order_id"],
+        sqlite_where=sa.text("supplied_at IS NULL"),
+    )
+
+
+def upgrade() -> None:
+    _drop_triggers()
+    _drop_partial_indexes()
+
+    # Text in UTC such as '2024-01-01 12:34:56.789012' to epoch milliseconds
+    for table, columns in COLUMNS.items():
+        assignments = ", ".join(
+            f"{column} = CAST(round((julianday({column}) - 2440587.5) * 86400000) "
+            "AS INTEGER)"
+            for column in columns
+        )
+        op.execute(f"UPDATE {table} SET {assignments}")
+
+    with op.batch_alter_table("orders") as batch_op:
+        batch_op.alter_column(
+            "ordered_at",
+            existing_type=sa.DateTime(),
+            type_=sa.Integer(),
+            existing_nullable=False,
+            server_default=sa.text(f"({EPOCH_MS_NOW})"),
+        )
+        for column in ("canceled_at", "completed_at"):
+            batch_op.alter_column(
+                column,
+                existing_type=sa.DateTime(timezone=True),
+                type_=sa.Integer(),
+                existing_nullable=True,
+            )
+    with op.batch_alter_table("ordered_items") as batch_op:
+        batch_op.alter_column(
+            "supplied_at",
+            existing_type=sa.DateTime(timezone=True),
+            type_=sa.Integer(),
+            existing_nullable=True,
+        )
+
+    _create_partial_indexes()
+    op.create_index(op.f("ix_orders_completed_at"), "orders", ["completed_at"])
+    _create_version_triggers()
+    for trigger in SALES_ROLLUP_TRIGGERS:
+        op.execute(trigger)
+
+
+def downgrade() -> None:
+    _drop_triggers()
+    op.drop_index(op.f("ix_orders_completed_at"), table_name="orders")
+    _drop_partial_indexes()
+
+    with op.batch_alter_table("ordered_items") as batch_op:
+        batch_op.alter_column(
+            "supplied_at",
+            existing_type=sa.Integer(),
+            type_=sa.DateTime(timezone=True),
+            existing_nullable=True,
+        )
+    with op.batch_alter_table("orders") as batch_op:
+        for column in ("completed_at", "canceled_at"):
+            batch_op.alter_column(
+                column,
+                existing_type=sa.Integer(),
+                type_=sa.DateTime(timezone=True),
+                existing_nullable=True,
+            )
+        batch_op.alter_column(
+            "ordered_at",
+            existing_type=sa.Integer(),
+            type_=sa.DateTime(),
+            existing_nullable=False,
+            server_default=sa.text("CURRENT_TIMESTAMP"),
+        )
+
+    # In the format SQLAlchemy writes datetimes in, with microseconds
+    for table, columns in COLUMNS.items():
+        assignments = ", ".join(
+            f"{column} = strftime('%Y-%m-%d %H:%M:%S', {column} / 1000, 'unixepoch') "
+            f"|| printf('.%06d', {column} % 1000 * 1000)"
+            for column in columns
+        )
+        op.execute(f"UPDATE {table} SET {assignments}")
+
+    _create_partial_indexes()
+    _create_version_triggers()
+    # The business days of `app.store.sales_rollup.TRIGGERS` before this revision
+    for trigger in SALES_ROLLUP_TRIGGERS:
+        op.execute(
+            trigger.replace(
+                "date(ordered_at / 1000, 'unixepoch', 'localtime')",
+                "date(ordered_at, 'localtime')",
+            ).replace(
+                "date(NEW.ordered_at / 1000, 'unixepoch', 'localtime')",
+                "date(NEW.ordered_at, 'localtime')",
+            )
+        )
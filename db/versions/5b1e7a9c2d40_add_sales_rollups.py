@@ -0,0 +1,117 @@
+"""Add sales_rollups table maintained by triggers for the statistics page
+
+Revision ID: 5b1e7a9c2d40
+Revises: 8c8415e43f14
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5b1e7a9c2d40"
+down_revision: Union[str, None] = "8c8415e43f14"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Same as `app.store.sales_rollup.TRIGGERS` at this revision
+TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_rollups_item_insert
+    AFTER INSERT ON ordered_items
+    BEGIN
+        INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+        SELECT
+            date(ordered_at, 'localtime'),
+            NEW.product_id,
+            1,
+            coalesce((SELECT price FROM products WHERE product_id = NEW.product_id), 0)
+        FROM orders WHERE order_id = NEW.order_id AND canceled_at IS NULL
+        ON CONFLICT (business_day, product_id) DO UPDATE SET
+            count = count + excluded.count, revenue = revenue + excluded.revenue;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_rollups_item_delete
+    AFTER DELETE ON ordered_items
+    BEGIN
+        INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+        SELECT
+            date(ordered_at, 'localtime'),
+            OLD.product_id,
+            -1,
+            -coalesce((SELECT price FROM products WHERE product_id = OLD.product_id), 0)
+        FROM orders WHERE order_id = OLD.order_id AND canceled_at IS NULL
+        ON CONFLICT (business_day, product_id) DO UPDATE SET
+            count = count + excluded.count, revenue = revenue + excluded.revenue;
+        DELETE FROM sales_rollups WHERE product_id = OLD.product_id AND count <= 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_rollups_order_cancel
+    AFTER UPDATE OF canceled_at ON orders
+    WHEN (OLD.canceled_at IS NULL) != (NEW.canceled_at IS NULL)
+    BEGIN
+        INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+        SELECT
+            date(NEW.ordered_at, 'localtime'),
+            ordered_items.product_id,
+            iif(NEW.canceled_at IS NULL, 1, -1) * count(*),
+            iif(NEW.canceled_at IS NULL, 1, -1) * coalesce(sum(products.price), 0)
+        FROM ordered_items
+        LEFT JOIN products ON products.product_id = ordered_items.product_id
+        WHERE ordered_items.order_id = NEW.order_id
+        GROUP BY ordered_items.product_id
+        ON CONFLICT (business_day, product_id) DO UPDATE SET
+            count = count + excluded.count, revenue = revenue + excluded.revenue;
+        DELETE FROM sales_rollups
+        WHERE business_day = date(NEW.ordered_at, 'localtime') AND count <= 0;
+    END
+    """,
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sales_rollups",
+        sa.Column("business_day", sa.Date(), nullable=False),
+        sa.Column("product_id", sa.Integer(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("revenue", sa.Integer(), nullable=False),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_sales_rollups")),
+        sa.UniqueConstraint(
+            "business_day",
+            "product_id",
+            name=op.f("uq_sales_rollups_business_day"),
+        ),
+    )
+    for trigger in TRIGGERS:
+        op.execute(trigger)
+    # Count the orders placed so far at the current prices
+    op.execute(
+        """
+        INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+        SELECT
+            date(orders.ordered_at, 'localtime'),
+            ordered_items.product_id,
+            count(*),
+            coalesce(sum(products.price), 0)
+        FROM ordered_items
+        JOIN orders ON orders.order_id = ordered_items.order_id
+        LEFT JOIN products ON products.product_id = ordered_items.product_id
+        WHERE orders.canceled_at IS NULL
+        GROUP BY 1, 2
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS sales_rollups_order_cancel")
+    op.execute("DROP TRIGGER IF EXISTS sales_rollups_item_delete")
+    op.execute("DROP TRIGGER IF EXISTS sales_rollups_item_insert")
+    op.drop_table("sales_rollups")
@@ -0,0 +1,40 @@
+"""Add indexes for paging through and filtering the resolved orders
+
+Revision ID: 6a4c0e9d2b18
+Revises: 3f2d8c61a9e4
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "6a4c0e9d2b18"
+down_revision: Union[str, None] = "3f2d8c61a9e4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_orders_resolved",
+        "orders",
+        ["order_id"],
+        sqlite_where=sa.text("canceled_at IS NOT NULL OR completed_at IS NOT NULL"),
+    )
+    op.create_index(
+        "ix_orders_canceled",
+        "orders",
+        ["order_id"],
+        sqlite_where=sa.text("canceled_at IS NOT NULL"),
+    )
+    op.create_index(op.f("ix_orders_ordered_at"), "orders", ["ordered_at"])
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_orders_ordered_at"), table_name="orders")
+    op.drop_index("ix_orders_canceled", table_name="orders")
+    op.drop_index("ix_orders_resolved", table_name="orders")
@@ -0,0 +1,46 @@
+"""Add indexes for looking up open orders and unsupplied items
+
+Revision ID: 8c8415e43f14
+Revises: d2dfdcd3480d
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8c8415e43f14"
+down_revision: Union[str, None] = "d2dfdcd3480d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(op.f("ix_orders_order_id"), "orders", ["order_id"])
+    op.create_index(
+        "ix_orders_open",
+        "orders",
+        ["order_id"],
+        sqlite_where=sa.text("canceled_at IS NULL AND completed_at IS NULL"),
+    )
+    op.create_index(
+        "ix_ordered_items_order_id_product_id",
+        "ordered_items",
+        ["order_id", "product_id"],
+    )
+    op.create_index(
+        "ix_ordered_items_unsupplied",
+        "ordered_items",
+        ["product_id", "order_id"],
+        sqlite_where=sa.text("supplied_at IS NULL"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ordered_items_unsupplied", table_name="ordered_items")
+    op.drop_index("ix_ordered_items_order_id_product_id", table_name="ordered_items")
+    op.drop_index("ix_orders_open", table_name="orders")
+    op.drop_index(op.f("ix_orders_order_id"), table_name="orders")
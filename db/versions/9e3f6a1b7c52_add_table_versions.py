@@ -0,0 +1,111 @@
+"""Add table_versions table bumped by triggers on every change
+
+Revision ID: 9e3f6a1b7c52
+Revises: 5b1e7a9c2d40
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9e3f6a1b7c52"
+down_revision: Union[str, None] = "5b1e7a9c2d40"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("orders", "ordered_items", "products")
+
+# Same as `app.store.table_version.TRIGGERS` at this revision
+TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS table_versions_orders_insert
+    AFTER INSERT ON orders
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = 'orders';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS table_versions_orders_update
+    AFTER UPDATE ON orders
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = 'orders';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS table_versions_orders_delete
+    AFTER DELETE ON orders
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = 'orders';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS table_versions_ordered_items_insert
+    AFTER INSERT ON ordered_items
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = 'ordered_items';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS table_versions_ordered_items_update
+    AFTER UPDATE ON ordered_items
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = 'ordered_items';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS table_versions_ordered_items_delete
+    AFTER DELETE ON ordered_items
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = 'ordered_items';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS table_versions_products_insert
+    AFTER INSERT ON products
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = 'products';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS table_versions_products_update
+    AFTER UPDATE ON products
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = 'products';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS table_versions_products_delete
+    AFTER DELETE ON products
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = 'products';
+    END
+    """,
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        "table_versions",
+        sa.Column("name", sa.String(length=40), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_table_versions")),
+        sa.UniqueConstraint("name", name=op.f("uq_table_versions_name")),
+    )
+    op.execute(
+        "INSERT INTO table_versions (name, version) "
+        "VALUES ('orders', 0), ('ordered_items', 0), ('products', 0)"
+    )
+    for trigger in TRIGGERS:
+        op.execute(trigger)
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        for event in ("insert", "update", "delete"):
+            op.execute(f"DROP TRIGGER IF EXISTS table_versions_{table}_{event}")
+    op.drop_table("table_versions")
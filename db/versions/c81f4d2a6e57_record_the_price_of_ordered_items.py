@@ -0,0 +1,168 @@
+"""Record the price of each ordered item for the sales rollups
+
+Revision ID: c81f4d2a6e57
+Revises: 6a4c0e9d2b18
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c81f4d2a6e57"
+down_revision: Union[str, None] = "6a4c0e9d2b18"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Same as `app.store.sales_rollup.TRIGGERS` at this revision
+TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_rollups_item_insert
+    AFTER INSERT ON ordered_items
+    BEGIN
+        UPDATE ordered_items
+        SET price = (SELECT price FROM products WHERE product_id = NEW.product_id)
+        WHERE id = NEW.id AND price IS NULL;
+        INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+        SELECT
+            date(ordered_at / 1000, 'unixepoch', 'localtime'),
+            NEW.product_id,
+            1,
+            coalesce((SELECT price FROM ordered_items WHERE id = NEW.id), 0)
+        FROM orders WHERE order_id = NEW.order_id AND canceled_at IS NULL
+        ON CONFLICT (business_day, product_id) DO UPDATE SET
+            count = count + excluded.count, revenue = revenue + excluded.revenue;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_rollups_item_delete
+    AFTER DELETE ON ordered_items
+    BEGIN
+        INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+        SELECT
+            date(ordered_at / 1000, 'unixepoch', 'localtime'),
+            OLD.product_id,
+            -1,
+            -coalesce(
+                OLD.price,
+                (SELECT price FROM products WHERE product_id = OLD.product_id),
+                0
+            )
+        FROM orders WHERE order_id = OLD.order_id AND canceled_at IS NULL
+        ON CONFLICT (business_day, product_id) DO UPDATE SET
+            count = count + excluded.count, revenue = revenue + excluded.revenue;
+        DELETE FROM sales_rollups WHERE product_id = OLD.product_id AND count <= 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_rollups_order_cancel
+    AFTER UPDATE OF canceled_at ON orders
+    WHEN (OLD.canceled_at IS NULL) != (NEW.canceled_at IS NULL)
+    BEGIN
+        INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+        SELECT
+            date(NEW.ordered_at / 1000, 'unixepoch', 'localtime'),
+            ordered_items.product_id,
+            iif(NEW.canceled_at IS NULL, 1, -1) * count(*),
+            iif(NEW.canceled_at IS NULL, 1, -1)
+                * coalesce(sum(coalesce(ordered_items.price, products.price)), 0)
+        FROM ordered_items
+        LEFT JOIN products ON products.product_id = ordered_items.product_id
+        WHERE ordered_items.order_id = NEW.order_id
+        GROUP BY ordered_items.product_id
+        ON CONFLICT (business_day, product_id) DO UPDATE SET
+            count = count + excluded.count, revenue = revenue + excluded.revenue;
+        DELETE FROM sales_rollups
+        WHERE business_day = date(NEW.ordered_at / 1000, 'unixepoch', 'localtime')
+            AND count <= 0;
+    END
+    """,
+)
+
+# Before this revision
+PREVIOUS_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_rollups_item_insert
+    AFTER INSERT ON ordered_items
+    BEGIN
+        INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+        SELECT
+            date(ordered_at / 1000, 'unixepoch', 'localtime'),
+            NEW.product_id,
+            1,
+            coalesce((SELECT price FROM products WHERE product_id = NEW.product_id), 0)
+        FROM orders WHERE order_id = NEW.order_id AND canceled_at IS NULL
+        ON CONFLICT (business_day, product_id) DO UPDATE SET
+            count = count + excluded.count, revenue = revenue + excluded.revenue;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_rollups_item_delete
+    AFTER DELETE ON ordered_items
+    BEGIN
+        INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+        SELECT
+            date(ordered_at / 1000, 'unixepoch', 'localtime'),
+            OLD.product_id,
+            -1,
+            -coalesce((SELECT price FROM products WHERE product_id = OLD.product_id), 0)
+        FROM orders WHERE order_id = OLD.order_id AND canceled_at IS NULL
+        ON CONFLICT (business_day, product_id) DO UPDATE SET
+            count = count + excluded.count, revenue = revenue + excluded.revenue;
+        DELETE FROM sales_rollups WHERE product_id = OLD.product_id AND count <= 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_rollups_order_cancel
+    AFTER UPDATE OF canceled_at ON orders
+    WHEN (OLD.canceled_at IS NULL) != (NEW.canceled_at IS NULL)
+    BEGIN
+        INSERT INTO sales_rollups (business_day, product_id, count, revenue)
+        SELECT
+            date(NEW.ordered_at / 1000, 'unixepoch', 'localtime'),
+            ordered_items.product_id,
+            iif(NEW.canceled_at IS NULL, 1, -1) * count(*),
+            iif(NEW.canceled_at IS NULL, 1, -1) * coalesce(sum(products.price), 0)
+        FROM ordered_items
+        LEFT JOIN products ON products.product_id = ordered_items.product_id
+        WHERE ordered_items.order_id = NEW.order_id
+        GROUP BY ordered_items.product_id
+        ON CONFLICT (business_day, product_id) DO UPDATE SET
+            count = count + excluded.count, revenue = revenue + excluded.revenue;
+        DELETE FROM sales_rollups
+        WHERE business_day = date(NEW.ordered_at / 1000, 'unixepoch', 'localtime')
+            AND count <= 0;
+    END
+    """,
+)
+TRIGGER_NAMES = (
+    "sales_rollups_item_insert",
+    "sales_rollups_item_delete",
+    "sales_rollups_order_cancel",
+)
+
+
+def _drop_triggers() -> None:
+    for name in TRIGGER_NAMES:
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def upgrade() -> None:
+    # The items ordered so far are left without a price, and keep being valued
+    # at the current price, since the one they were counted at is unknown.
+    op.add_column("ordered_items", sa.Column("price", sa.Integer(), nullable=True))
+    _drop_triggers()
+    for trigger in TRIGGERS:
+        op.execute(trigger)
+
+
+def downgrade() -> None:
+    # SQLite does not drop a column that triggers refer to
+    _drop_triggers()
+    op.drop_column("ordered_items", "price")
+    for trigger in PREVIOUS_TRIGGERS:
+        op.execute(trigger)
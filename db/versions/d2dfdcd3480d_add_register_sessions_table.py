@@ -0,0 +1,41 @@
+"""Add register_sessions table to share carts between workers
+
+Revision ID: d2dfdcd3480d
+Revises: b260a0b3e3c6
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d2dfdcd3480d"
+down_revision: Union[str, None] = "b260a0b3e3c6"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "register_sessions",
+        sa.Column("session_key", sa.Uuid(), nullable=False),
+        sa.Column("cart", sa.LargeBinary(), nullable=False),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=False,
+        ),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_register_sessions")),
+        sa.UniqueConstraint(
+            "session_key", name=op.f("uq_register_sessions_session_key")
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("register_sessions")
@@ -0,0 +1,31 @@
+"""Drop the index for canceled orders, which ties with the one for resolved orders
+
+Revision ID: e5a9b3c7d104
+Revises: c81f4d2a6e57
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e5a9b3c7d104"
+down_revision: Union[str, None] = "c81f4d2a6e57"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.drop_index("ix_orders_canceled", table_name="orders", if_exists=True)
+
+
+def downgrade() -> None:
+    op.create_index(
+        "ix_orders_canceled",
+        "orders",
+        ["order_id"],
+        sqlite_where=sa.text("canceled_at IS NOT NULL"),
+    )
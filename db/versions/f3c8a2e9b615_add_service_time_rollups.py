@@ -0,0 +1,89 @@
+"""Add service_time_rollups table maintained by triggers for the statistics page
+
+Revision ID: f3c8a2e9b615
+Revises: e5a9b3c7d104
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f3c8a2e9b615"
+down_revision: Union[str, None] = "e5a9b3c7d104"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Same as the service time triggers of `app.store.sales_rollup.TRIGGERS` at this
+# revision
+TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS service_time_rollups_order_insert
+    AFTER INSERT ON orders
+    WHEN NEW.completed_at IS NOT NULL
+    BEGIN
+        INSERT INTO service_time_rollups (business_day, count, total_ms)
+        VALUES (
+            date(NEW.ordered_at / 1000, 'unixepoch', 'localtime'),
+            1,
+            NEW.completed_at - NEW.ordered_at
+        )
+        ON CONFLICT (business_day) DO UPDATE SET
+            count = count + excluded.count, total_ms = total_ms + excluded.total_ms;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS service_time_rollups_order_update
+    AFTER UPDATE OF ordered_at, completed_at ON orders
+    WHEN OLD.completed_at IS NOT NEW.completed_at OR OLD.ordered_at != NEW.ordered_at
+    BEGIN
+        INSERT INTO service_time_rollups (business_day, count, total_ms)
+        SELECT
+            date(OLD.ordered_at / 1000, 'unixepoch', 'localtime'),
+            -1,
+            OLD.ordered_at - OLD.completed_at
+        WHERE OLD.completed_at IS NOT NULL
+        ON CONFLICT (business_day) DO UPDATE SET
+            count = count + excluded.count, total_ms = total_ms + excluded.total_ms;
+        INSERT INTO service_time_rollups (business_day, count, total_ms)
+        SELECT
+            date(NEW.ordered_at / 1000, 'unixepoch', 'localtime'),
+            1,
+            NEW.completed_at - NEW.ordered_at
+        WHERE NEW.completed_at IS NOT NULL
+        ON CONFLICT (business_day) DO UPDATE SET
+            count = count + excluded.count, total_ms = total_ms + excluded.total_ms;
+        DELETE FROM service_time_rollups
+        WHERE business_day = date(OLD.ordered_at / 1000, 'unixepoch', 'localtime')
+            AND count <= 0;
+    END
+    """,
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        "service_time_rollups",
+        sa.Column("business_day", sa.Date(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("total_ms", sa.Integer(), nullable=False),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_service_time_rollups")),
+        sa.UniqueConstraint(
+            "business_day", name=op.f("uq_service_time_rollups_business_day")
+        ),
+    )
+    for trigger in TRIGGERS:
+        op.execute(trigger)
+    # The completed orders so far are counted on the next startup, which can
+    # read the archive as well. See `app.store.sales_rollup.Table.ainit`.
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS service_time_rollups_order_update")
+    op.execute("DROP TRIGGER IF EXISTS service_time_rollups_order_insert")
+    op.drop_table("service_time_rollups")
@@ -95,6 +95,65 @@ def task_test() -> Generator[TaskDict]:
     yield {"basename": "t", "actions": actions}
 
 
+def task_rebuild_sales_rollups() -> TaskDict:
+    """Recount the sales figures of `/stat` from the orders in `db/app.db`."""
+
+    def rebuild() -> None:
+        import asyncio
+
+        from app.store import rebuild_sales_rollups
+
+        asyncio.run(rebuild_sales_rollups())
+
+    return {"basename": "rebuild-sales-rollups", "actions": [rebuild]}
+
+
+def task_archive_orders() -> TaskDict:
+    """Move the orders resolved long ago from `db/app.db` to `db/archive.db`."""
+
+    def archive() -> None:
+        import asyncio
+
+        from app.store import archive_orders
+
+        print(f"archived {asyncio.run(archive_orders())} orders")
+
+    return {"basename": "archive-orders", "actions": [archive]}
+
+
+def task_backup() -> TaskDict:
+    """Back up `db/app.db` and `db/archive.db`, even while the server is running."""
+
+    def backup(gzip: bool) -> None:
+        import asyncio
+
+        from app.store import backup_databases
+
+        print(asyncio.run(backup_databases(gzip)).path)
+
+    return {
+        "basename": "backup",
+        "actions": [backup],
+        "params": [{"name": "gzip", "long": "gzip", "type": bool, "default": False}],
+    }
+
+
+def task_export_orders() -> TaskDict:
+    """Export the orders in `db/app.db` as columns, e.g. `doit export-orders a.mcol`."""
+
+    def export(path: list[str]) -> TaskFailed | None:
+        import asyncio
+        from pathlib import Path
+
+        from app.store import export_order_columns
+
+        if len(path) != 1:
+            return TaskFailed("specify a single output path")
+        asyncio.run(export_order_columns(Path(path[0])))
+
+    return {"basename": "export-orders", "actions": [export], "pos_arg": "path"}
+
+
 def task_snapshot_review() -> Generator[TaskDict]:
     """Review inline snapshot tests."""
 
@@ -106,3 +165,17 @@ def task_snapshot_review() -> Generator[TaskDict]:
 
     yield {"basename": "snapshot-review", "actions": [cmd], "pos_arg": "files_or_dirs"}
     yield {"basename": "sr", "actions": [cmd], "pos_arg": "files_or_dirs"}
+
+
+def task_bench() -> Generator[TaskDict]:
+    """Run a benchmark script in `bench/`, e.g. `doit bench relay_latency`."""
+
+    def cmd(args: list[str]) -> TaskFailed | None:
+        if not args:
+            return TaskFailed("specify a benchmark name")
+        name, *rest = args
+        action = [*UV_RUN, "python", "-m", f"bench.{name}", *rest]
+        return Interactive(action, shell=False).execute()
+
+    yield {"basename": "bench", "actions": [cmd], "pos_arg": "args"}
+    yield {"basename": "b", "actions": [cmd], "pos_arg": "args"}
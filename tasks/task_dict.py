@@ -19,7 +19,7 @@ type Action = (
 class ParamBase(TypedDict):
     name: str
     """variable name"""
-    default: str
+    default: str | bool | int
     """default value (from its type)"""
 
 